@@ -0,0 +1,143 @@
+import os
+import time
+import threading
+import collections
+import contextlib
+
+import phylib
+
+################################################################################
+# Metrics settings, from the environment so pool workers share them
+ENABLED = os.environ.get("POOL_METRICS", "1") != "0" # POOL_METRICS=0 turns every counter and timer off
+LOG     = os.environ.get("POOL_METRICS_LOG", "0") != "0" # POOL_METRICS_LOG=1 prints the breakdown of each shot
+PREFIX  = "pool"
+
+# Counters of phylib_count_segment (see phylib.i) are only kept when enabled
+phylib.cvar.phylib_counting = 1 if ENABLED else 0
+
+
+class Timer():
+    """
+    Context manager that adds the time spent in its block to a stage of
+    metrics.
+    """
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.time(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+NO_TIMER = contextlib.nullcontext() # Timer used while disabled
+
+
+class Metrics():
+    """
+    Counters and stage timers of one process (see process_metrics) or of
+    one request.
+    Counters are keyed by name and an optional label, timers by stage and
+    hold the number of times a stage ran and its total seconds. Snapshots
+    are plain dicts, so a worker process can send them to the server.
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.counters = collections.Counter()
+        self.timers = {}
+
+    def count(self, name, value=1, label=None):
+        if ENABLED:
+            with self.lock:
+                self.counters[(name, label)] += value
+
+    def time(self, stage, seconds, count=1):
+        if ENABLED:
+            with self.lock:
+                timer = self.timers.setdefault(stage, [0, 0.0])
+                timer[0] += count
+                timer[1] += seconds
+
+    def timer(self, stage):
+        """
+        Times a block: with metrics.timer("segment"): ...
+        """
+        return Timer(self, stage) if ENABLED else NO_TIMER
+
+    def count_phylib(self):
+        """
+        Moves the segment, step, allocation and collision counts of phylib
+        into counters.
+        """
+        if ENABLED:
+            counts = phylib.phylib_take_counts()
+            for name in ["segments", "steps", "stops", "allocations"]:
+                self.count(name, counts[name])
+            for type, count in counts["collisions"].items():
+                self.count("collisions", count, type)
+
+    def drain(self):
+        """
+        Returns a snapshot and starts again from zero.
+        """
+        with self.lock:
+            snapshot = {"counters": dict(self.counters), "timers": self.timers}
+            self.counters = collections.Counter()
+            self.timers = {}
+        return snapshot
+
+    def merge(self, snapshot):
+        for (name, label), value in snapshot["counters"].items():
+            self.count(name, value, label)
+        for stage, (count, seconds) in snapshot["timers"].items():
+            self.time(stage, seconds, count)
+
+    def summary(self):
+        """
+        One line breakdown of the timers in ms, used to log a request.
+        """
+        with self.lock:
+            return " ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, (count, seconds) in self.timers.items())
+
+    def prometheus(self):
+        """
+        Returns the counters and timers in the Prometheus text format.
+        """
+        with self.lock:
+            counters = sorted(self.counters.items(), key=lambda item: (item[0][0], item[0][1] or ""))
+            timers = sorted(self.timers.items())
+        lines = []
+        previous = None
+        for (name, label), value in counters:
+            if name != previous:
+                lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+                previous = name
+            labels = f'{{type="{label}"}}' if label is not None else ""
+            lines.append(f"{PREFIX}_{name}_total{labels} {value}")
+        if timers:
+            lines.append(f"# TYPE {PREFIX}_stage_seconds summary")
+        for stage, (count, seconds) in timers:
+            lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {seconds}')
+            lines.append(f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+current: Metrics = None # Metrics of this process, see process_metrics
+
+def process_metrics():
+    """
+    Returns the Metrics of the current process. A forked worker starts
+    from zero rather than from a copy of the counts of its parent.
+    """
+    global current
+    if current is None or current.pid != os.getpid():
+        phylib.phylib_take_counts() # Counted by the parent
+        current = Metrics()
+    return current
@@ -1,6 +1,24 @@
 import phylib
 import sqlite3
 import math
+import os
+import random
+import sys
+import array
+import bisect
+import zlib
+import hashlib
+import collections
+import functools
+import queue
+import threading
+import multiprocessing.util
+from Metrics import process_metrics
+import Render
+try:
+    import numpy
+except ImportError:
+    numpy = None # Table.frames falls back to phylib_frames
 
 ################################################################################
 # Import constants from phylib as global variables
@@ -14,12 +32,15 @@ VEL_EPSILON   = phylib.PHYLIB_VEL_EPSILON
 DRAG          = phylib.PHYLIB_DRAG
 MAX_TIME      = phylib.PHYLIB_MAX_TIME
 MAX_OBJECTS   = phylib.PHYLIB_MAX_OBJECTS
+STEP_ENGINE   = phylib.PHYLIB_STEP_ENGINE
+EVENT_ENGINE  = phylib.PHYLIB_EVENT_ENGINE
+SOA_ENGINE    = phylib.PHYLIB_SOA_ENGINE
+FRAME_FIELDS  = phylib.PHYLIB_FRAME_FIELDS
 HEADER        = """<?xml version="1.0" encoding="UTF-8" standalone="no"?>
 <!DOCTYPE svg PUBLIC "-//W3C//DTD SVG 1.1//EN" "http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd">
 <svg width="700" height="1375" viewBox="-25 -25 1400 2750" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink">
   <rect width="1350" height="2700" x="0" y="0" fill="#C0D0C0" />\n"""
-FULL_HEADER   = HEADER + """<rect width="1350" height="2700" x="0" y="0" fill="#C0D0C0" />
-  <rect width="1400" height="25" x="-25" y="-25" fill="darkgreen" />
+FULL_HEADER   = HEADER + """  <rect width="1400" height="25" x="-25" y="-25" fill="darkgreen" />
   <rect width="1400" height="25" x="-25" y="2700" fill="darkgreen" />
   <rect width="25" height="2750" x="-25" y="-25" fill="darkgreen" />
   <rect width="25" height="2750" x="1350" y="-25" fill="darkgreen" />
@@ -35,6 +56,14 @@ FRAME_RATE    = 0.01
 CUE_NUMBER    = 0
 BLACK_NUMBER  = 8
 MAX_COUNT     = 2500
+STOPPED       = phylib.PHYLIB_STOPPED  # Event.hit of a ball that stopped
+NO_EVENT      = phylib.PHYLIB_NO_EVENT # Event.hit of a segment that ran for MAX_TIME
+ENGINE        = STEP_ENGINE # Engine used by Table.segment, EVENT_ENGINE jumps between events
+DB_NAME       = "phylib.db"
+RACK_SEED     = 2750 # Seed of make_new_table for the racks of the benchmarks and tests
+SHOT_CACHE_SIZE      = 256   # Shots kept in memory by a ShotCache
+SHOT_CACHE_ROWS      = 4096  # Shots kept in the ShotCache table
+SHOT_CACHE_PRECISION = 1.0   # mm and mm/s, tables and shots closer than this share results
 
 ################################################################################
 # The standard colours of pool balls
@@ -81,7 +110,7 @@ class StillBall(phylib.phylib_object):
 
     def svg(self, include_id=False):
         obj = self.obj.still_ball
-        return """  <circle %s cx="%d" cy="%d" r="%d" fill="%s" />\n""" % ('id="cue"' if obj.number == 0 and include_id else '',
+        return """  <circle %s class="ball" cx="%d" cy="%d" r="%d" fill="%s" />\n""" % ('id="cue"' if obj.number == 0 and include_id else '',
                                                                             obj.pos.x, obj.pos.y, BALL_RADIUS, BALL_COLOURS[obj.number])
     
 
@@ -102,7 +131,7 @@ class RollingBall(phylib.phylib_object):
 
     def svg(self, include_id=False):
         obj = self.obj.rolling_ball
-        return """  <circle %s cx="%d" cy="%d" r="%d" fill="%s" />\n""" % ('id="cue"' if obj.number == 0 and include_id else '', 
+        return """  <circle %s class="ball" cx="%d" cy="%d" r="%d" fill="%s" />\n""" % ('id="cue"' if obj.number == 0 and include_id else '', 
                                                                            obj.pos.x, obj.pos.y, BALL_RADIUS, BALL_COLOURS[obj.number])
 
 
@@ -166,11 +195,9 @@ class Table(phylib.phylib_table):
     def __init__(self):
         """
         Table constructor method.
-        This method call the phylib_table constructor and sets the current
-        object index to -1.
+        This method call the phylib_table constructor.
         """
         phylib.phylib_table.__init__(self)
-        self.current = -1
 
     def __iadd__(self, other):
         """
@@ -185,21 +212,11 @@ class Table(phylib.phylib_table):
         """
         This method adds iterator support for the table.
         This allows you to write "for object in table:" to loop over all
-        the objects in the table.
+        the objects in the table. Only occupied slots are visited, in the
+        order of slots (see phylib_index), and every loop gets its own
+        iterator so loops over the same table can be nested.
         """
-        return self
-
-    def __next__(self):
-        """
-        This provides the next object from the table in a loop.
-        """
-        self.current += 1  # increment the index to the next object
-        if self.current < MAX_OBJECTS:   # check if there are no more objects
-            return self[self.current] # return the latest object
-
-        # if we get there then we have gone through all the objects
-        self.current = -1    # reset the index counter
-        raise StopIteration  # raise StopIteration to tell for loop to stop
+        return map(self.__getitem__, self.slots())
 
     def __getitem__(self, index):
         """
@@ -207,10 +224,13 @@ class Table(phylib.phylib_table):
         It calls get_object (see phylib.i) to retreive a generic phylib_object
         and then sets the __class__ attribute to make the class match
         the object type.
+        The object lives in a slot of the table and does not own it, so it
+        keeps a reference to the table, which is freed with its last one.
         """
         result = self.get_object(index) 
         if result==None:
             return None
+        result.table = self
         if result.type == phylib.PHYLIB_STILL_BALL:
             result.__class__ = StillBall
         if result.type == phylib.PHYLIB_ROLLING_BALL:
@@ -230,24 +250,40 @@ class Table(phylib.phylib_table):
         """
         result = ""    # create empty string
         result += "time = %6.1f;\n" % self.time    # append time
-        for i,obj in enumerate(self): # loop over all objects and number them
+        for i in range(MAX_OBJECTS): # loop over all slots, empty ones included
+            obj = self[i]
             result += "  [%02d] = %s\n" % (i,obj)  # append object description
         return result  # return the string
 
-    def segment(self):
+    def segment(self, engine=None):
         """
         Calls the segment method from phylib.i (which calls the phylib_segment
         functions in phylib.c.
+        The engine may be STEP_ENGINE, EVENT_ENGINE or SOA_ENGINE and defaults
+        to ENGINE. The steps attribute of the result holds the number of
+        SIM_RATE steps the engine evaluated.
         Sets the __class__ of the returned phylib_table object to Table
         to make it a Table object.
         """
 
-        result = phylib.phylib_table.segment(self)
+        result = phylib.phylib_table.segment(self, ENGINE if engine is None else engine)
         if result:
             result.__class__ = Table
-            result.current = -1
         return result
     
+    def shoot(self, engine=None, max_count=MAX_COUNT):
+        """
+        Runs the struck table to rest in one call to phylib_shoot (see
+        phylib.i), at most max_count segments. Returns (tables, events)
+        where tables lists the Table after each segment and events the
+        Event that ended it. The shot never stopped if it ran max_count
+        segments.
+        """
+        tables, events = phylib.phylib_table.shoot(self, ENGINE if engine is None else engine, max_count)
+        for table in tables:
+            table.__class__ = Table
+        return tables, [Event(*event) for event in events]
+
     def roll(self, t):
         new = Table()
         for ball in self:
@@ -264,45 +300,268 @@ class Table(phylib.phylib_table):
                 new += new_ball
         return new
 
+    def frames(self, start, end, step=FRAME_RATE):
+        """
+        Rolls the table to every frame time from start up to end and returns
+        a list of Frame objects that share one packed buffer of doubles.
+        The buffer comes from trajectory when NumPy is installed and from a
+        single call to phylib_frames (see phylib.i) otherwise.
+        """
+        if numpy is not None:
+            data = self.trajectory(start, end, step).ravel()
+        else:
+            data = phylib.phylib_table.frames(self, start, end, step).cast('d')
+        count = phylib.phylib_frame_count(start, end, step)
+        balls = phylib.phylib_balls(self)
+        return [Frame(data, i * balls * FRAME_FIELDS, balls, start + i * step) for i in range(count)]
+
+    def frame(self, t):
+        """
+        Rolls the table by t seconds and returns its balls as a single Frame,
+        the same frame frames returns for the time self.time + t.
+        """
+        return Frame(phylib.phylib_table.frame(self, t).cast('d'), 0, phylib.phylib_balls(self), self.time + t)
+
+    def trajectory(self, start, end, step=FRAME_RATE):
+        """
+        NumPy version of phylib_frames that evaluates every frame time at
+        once. Returns an (n_frames, n_balls, FRAME_FIELDS) array using the
+        same arithmetic and sign change clamping as phylib_roll.
+        """
+        balls = [object for object in iter(self) if isinstance(object, StillBall) or isinstance(object, RollingBall)]
+        state = numpy.zeros((len(balls), 8))
+        for i, ball in enumerate(balls):
+            if isinstance(ball, RollingBall):
+                obj = ball.obj.rolling_ball
+                state[i] = (phylib.PHYLIB_ROLLING_BALL, obj.number, obj.pos.x, obj.pos.y, obj.vel.x, obj.vel.y, obj.acc.x, obj.acc.y)
+            else:
+                obj = ball.obj.still_ball
+                state[i] = (phylib.PHYLIB_STILL_BALL, obj.number, obj.pos.x, obj.pos.y, 0.0, 0.0, 0.0, 0.0)
+
+        count = phylib.phylib_frame_count(start, end, step)
+        t = ((start - self.time) + numpy.arange(count) * step)[:, None, None]
+        p, v, a = state[:, 2:4], state[:, 4:6], state[:, 6:8]
+
+        frames = numpy.empty((count, len(balls), FRAME_FIELDS))
+        frames[:, :, 0:2] = state[:, 0:2]
+        frames[:, :, 2:4] = p + v * t + .5 * a * t * t
+        vel = v + a * t
+        frames[:, :, 4:6] = numpy.where(vel * v < 0, 0.0, vel) # Check for change of sign
+        return frames
+
+    def state(self):
+        """
+        Returns the balls of the table as a Frame, read from the buffer of a
+        single call to state (see phylib.i) rather than through a SWIG object
+        per ball. Frame.data is a read-only memoryview of doubles that NumPy
+        can wrap with numpy.asarray without copying.
+        """
+        return Frame(phylib.phylib_table.state(self).cast('d'), 0, phylib.phylib_balls(self), self.time)
+
     def get_cue(self):
-        cue = None
-        for ball in iter(self):
-            if isinstance(ball, StillBall):
-                if ball.obj.still_ball.number == 0:
-                    cue = ball
-                    # Cannot return here or self.current is positioned incorrectly
-        return cue
+        # The slot is found in C, so only the cue gets a SWIG object
+        slot = phylib.phylib_still_slot(self, CUE_NUMBER)
+        return None if slot < 0 else self[slot]
 
     def svg(self, include_id=False):
-        contents = ""
-        for object in iter(self):
-            if object:
-                if include_id and (isinstance(object, StillBall) or isinstance(object, RollingBall)):
-                    contents += object.svg(include_id=True)
-                else:
-                    contents += object.svg()
-        return HEADER + contents + FOOTER
+        return RENDERER.table(self.state().balls(), include_id).decode()
+
+    def write_svg(self, out, include_id=False):
+        """
+        Writes the SVG of svg straight to a binary file, such as an HTTP
+        socket, without building a string.
+        """
+        RENDERER.write_table(out, self.state().balls(), include_id)
     
     def balls_svg(self, frame, include_id=False):
-        contents = ""
-        for object in iter(self):
-            if isinstance(object, StillBall) or isinstance(object, RollingBall):
-                contents += object.svg(include_id)
-        return f'<g id="frame-{frame}">\n{contents}</g>\n'
+        return self.state().balls_svg(frame, include_id)
     
+    def balls(self):
+        """
+        Returns a (type, number, x, y, xvel, yvel) tuple for every ball,
+        matching Frame.balls.
+        """
+        return self.state().balls()
+
     def balls_left(self):
-        balls_left = []
-        for object in iter(self):
-            if isinstance(object, StillBall) or isinstance(object, RollingBall):
-                balls_left.append(object.number())
-        return balls_left
+        return self.state().balls_left()
+
+
+Event = collections.namedtuple("Event", ["time", "hit", "ball", "other"])
+Event.__doc__ = """
+Event that ended a segment, see Table.shoot. At time the rolling ball
+numbered ball hit an object of type hit (a phylib_obj) or stopped (hit is
+STOPPED), other is the number of the ball hit and None for any other
+object. A segment that ran for MAX_TIME ends with hit NO_EVENT.
+"""
+
+
+class Frame():
+    """
+    A table rolled to a single point in time, read from the buffer returned
+    by Table.frames (a memoryview or a flat NumPy array) instead of a Table
+    of SWIG objects.
+    """
+
+    def __init__(self, data, offset, count, time):
+        self.data = data
+        self.offset = offset
+        self.count = count
+        self.time = time
+
+    def balls(self):
+        """
+        Returns a (type, number, x, y, xvel, yvel) tuple for every ball.
+        """
+        data = self.data[self.offset:self.offset + self.count * FRAME_FIELDS].tolist()
+        return [(int(data[i]), int(data[i + 1]), data[i + 2], data[i + 3], data[i + 4], data[i + 5])
+                for i in range(0, len(data), FRAME_FIELDS)]
+
+    def circles(self, include_id=False):
+        return RENDERER.balls(self.balls(), include_id).decode()
+
+    def balls_svg(self, frame, include_id=False):
+        return RENDERER.frame(frame, self.balls(), include_id).decode()
+
+    def balls_left(self):
+        return [ball[1] for ball in self.balls()]
+
+
+# FULL_HEADER already holds the cushions and holes that phylib_new_table places on every table
+RENDERER = Render.Renderer(FULL_HEADER, FOOTER, BALL_COLOURS, BALL_RADIUS)
+
+
+class ShotFrames():
+    """
+    The frames of a shot as a lazy sequence. Only the tables at segment
+    boundaries are kept, a frame is rolled from the table at the start of
+    its segment when it is read, so memory does not grow with the length
+    of the shot.
+    Items come in the order simulate_segments yields them: the Frames of
+    each segment followed by the Table that ends it, then the tables in
+    extra. Supports len, iteration (a segment at a time with Table.frames)
+    and indexing, where finding the segment of an index or a time (see
+    index) is a binary search. Segments can be appended as they are
+    computed.
+    """
+
+    def __init__(self, start: Table, tables=(), extra=(), step=FRAME_RATE):
+        self.tables = [start]
+        self.extra = list(extra)
+        self.step = step
+        self.times = [start.time]
+        # ends[k] is the index after the table that ends segment k
+        self.ends = []
+        for table in tables:
+            self.append(table)
+
+    def append(self, table):
+        """
+        Adds the table that ends the next segment.
+        """
+        total = (self.ends[-1] if self.ends else 0) + phylib.phylib_frame_count(self.times[-1], table.time, self.step) + 1
+        self.tables.append(table)
+        self.times.append(table.time)
+        self.ends.append(total)
+
+    def __len__(self):
+        return (self.ends[-1] if self.ends else 0) + len(self.extra)
+
+    def __iter__(self):
+        for k in range(len(self.ends)):
+            yield from self.segment(k)
+        yield from self.extra
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("frame index out of range")
+        k = bisect.bisect_right(self.ends, index)
+        if k == len(self.ends):
+            return self.extra[index - (self.ends[-1] if self.ends else 0)]
+        frame = index - (self.ends[k - 1] if k else 0)
+        if index == self.ends[k] - 1:
+            return self.tables[k + 1]
+        return self.tables[k].frame(frame * self.step)
+
+    def segment(self, k):
+        """
+        Returns the Frames of segment k followed by the Table that ends it.
+        """
+        table, next_table = self.tables[k], self.tables[k + 1]
+        return table.frames(table.time, next_table.time, self.step) + [next_table]
+
+    def index(self, time):
+        """
+        Returns the index of the frame showing the table at time, the last
+        table of the shot once every ball has stopped.
+        """
+        k = bisect.bisect_right(self.times, time) - 1
+        if k < 0:
+            return 0
+        if k >= len(self.ends):
+            return len(self) - 1
+        first = self.ends[k - 1] if k else 0
+        count = self.ends[k] - first - 1
+        if count == 0:
+            return max(first - 1, 0) # Segment shorter than a frame, still showing the table before it
+        frame = min(int((time - self.times[k]) / self.step), count - 1)
+        # Division can round either way, frame times are self.times[k] + frame * self.step
+        if frame < count - 1 and self.times[k] + (frame + 1) * self.step <= time:
+            frame += 1
+        elif frame > 0 and self.times[k] + frame * self.step > time:
+            frame -= 1
+        return first + frame
+
+    def at(self, time):
+        return self[self.index(time)]
+
+
+def pack_blob(typecode, values):
+    """
+    Packs numbers into a zlib compressed, little-endian blob of array
+    typecode. Still balls repeat from frame to frame so frames compress well.
+    """
+    values = array.array(typecode, values)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return zlib.compress(values.tobytes(), 1)
+
+def unpack_blob(typecode, blob):
+    values = array.array(typecode)
+    values.frombytes(zlib.decompress(blob))
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+def make_frames(times, counts, data):
+    """
+    Returns a Frame for every time, each with the next counts balls of data.
+    """
+    data = memoryview(data)
+    frames = []
+    offset = 0
+    for time, count in zip(times, counts):
+        frames.append(Frame(data, offset, count, time))
+        offset += count * FRAME_FIELDS
+    return frames
 
 
 class Database():
     def __init__(self, reset=False):
         if reset:
-            open("phylib.db", "w").close()
-        self.conn = sqlite3.connect("phylib.db")
+            open(DB_NAME, "w").close()
+            # A stale write-ahead log would be replayed into the new database
+            for suffix in ["-wal", "-shm"]:
+                if os.path.exists(DB_NAME + suffix):
+                    os.remove(DB_NAME + suffix)
+        self.conn = sqlite3.connect(DB_NAME)
+        # Readers do not block the writer and commits skip most fsyncs
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
 
     def createDB(self):
         self.cur = self.conn.cursor()
@@ -347,6 +606,40 @@ class Database():
                          FOREIGN KEY (SHOTID) REFERENCES Shot (SHOTID)
         )""")
 
+        # ShotFrames, all frames of a shot in one row: the frame times (float64),
+        # the number of balls in each frame (uint8) and FRAME_FIELDS float32s per ball,
+        # each packed with pack_blob
+        self.cur.execute("""CREATE TABLE IF NOT EXISTS ShotFrames (
+                         SHOTID INTEGER PRIMARY KEY NOT NULL,
+                         TIMES BLOB NOT NULL,
+                         COUNTS BLOB NOT NULL,
+                         BALLS BLOB NOT NULL,
+                         FOREIGN KEY (SHOTID) REFERENCES Shot (SHOTID)
+        )""")
+
+        # GameState, the latest snapshot of each game, see Game.save. VERSION counts the
+        # snapshots saved, so a server sharing the file can tell its copy of a game is stale
+        self.cur.execute("""CREATE TABLE IF NOT EXISTS GameState (
+                         GAMEID INTEGER PRIMARY KEY NOT NULL,
+                         SESSIONID VARCHAR(64) UNIQUE,
+                         CURRENT VARCHAR(64),
+                         LOW VARCHAR(64),
+                         TIME FLOAT NOT NULL,
+                         BALLS BLOB NOT NULL,
+                         VERSION INTEGER NOT NULL DEFAULT 0,
+                         FOREIGN KEY (GAMEID) REFERENCES Game (GAMEID)
+        )""")
+
+        # ShotCache, the on-disk tier of ShotCache, results are packed like ShotFrames
+        self.cur.execute("""CREATE TABLE IF NOT EXISTS ShotCache (
+                         KEY CHAR(40) PRIMARY KEY NOT NULL,
+                         ELAPSED FLOAT NOT NULL,
+                         SUNK BLOB NOT NULL,
+                         TIMES BLOB NOT NULL,
+                         COUNTS BLOB NOT NULL,
+                         BALLS BLOB NOT NULL
+        )""")
+
         # Game
         self.cur.execute("""CREATE TABLE IF NOT EXISTS Game (
                          GAMEID INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
@@ -362,6 +655,22 @@ class Database():
         )""")
         self.cur.close()
         self.conn.commit()
+        self.createIndexes()
+
+    def createIndexes(self):
+        """
+        Secondary indexes for the lookups of readTable, writeShot and the
+        replay queries, each covers the columns its queries read.
+        """
+        self.cur = self.conn.cursor()
+        self.cur.execute("""CREATE INDEX IF NOT EXISTS BallTableIndex ON BallTable (TABLEID, BALLID)""")
+        self.cur.execute("""CREATE INDEX IF NOT EXISTS TableShotIndex ON TableShot (SHOTID, TABLEID)""")
+        self.cur.execute("""CREATE INDEX IF NOT EXISTS ShotGameIndex ON Shot (GAMEID)""")
+        self.cur.execute("""CREATE INDEX IF NOT EXISTS ShotPlayerIndex ON Shot (PLAYERID)""")
+        self.cur.execute("""CREATE INDEX IF NOT EXISTS PlayerNameIndex ON Player (PLAYERNAME, GAMEID)""")
+        self.cur.execute("""CREATE INDEX IF NOT EXISTS PlayerGameIndex ON Player (GAMEID)""")
+        self.cur.close()
+        self.conn.commit()
 
     def readTable(self, tableID, commit=True):
         self.cur = self.conn.cursor()
@@ -372,7 +681,7 @@ class Database():
         
         table = Table()
         table.time = res_table[1]
-        for ball in self.cur.execute("""SELECT * FROM Ball INNER JOIN BallTable ON Ball.BALLID=BallTable.BALLID WHERE BallTable.TABLEID=?""", (res_table[0],)):
+        for ball in self.cur.execute("""SELECT * FROM Ball INNER JOIN BallTable ON Ball.BALLID=BallTable.BALLID WHERE BallTable.TABLEID=? ORDER BY BallTable.ROWID""", (res_table[0],)):
             # The ball tuple has the following properties: (id, number, posx, posy, velx, vely, id, tableid)
             if ball[4] is None or ball[5] is None:
                 pos = Coordinate(ball[2], ball[3])
@@ -397,29 +706,64 @@ class Database():
         self.cur = self.conn.cursor()
         self.cur.execute("""INSERT INTO TTable (TIME) VALUES (?)""", (table.time,))
         tableID = self.cur.lastrowid
-        for object in iter(table):
-            if object:
-                if isinstance(object, StillBall):
-                    ball = object.obj.still_ball
-                    self.cur.execute("""INSERT INTO Ball (BALLNO, XPOS, YPOS) VALUES (?, ?, ?)""",
-                                     (ball.number, ball.pos.x, ball.pos.y,))
-                    ballID = self.cur.lastrowid
-                    self.cur.execute("""INSERT INTO BallTable (BALLID, TABLEID) VALUES (?, ?)""",
-                                     (ballID, tableID,))
-                elif isinstance(object, RollingBall):
-                    ball = object.obj.rolling_ball
-                    self.cur.execute("""INSERT INTO Ball (BALLNO, XPOS, YPOS, XVEL, YVEL) VALUES (?, ?, ?, ?, ?)""",
-                                     (ball.number, ball.pos.x, ball.pos.y, ball.vel.x, ball.vel.y,))
-                    ballID = self.cur.lastrowid
-                    self.cur.execute("""INSERT INTO BallTable (BALLID, TABLEID) VALUES (?, ?)""",
-                                     (ballID, tableID,))
-                else:
-                    pass # Other classes are handled by definition
+        for type, number, x, y, xvel, yvel in table.balls():
+            if type == phylib.PHYLIB_STILL_BALL:
+                self.cur.execute("""INSERT INTO Ball (BALLNO, XPOS, YPOS) VALUES (?, ?, ?)""",
+                                 (number, x, y,))
+            else:
+                self.cur.execute("""INSERT INTO Ball (BALLNO, XPOS, YPOS, XVEL, YVEL) VALUES (?, ?, ?, ?, ?)""",
+                                 (number, x, y, xvel, yvel,))
+            ballID = self.cur.lastrowid
+            self.cur.execute("""INSERT INTO BallTable (BALLID, TABLEID) VALUES (?, ?)""",
+                             (ballID, tableID,))
         self.cur.close()
         if commit:
             self.conn.commit()
         return tableID - 1
     
+    def writeTables(self, tables, shotID):
+        """
+        Bulk version of writeTable and writeTableShot for every table of a
+        shot. The IDs are assigned up front so the rows can be written with
+        executemany, all in one transaction.
+        Returns the ID of the first table (like writeTable).
+        """
+        self.cur = self.conn.cursor()
+        self.cur.execute("""BEGIN IMMEDIATE""") # Lock out other writers until the IDs are used
+        tableID = self.cur.execute("""SELECT COALESCE(MAX(TABLEID), 0) FROM TTable""").fetchone()[0] + 1
+        ballID = self.cur.execute("""SELECT COALESCE(MAX(BALLID), 0) FROM Ball""").fetchone()[0] + 1
+        firstID = tableID
+        frames = [table.balls() for table in tables]
+        # Still balls are numbered before rolling balls so both inserts append in order,
+        # BallTable keeps the order of the balls within each table
+        rollingID = ballID + sum(ball[0] == phylib.PHYLIB_STILL_BALL for balls in frames for ball in balls)
+        ttables = []
+        table_shots = []
+        still = []
+        rolling = []
+        ball_tables = []
+        for table, balls in zip(tables, frames):
+            ttables.append((tableID, table.time,))
+            table_shots.append((tableID, shotID,))
+            for type, number, x, y, xvel, yvel in balls:
+                if type == phylib.PHYLIB_STILL_BALL:
+                    still.append((ballID, number, x, y,))
+                    ball_tables.append((ballID, tableID,))
+                    ballID += 1
+                else:
+                    rolling.append((rollingID, number, x, y, xvel, yvel,))
+                    ball_tables.append((rollingID, tableID,))
+                    rollingID += 1
+            tableID += 1
+        self.cur.executemany("""INSERT INTO TTable (TABLEID, TIME) VALUES (?, ?)""", ttables)
+        self.cur.executemany("""INSERT INTO Ball (BALLID, BALLNO, XPOS, YPOS) VALUES (?, ?, ?, ?)""", still)
+        self.cur.executemany("""INSERT INTO Ball (BALLID, BALLNO, XPOS, YPOS, XVEL, YVEL) VALUES (?, ?, ?, ?, ?, ?)""", rolling)
+        self.cur.executemany("""INSERT INTO BallTable (BALLID, TABLEID) VALUES (?, ?)""", ball_tables)
+        self.cur.executemany("""INSERT INTO TableShot (TABLEID, SHOTID) VALUES (?, ?)""", table_shots)
+        self.cur.close()
+        self.conn.commit()
+        return firstID - 1
+
     def readGame(self, gameID):
         self.cur = self.conn.cursor()
         players = self.cur.execute("SELECT * FROM Player INNER JOIN Game ON Player.GAMEID=Game.GAMEID WHERE Game.GAMEID=?", (gameID,))
@@ -447,11 +791,13 @@ class Database():
     
     def writeShot(self, playerName, gameID):
         self.cur = self.conn.cursor()
-        res = self.cur.execute("""SELECT Player.PLAYERID FROM Player WHERE Player.PLAYERNAME=?""", (playerName,))
+        res = self.cur.execute("""SELECT Player.PLAYERID FROM Player WHERE Player.PLAYERNAME=? AND Player.GAMEID=?""", (playerName, gameID,))
         res_player = res.fetchone()
-        # We can assume that the player name will always exist in the database due to the definition of
-        # the Game class -> the constructor adds players (id, name) to the database
-        
+        # The Game constructor adds its players, so a missing one is a bad playerName or gameID
+        if res_player is None:
+            self.cur.close()
+            raise ValueError(f"No player {playerName!r} in game {gameID}")
+
         self.cur.execute("""INSERT INTO Shot (PLAYERID, GAMEID) VALUES (?, ?)""", (res_player[0], gameID,))
         shotID = self.cur.lastrowid
         self.cur.close()
@@ -466,28 +812,461 @@ class Database():
             self.conn.commit()
         return shotID
 
+    def writeShotFrames(self, shotID, tables, commit=True):
+        """
+        Writes every table of a shot as a single ShotFrames row, the compact
+        alternative to writeTables. Positions and velocities are stored as
+        float32.
+        """
+        times = []
+        counts = []
+        balls = []
+        for table in tables:
+            frame = table.balls()
+            times.append(table.time)
+            counts.append(len(frame))
+            balls.extend(value for ball in frame for value in ball)
+        self.cur = self.conn.cursor()
+        self.cur.execute("""INSERT INTO ShotFrames (SHOTID, TIMES, COUNTS, BALLS) VALUES (?, ?, ?, ?)""",
+                         (shotID, pack_blob("d", times), pack_blob("B", counts), pack_blob("f", balls),))
+        self.cur.close()
+        if commit:
+            self.conn.commit()
+        return shotID
+
+    def readShotFrames(self, shotID):
+        """
+        Returns the frames of a shot written by writeShotFrames as a list of
+        Frames over the stored blob, or None if the shot has no frames.
+        """
+        self.cur = self.conn.cursor()
+        res = self.cur.execute("""SELECT TIMES, COUNTS, BALLS FROM ShotFrames WHERE SHOTID=?""", (shotID,))
+        res_shot = res.fetchone()
+        self.cur.close()
+        if res_shot is None:
+            return None # No frames with matching shot ID found
+
+        return make_frames(unpack_blob("d", res_shot[0]), unpack_blob("B", res_shot[1]), unpack_blob("f", res_shot[2]))
+
+    def writeSnapshot(self, gameID, table, currentPlayer, low, sessionID=None, version=0):
+        """
+        Replaces the snapshot of a game, saved over the snapshot of the given
+        version (0 for a game without one). The table is packed like a
+        ShotFrames frame but as float64 so a resumed game plays out exactly
+        the same. A session ID belongs to one game at a time. Returns the
+        version of the new snapshot, or None without writing anything when
+        the stored snapshot is no longer version, saved by another server.
+        """
+        balls = pack_blob("d", [value for ball in table.balls() for value in ball])
+        self.cur = self.conn.cursor()
+        if sessionID is not None:
+            self.cur.execute("""UPDATE GameState SET SESSIONID=NULL WHERE SESSIONID=? AND GAMEID!=?""", (sessionID, gameID,))
+        self.cur.execute("""UPDATE GameState SET SESSIONID=?, CURRENT=?, LOW=?, TIME=?, BALLS=?, VERSION=VERSION+1
+                            WHERE GAMEID=? AND VERSION=?""",
+                         (sessionID, currentPlayer, low, table.time, balls, gameID, version,))
+        if self.cur.rowcount == 0:
+            self.cur.execute("""INSERT OR IGNORE INTO GameState (GAMEID, SESSIONID, CURRENT, LOW, TIME, BALLS, VERSION)
+                                VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                             (gameID, sessionID, currentPlayer, low, table.time, balls, version + 1,))
+        saved = self.cur.rowcount != 0
+        self.cur.close()
+        if not saved:
+            self.conn.rollback()
+            return None
+        self.conn.commit()
+        return version + 1
+
+    def readSnapshot(self, gameID):
+        """
+        Returns the (table, currentPlayer, low, version) snapshot of a game,
+        or None if the game has none.
+        """
+        self.cur = self.conn.cursor()
+        res = self.cur.execute("""SELECT CURRENT, LOW, TIME, BALLS, VERSION FROM GameState WHERE GAMEID=?""", (gameID,))
+        res_state = res.fetchone()
+        self.cur.close()
+        if res_state is None:
+            return None
+        data = unpack_blob("d", res_state[3])
+        balls = [(int(data[i]), int(data[i + 1]), data[i + 2], data[i + 3], data[i + 4], data[i + 5])
+                 for i in range(0, len(data), FRAME_FIELDS)]
+        return make_table(balls, res_state[2]), res_state[0], res_state[1], res_state[4]
+
+    def readSessionGame(self, sessionID):
+        """
+        Returns the (gameID, version) of the game last saved with a session
+        ID and of its snapshot, or None.
+        """
+        self.cur = self.conn.cursor()
+        res = self.cur.execute("""SELECT GAMEID, VERSION FROM GameState WHERE SESSIONID=?""", (sessionID,))
+        res_state = res.fetchone()
+        self.cur.close()
+        return res_state
+
+    def readCachedShot(self, key):
+        """
+        Returns the (elapsed, sunk, times, counts, balls) entry of a
+        ShotCache key, or None.
+        """
+        self.cur = self.conn.cursor()
+        res = self.cur.execute("""SELECT ELAPSED, SUNK, TIMES, COUNTS, BALLS FROM ShotCache WHERE KEY=?""", (key,))
+        entry = res.fetchone()
+        self.cur.close()
+        return entry
+
+    def writeCachedShot(self, key, entry):
+        """
+        Stores a ShotCache entry, dropping the oldest past SHOT_CACHE_ROWS.
+        """
+        self.cur = self.conn.cursor()
+        self.cur.execute("""INSERT OR REPLACE INTO ShotCache (KEY, ELAPSED, SUNK, TIMES, COUNTS, BALLS) VALUES (?, ?, ?, ?, ?, ?)""",
+                         (key,) + tuple(entry))
+        self.cur.execute("""DELETE FROM ShotCache WHERE ROWID <= (SELECT MAX(ROWID) FROM ShotCache) - ?""", (SHOT_CACHE_ROWS,))
+        self.cur.close()
+        self.conn.commit()
+
+    def readFrameRows(self, where, parameters=()):
+        """
+        Reads the TTable, Ball, BallTable and TableShot rows of the tables
+        matching where in a single join. Returns a dictionary of shot ID to
+        (times, counts, balls) lists laid out like a ShotFrames row.
+        """
+        self.cur = self.conn.cursor()
+        rows = self.cur.execute("""SELECT TableShot.SHOTID, TTable.TABLEID, TTable.TIME, Ball.BALLNO, Ball.XPOS, Ball.YPOS, Ball.XVEL, Ball.YVEL
+                                   FROM TableShot INNER JOIN TTable ON TableShot.TABLEID=TTable.TABLEID
+                                   LEFT JOIN BallTable ON BallTable.TABLEID=TTable.TABLEID
+                                   LEFT JOIN Ball ON Ball.BALLID=BallTable.BALLID
+                                   WHERE %s
+                                   ORDER BY TableShot.SHOTID, TTable.TABLEID, BallTable.ROWID""" % where, parameters)
+        shots = {}
+        last_table = None
+        for shotID, tableID, time, number, x, y, xvel, yvel in rows:
+            times, counts, balls = shots.setdefault(shotID, ([], [], []))
+            if tableID != last_table:
+                times.append(time)
+                counts.append(0)
+                last_table = tableID
+            if number is None:
+                continue # Table without balls
+            counts[-1] += 1
+            if xvel is None or yvel is None:
+                balls.extend((phylib.PHYLIB_STILL_BALL, number, x, y, 0.0, 0.0))
+            else:
+                balls.extend((phylib.PHYLIB_ROLLING_BALL, number, x, y, xvel, yvel))
+        self.cur.close()
+        return shots
+
+    def readShot(self, shotID):
+        """
+        Returns every frame of a shot as a list of Frames, from ShotFrames or
+        the relational tables, or None if the shot has no frames.
+        """
+        frames = self.readShotFrames(shotID)
+        if frames is None:
+            shots = self.readFrameRows("TableShot.SHOTID=?", (shotID,))
+            if shotID in shots:
+                times, counts, balls = shots[shotID]
+                frames = make_frames(times, counts, array.array("d", balls))
+        return frames
+
+    def readFinalTables(self, gameID):
+        """
+        Returns a (shotID, Frame) pair with the final table of every shot of
+        a game, in the order they were shot.
+        """
+        final = {}
+        shots = self.readFrameRows("""TableShot.SHOTID IN (SELECT SHOTID FROM Shot WHERE GAMEID=?) AND
+                                      TableShot.TABLEID=(SELECT MAX(Final.TABLEID) FROM TableShot AS Final
+                                      WHERE Final.SHOTID=TableShot.SHOTID)""", (gameID,))
+        for shotID, (times, counts, balls) in shots.items():
+            final[shotID] = make_frames(times, counts, array.array("d", balls))[-1]
+
+        self.cur = self.conn.cursor()
+        rows = self.cur.execute("""SELECT ShotFrames.SHOTID, TIMES, COUNTS, BALLS FROM Shot
+                                   INNER JOIN ShotFrames ON ShotFrames.SHOTID=Shot.SHOTID
+                                   WHERE Shot.GAMEID=?""", (gameID,)).fetchall()
+        self.cur.close()
+        for shotID, times, counts, balls in rows:
+            final[shotID] = make_frames(unpack_blob("d", times), unpack_blob("B", counts), unpack_blob("f", balls))[-1]
+        return sorted(final.items())
+
+    def readShotCounts(self, gameID):
+        """
+        Returns a dictionary of player name to the number of shots they
+        have taken in a game.
+        """
+        self.cur = self.conn.cursor()
+        rows = self.cur.execute("""SELECT Player.PLAYERNAME, COUNT(Shot.SHOTID) FROM Player
+                                   LEFT JOIN Shot ON Shot.PLAYERID=Player.PLAYERID
+                                   WHERE Player.GAMEID=? GROUP BY Player.PLAYERID""", (gameID,)).fetchall()
+        self.cur.close()
+        return dict(rows)
+
+    def migrateShots(self):
+        """
+        Moves the frames of every shot stored in TTable, Ball, BallTable and
+        TableShot rows to ShotFrames, in one pass over the old rows and one
+        transaction. Returns the number of shots migrated. The file only
+        shrinks after a VACUUM.
+        """
+        shots = self.readFrameRows("TableShot.SHOTID NOT IN (SELECT SHOTID FROM ShotFrames)")
+        self.cur = self.conn.cursor()
+        self.cur.executemany("""INSERT INTO ShotFrames (SHOTID, TIMES, COUNTS, BALLS) VALUES (?, ?, ?, ?)""",
+                             [(shotID, pack_blob("d", times), pack_blob("B", counts), pack_blob("f", balls),)
+                              for shotID, (times, counts, balls) in shots.items()])
+
+        # Remove the migrated rows
+        self.cur.execute("""CREATE TEMP TABLE MigratedTable AS SELECT TABLEID FROM TableShot
+                            WHERE SHOTID IN (SELECT SHOTID FROM ShotFrames)""")
+        self.cur.execute("""DELETE FROM Ball WHERE BALLID IN (SELECT BALLID FROM BallTable
+                            WHERE TABLEID IN (SELECT TABLEID FROM MigratedTable))""")
+        self.cur.execute("""DELETE FROM BallTable WHERE TABLEID IN (SELECT TABLEID FROM MigratedTable)""")
+        self.cur.execute("""DELETE FROM TTable WHERE TABLEID IN (SELECT TABLEID FROM MigratedTable)""")
+        self.cur.execute("""DELETE FROM TableShot WHERE TABLEID IN (SELECT TABLEID FROM MigratedTable)""")
+        self.cur.execute("""DROP TABLE MigratedTable""")
+        self.cur.close()
+        self.conn.commit()
+        return len(shots)
+
     def close(self):
         self.conn.commit()
         self.conn.close()
 
 
+class DatabaseWriter():
+    """
+    Writes shots to the database on a background thread, so the caller can
+    move on as soon as a shot has been simulated. Shots are written in the
+    order they were queued.
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, playerName, gameID, tables):
+        self.queue.put((self.write_shot, (playerName, gameID, tables)))
+
+    def call(self, function, *args):
+        """
+        Runs function(*args) on the thread, after the shots queued before it.
+        """
+        self.queue.put((function, args))
+
+    def run(self):
+        self.db = Database()
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            function, args = item
+            try:
+                function(*args)
+            except Exception as error:
+                # A bad item must not stop the thread, or every later shot would be dropped
+                self.db.conn.rollback()
+                print(f"Failed to run a queued call on the writer thread: {error!r}")
+        self.db.close()
+
+    def write_shot(self, playerName, gameID, tables):
+        try:
+            with process_metrics().timer("database"):
+                shotID = self.db.writeShot(playerName, gameID)
+                self.db.writeShotFrames(shotID, tables)
+        except Exception as error:
+            self.db.conn.rollback()
+            print(f"Failed to write shot of game {gameID}: {error!r}")
+
+    def close(self):
+        """
+        Writes the shots still queued and stops the thread.
+        """
+        self.queue.put(None)
+        self.thread.join()
+
+
+writer: DatabaseWriter = None # Writer of this process, see shot_writer
+
+def shot_writer():
+    """
+    Returns the DatabaseWriter of the current process, starting it on first
+    use. Queued shots are flushed when the process exits, which also covers
+    the worker processes of a pool.
+    """
+    global writer
+    if writer is None or writer.pid != os.getpid():
+        writer = DatabaseWriter()
+        multiprocessing.util.Finalize(writer, writer.close, exitpriority=10)
+    return writer
+
+
+class ShotCache():
+    """
+    Memo cache of shot results. Shots are deterministic, so the frames,
+    balls sunk and elapsed time of a shot are stored under a hash of the
+    engine, the balls and the cue velocity, quantized to precision. The
+    most recently used size shots are kept in memory, with an optional
+    ShotCache table in the database shared by every process.
+    """
+
+    def __init__(self, size=SHOT_CACHE_SIZE, precision=SHOT_CACHE_PRECISION, database=False):
+        self.size = size
+        self.precision = precision
+        self.database = database
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, table: Table, xvel, yvel):
+        quantize = lambda value: round(value / self.precision)
+        balls = sorted((number, type, quantize(x), quantize(y), quantize(ball_xvel), quantize(ball_yvel))
+                       for type, number, x, y, ball_xvel, ball_yvel in table.balls())
+        state = (ENGINE, balls, quantize(xvel), quantize(yvel))
+        return hashlib.sha1(repr(state).encode()).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+        if entry is None and self.database:
+            db = Database()
+            entry = db.readCachedShot(key)
+            db.close()
+            if entry is not None:
+                self.remember(key, entry)
+        return entry
+
+    def put(self, key, entry):
+        self.remember(key, entry)
+        if self.database:
+            db = Database()
+            db.writeCachedShot(key, entry)
+            db.close()
+
+    def remember(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def store(self, key, start, elapsed, balls_sunk, segments):
+        """
+        Builds the entry of a shot from the lists of frames simulate_segments
+        yielded for it, with times relative to start, and puts it in the cache.
+        """
+        frames = [frame for segment in segments for frame in segment]
+        balls = [frame.balls() for frame in frames]
+        self.put(key, (elapsed, pack_blob("B", balls_sunk), pack_blob("d", [frame.time - start for frame in frames]),
+                       pack_blob("B", [len(frame) for frame in balls]),
+                       pack_blob("d", [value for frame in balls for ball in frame for value in ball])))
+
+    def segments(self, table: Table, xvel, yvel, defer=None):
+        """
+        Cached version of simulate_segments. A hit yields every frame at once
+        without running the physics, frame times are moved to start at
+        table.time. Shots that never stopped are not cached. On a miss the
+        shot is stored from the frames already yielded, before returning, or
+        by calling the function passed to defer when given, so the caller can
+        store it once it has answered (see run_shot).
+        """
+        key = self.key(table, xvel, yvel)
+        start = table.time
+        entry = self.get(key)
+        if entry is None:
+            self.misses += 1
+            process_metrics().count("shot_cache_misses")
+            segments = []
+            shot = simulate_segments(table, xvel, yvel)
+            while True:
+                try:
+                    segment = next(shot)
+                except StopIteration as stop:
+                    elapsed, balls_sunk, tables = stop.value
+                    break
+                segments.append(segment)
+                yield segment
+            if elapsed >= 0:
+                store = functools.partial(self.store, key, start, elapsed, balls_sunk, segments)
+                if defer is None:
+                    store()
+                else:
+                    defer(store)
+            return elapsed, balls_sunk, tables
+
+        self.hits += 1
+        process_metrics().count("shot_cache_hits")
+        elapsed, sunk, times, counts, balls = entry
+        tables = make_frames([time + start for time in unpack_blob("d", times)], unpack_blob("B", counts), unpack_blob("d", balls))
+        yield tables
+        return elapsed, list(unpack_blob("B", sunk)), tables
+
+
+cache: ShotCache = None # Cache of this process, see shot_cache
+
+def shot_cache():
+    """
+    Returns the ShotCache of the current process, backed by the database.
+    """
+    global cache
+    if cache is None:
+        cache = ShotCache(database=True)
+    return cache
+
+
+def assign_balls(own, other, balls_sunk):
+    """
+    Returns the (own, other) balls of the player who shot after a shot that
+    sank balls_sunk, in the order they fell. While the table is open both
+    are empty, and the first object ball sunk gives the player its group,
+    low (1-7) or high (9-15).
+    """
+    balls = [ball for ball in balls_sunk if ball != BLACK_NUMBER and ball != CUE_NUMBER]
+    if (len(own) == 0 or len(other) == 0) and len(balls) != 0:
+        low, high = list(range(1, 8)), list(range(9, 16))
+        return (low, high) if balls[0] in low else (high, low)
+    return own, other
+
+def black_wins(own, balls_left):
+    """
+    Returns True if the player who sank the black wins the game, with own
+    their balls after the shot (see assign_balls): only if none are left.
+    A player with no group yet has none left.
+    """
+    return not any(ball in own for ball in balls_left)
+
+
 class Game():
     def __init__(self, gameID=None, gameName=None, player1Name=None, player2Name=None):
         self.gameID = gameID
         self.gameName = gameName
         self.player1Name = player1Name
         self.player2Name = player2Name
-        self.balls = {f'{player1Name}': [], f"{player2Name}": []}
         self.low = None
+        self.table = None # Table and player to shoot of the last snapshot, see save
+        self.current_player = None
+        self.version = 0 # Of the last snapshot, see Database.writeSnapshot
         self.db = Database()
         self.db.createDB()
         if self.is_new_game():
             # String values will be provided for all three names
             self.gameID = self.db.writeGame(self.gameName, self.player1Name, self.player2Name)
+            self.balls = {f'{self.player1Name}': [], f"{self.player2Name}": []}
         else:
             # The gameID will be provided
             self.gameID += 1
             self.gameName, self.player1Name, self.player2Name = self.db.readGame(self.gameID)
+            self.balls = {f'{self.player1Name}': [], f"{self.player2Name}": []}
+            snapshot = self.db.readSnapshot(self.gameID)
+            if snapshot is not None:
+                # Resume where the game was left
+                self.table, self.current_player, low, self.version = snapshot
+                if low is not None:
+                    self.set_low(low)
         self.db.close()
             
         
@@ -502,73 +1281,65 @@ class Game():
     def other_player(self, name):
         return self.player2Name if name == self.player1Name else self.player1Name
 
+    def set_low(self, playerName):
+        self.balls[playerName] = list(range(1, 8))
+        self.balls[self.other_player(playerName)] = list(range(9, 16))
+        self.low = playerName
+
+    def save(self, table: Table, current_player, sessionID=None):
+        """
+        Stores a snapshot of the game, the table, the player to shoot and
+        the low/high assignment, so it can be resumed with Game(gameID).
+        Returns False without storing it if another server saved a newer
+        snapshot since this game was loaded.
+        """
+        db = Database()
+        version = db.writeSnapshot(self.gameID, table, current_player, self.low, sessionID, self.version)
+        db.close()
+        if version is None:
+            return False
+        self.table = table
+        self.current_player = current_player
+        self.version = version
+        return True
+
     def shoot(self, gameName, playerName, table: Table, xvel, yvel):
-        original_table = phylib.phylib_copy_table(table)
-        original_table.__class__ = Table
-        original_table.current = -1
-        cueBall = table.get_cue()
-        temp_cue = StillBall(0, Coordinate(cueBall.obj.still_ball.pos.x, cueBall.obj.still_ball.pos.y))
-
-        # Convert ball to rolling and set ball attributes
-        pos = Coordinate(cueBall.obj.still_ball.pos.x, cueBall.obj.still_ball.pos.y)
-        vel = Coordinate(xvel, yvel)
-        if (phylib.phylib_length(vel) > VEL_EPSILON):
-            acc = Coordinate(float(-vel.x / phylib.phylib_length(vel) * DRAG), float(-vel.y / phylib.phylib_length(vel) * DRAG))
-        else:
-            acc = Coordinate(0, 0) # Ball should not be moving
-        cueBall.type = phylib.PHYLIB_ROLLING_BALL
-        cueBall.obj.rolling_ball.number = 0
-        cueBall.obj.rolling_ball.pos.x = pos.x
-        cueBall.obj.rolling_ball.pos.y = pos.y
-        cueBall.obj.rolling_ball.vel.x = vel.x
-        cueBall.obj.rolling_ball.vel.y = vel.y
-        cueBall.obj.rolling_ball.acc.x = acc.x
-        cueBall.obj.rolling_ball.acc.y = acc.y
-
-        # Run segment
-        count = 0
-        tables = []
-        balls_sunk = []
-        full_start = table.time
-        while table:
-            count += 1
-            start = table.time
-            temp_table = table
-            table = table.segment()
-            if table:
-                end = table.time
-                elapsed = math.floor((end - start) / FRAME_RATE)
-                for i in range(elapsed):
-                    time = i * FRAME_RATE
-                    new_table = temp_table.roll(time)
-                    new_table.time = start + time
-                    tables.append(new_table)
-                tables.append(table)
-                balls_sunk.extend(segment_sunk(temp_table, table))
-            if not table:
-                full_elapsed = temp_table.time - full_start
-                # Only write table at the end of the segment
-                if CUE_NUMBER in balls_sunk:
-                    temp_table += temp_cue
-                    tables.append(temp_table)
-                if BLACK_NUMBER in balls_sunk:
-                    tables.append(Table()) # Empty table
-            if count > MAX_COUNT:
-                return None, -1, None, [original_table]
-        
+        """
+        Runs a shot to completion and returns (next_player, elapsed,
+        balls_sunk, tables), see shoot_segments. tables is a ShotFrames,
+        frames are only rolled when they are read.
+        """
+        shot = self.shoot_segments(gameName, playerName, table, xvel, yvel)
+        while True:
+            try:
+                next(shot)
+            except StopIteration as stop:
+                return stop.value
 
+    def shoot_segments(self, gameName, playerName, table: Table, xvel, yvel):
+        """
+        Generator version of shoot that yields the frames of each segment as
+        soon as it has been computed. The (next_player, elapsed, balls_sunk,
+        tables) result is the value of the final StopIteration.
+        """
+        elapsed, balls_sunk, tables = yield from simulate_segments(table, xvel, yvel)
+        if elapsed < 0:
+            return None, elapsed, None, tables
+        return self.next_player(playerName, balls_sunk), elapsed, balls_sunk, tables
+
+    def next_player(self, playerName, balls_sunk):
+        """
+        Applies the balls sunk by a shot to the game and returns the player
+        that shoots next, or None once the black ball is sunk.
+        """
         # Simple game logic required for A4
         # Assign high and low balls to players
-        balls = [ball for ball in balls_sunk if ball != BLACK_NUMBER and ball != CUE_NUMBER]
-        if (len(self.balls[playerName]) == 0 or len(self.balls[self.other_player(playerName)]) == 0) and len(balls) != 0:
-            if balls[0] in range(1, 8): # 1-7
-                self.balls[playerName] = list(range(1, 8))
-                self.balls[self.other_player(playerName)] = list(range(9, 16))
-                self.low = playerName
+        own, other = assign_balls(self.balls[playerName], self.balls[self.other_player(playerName)], balls_sunk)
+        if own != self.balls[playerName]:
+            if own[0] in range(1, 8): # 1-7
+                self.set_low(playerName)
             else: # 9-15
-                self.balls[playerName] = list(range(9, 16))
-                self.balls[self.other_player(playerName)] = list(range(1, 8))
-                self.low = self.other_player(playerName)
+                self.set_low(self.other_player(playerName))
         
         # Determine next player
         if BLACK_NUMBER in balls_sunk:
@@ -580,19 +1351,248 @@ class Game():
       
         # NOTE: the above logic does not handle states which determine victory or defeat, it only returns None
         # as the next player. Handling this is the responsiblity of the server. 
-        return next_player, full_elapsed, balls_sunk, tables
-        
-def segment_sunk(table_before: Table, table_after: Table):
+        return next_player
+
+
+class FrameEncoder():
+    """
+    Encodes the frames returned by Game.shoot as a compact animation.
+    A keyframe {"k": [number, x, y, ...]} lists every ball and is written for
+    the first frame, at segment boundaries and whenever the set of balls
+    changes. Every other frame is a flat [number, dx, dy, ...] list of the
+    balls that moved since the previous frame. Positions are truncated to
+    integers like the %d in the SVG output.
+    """
+
+    def __init__(self):
+        self.previous = None
+
+    def encode(self, tables):
+        """
+        Encodes the next frames of a shot, deltas carry on from the last call
+        so a shot can be encoded one segment at a time.
+        """
+        frames = []
+        for table in tables:
+            current = {number: (int(x), int(y)) for _, number, x, y, _, _ in table.balls()}
+            previous = self.previous
+            if previous is None or not isinstance(table, Frame) or current.keys() != previous.keys():
+                frames.append({"k": [value for number, (x, y) in current.items() for value in (number, x, y)]})
+            else:
+                delta = []
+                for number, (x, y) in current.items():
+                    dx, dy = x - previous[number][0], y - previous[number][1]
+                    if dx or dy:
+                        delta.extend((number, dx, dy))
+                frames.append(delta)
+            self.previous = current
+        return frames
+
+
+def encode_frames(tables):
+    return {"rate": FRAME_RATE, "frames": FrameEncoder().encode(tables)}
+
+def strike(table: Table, xvel, yvel):
+    """
+    Sets the still cue ball of table rolling with velocity (xvel, yvel).
+    """
+    cueBall = table.get_cue()
+    # Convert ball to rolling and set ball attributes
+    pos = Coordinate(cueBall.obj.still_ball.pos.x, cueBall.obj.still_ball.pos.y)
+    vel = Coordinate(xvel, yvel)
+    if (phylib.phylib_length(vel) > VEL_EPSILON):
+        acc = Coordinate(float(-vel.x / phylib.phylib_length(vel) * DRAG), float(-vel.y / phylib.phylib_length(vel) * DRAG))
+    else:
+        acc = Coordinate(0, 0) # Ball should not be moving
+    cueBall.type = phylib.PHYLIB_ROLLING_BALL
+    cueBall.obj.rolling_ball.number = 0
+    cueBall.obj.rolling_ball.pos.x = pos.x
+    cueBall.obj.rolling_ball.pos.y = pos.y
+    cueBall.obj.rolling_ball.vel.x = vel.x
+    cueBall.obj.rolling_ball.vel.y = vel.y
+    cueBall.obj.rolling_ball.acc.x = acc.x
+    cueBall.obj.rolling_ball.acc.y = acc.y
+
+def simulate_segments(table: Table, xvel, yvel):
+    """
+    Shoots the cue ball of table and yields the frames of each segment as soon
+    as it has been computed. The (elapsed, balls_sunk, tables) result is the
+    value of the final StopIteration, where tables is a ShotFrames of the
+    whole shot and elapsed is -1 if the shot never stopped.
+    """
+    original_table = phylib.phylib_copy_table(table)
+    original_table.__class__ = Table
+    cueBall = table.get_cue()
+    temp_cue = StillBall(0, Coordinate(cueBall.obj.still_ball.pos.x, cueBall.obj.still_ball.pos.y))
+    strike(table, xvel, yvel)
+
+    # Run one segment at a time, so the first frames are out after a single segment
+    metrics = process_metrics()
+    full_start = table.time
     balls_sunk = []
-    for ball_before in iter(table_before):
-        if isinstance(ball_before, StillBall) or isinstance(ball_before, RollingBall):
-            found = False
-            for ball_after in iter(table_after):
-                if isinstance(ball_after, StillBall) or isinstance(ball_after, RollingBall):
-                    if ball_before.number() == ball_after.number():
-                        found = True
-                        table_after.current = -1
-                        break
-            if not found:
-                balls_sunk.append(ball_before.number())
-    return balls_sunk
\ No newline at end of file
+    shot = ShotFrames(table)
+    for k in range(MAX_COUNT):
+        with metrics.timer("segment"):
+            segment = shot.tables[-1].segment()
+        if segment is None:
+            break
+        shot.append(segment)
+        if segment.event.hit == phylib.PHYLIB_HOLE:
+            balls_sunk.append(segment.event.ball)
+        with metrics.timer("frames"):
+            frames = shot.segment(k)
+        metrics.count("frames", len(frames) - 1)
+        yield frames
+    else:
+        # Same limit as Table.shoot
+        return -1, None, ShotFrames(original_table, [], [original_table])
+
+    # Only write table at the end of the segment
+    table = shot.tables[-1]
+    if CUE_NUMBER in balls_sunk:
+        table += temp_cue
+        shot.extra.append(table)
+    if BLACK_NUMBER in balls_sunk:
+        shot.extra.append(Table()) # Empty table
+    yield list(shot.extra)
+    return table.time - full_start, balls_sunk, shot
+
+def simulate_batch(tables, velocities, max_count=MAX_COUNT):
+    """
+    Shoots the cue ball of each table with the (xvel, yvel) of velocities
+    and runs every shot to rest in one call to phylib_batch (see phylib.i),
+    on SOA_ENGINE and with OpenMP threads when phylib was built with them.
+    The tables are left untouched. Returns an (elapsed, balls_sunk, balls,
+    segments) tuple per shot, where balls_sunk lists the balls in the order
+    they fell like simulate_segments, balls describes the final table like
+    Table.balls and elapsed is -1 if the shot never stopped.
+    """
+    results = []
+    for elapsed, segments, balls_sunk, balls in phylib.phylib_shoot_batch(tables, velocities, max_count):
+        results.append((elapsed if segments >= 0 else -1, balls_sunk, balls, segments))
+    return results
+
+def make_new_table(seed=None):
+    """
+    Makes a new table with a full set of balls, racked with up to 1 mm of
+    jitter on each axis. The jitter comes from random, or from its own
+    random.Random(seed) when a seed is given so the rack can be repeated.
+    """
+    rng = random if seed is None else random.Random(seed)
+    nudge = lambda: rng.uniform(-1, 1)
+    table = Table()
+    # Cue ball
+    pos = Coordinate(TABLE_WIDTH/2.0, TABLE_LENGTH - TABLE_WIDTH/2.0)
+    cue = StillBall(0, pos)
+    table += cue
+
+    # All balls from front to back (left to right each row)
+    # Row 1
+    pos = Coordinate(TABLE_WIDTH / 2.0 + nudge(), TABLE_WIDTH / 2.0 + nudge())
+    sb = StillBall(1, pos)
+    table += sb
+    # Row 2
+    pos = Coordinate(TABLE_WIDTH/2.0 - (BALL_DIAMETER+4.0)/2.0 + nudge(), TABLE_WIDTH/2.0 - math.sqrt(3.0)/2.0*(BALL_DIAMETER+4.0) + nudge())
+    sb = StillBall(2, pos)
+    table += sb
+    pos = Coordinate(TABLE_WIDTH/2.0 + (BALL_DIAMETER+4.0)/2.0 + nudge(), TABLE_WIDTH/2.0 - math.sqrt(3.0)/2.0*(BALL_DIAMETER+4.0) + nudge())
+    sb = StillBall(9, pos)
+    table += sb
+    # Row 3
+    pos = Coordinate(TABLE_WIDTH/2.0 - 2.0*(BALL_DIAMETER+4.0)/2.0 + nudge(), TABLE_WIDTH/2.0 - 2.0*math.sqrt(3.0)/2.0*(BALL_DIAMETER+4.0) + nudge())
+    sb = StillBall(3, pos)
+    table += sb
+    pos = Coordinate(TABLE_WIDTH/2.0 + nudge(), TABLE_WIDTH/2.0 - 2.0*math.sqrt(3.0)/2.0*(BALL_DIAMETER+4.0) + nudge())
+    sb = StillBall(8, pos)
+    table += sb
+    pos = Coordinate(TABLE_WIDTH/2.0 + 2.0*(BALL_DIAMETER+4.0)/2.0 + nudge(), TABLE_WIDTH/2.0 - 2.0*math.sqrt(3.0)/2.0*(BALL_DIAMETER+4.0) + nudge())
+    sb = StillBall(10, pos)
+    table += sb
+    # Row 4
+    pos = Coordinate(TABLE_WIDTH/2.0 - 3.0*(BALL_DIAMETER+4.0)/2.0 + nudge(), TABLE_WIDTH/2.0 - 3.0*math.sqrt(3.0)/2.0*(BALL_DIAMETER+4.0) + nudge())
+    sb = StillBall(4, pos)
+    table += sb
+    pos = Coordinate(TABLE_WIDTH/2.0 - (BALL_DIAMETER+4.0)/2.0 + nudge(), TABLE_WIDTH/2.0 - 3.0*math.sqrt(3.0)/2.0*(BALL_DIAMETER+4.0) + nudge())
+    sb = StillBall(14, pos)
+    table += sb
+    pos = Coordinate(TABLE_WIDTH/2.0 + (BALL_DIAMETER+4.0)/2.0 + nudge(), TABLE_WIDTH/2.0 - 3.0*math.sqrt(3.0)/2.0*(BALL_DIAMETER+4.0) + nudge())
+    sb = StillBall(7, pos)
+    table += sb
+    pos = Coordinate(TABLE_WIDTH/2.0 + 3.0*(BALL_DIAMETER+4.0)/2.0 + nudge(), TABLE_WIDTH/2.0 - 3.0*math.sqrt(3.0)/2.0*(BALL_DIAMETER+4.0) + nudge())
+    sb = StillBall(11, pos)
+    table += sb
+    # Row 5
+    pos = Coordinate(TABLE_WIDTH/2.0 - 4.0*(BALL_DIAMETER+4.0)/2.0 + nudge(), TABLE_WIDTH/2.0 - 4.0*math.sqrt(3.0)/2.0*(BALL_DIAMETER+4.0) + nudge())
+    sb = StillBall(12, pos)
+    table += sb
+    pos = Coordinate(TABLE_WIDTH/2.0 - 2.0*(BALL_DIAMETER+4.0)/2.0 + nudge(), TABLE_WIDTH/2.0 - 4.0*math.sqrt(3.0)/2.0*(BALL_DIAMETER+4.0) + nudge())
+    sb = StillBall(6, pos)
+    table += sb
+    pos = Coordinate(TABLE_WIDTH/2.0 + nudge(), TABLE_WIDTH/2.0 - 4.0*math.sqrt(3.0)/2.0*(BALL_DIAMETER+4.0) + nudge())
+    sb = StillBall(15, pos)
+    table += sb
+    pos = Coordinate(TABLE_WIDTH/2.0 + 2.0*(BALL_DIAMETER+4.0)/2.0 + nudge(), TABLE_WIDTH/2.0 - 4.0*math.sqrt(3.0)/2.0*(BALL_DIAMETER+4.0) + nudge())
+    sb = StillBall(13, pos)
+    table += sb
+    pos = Coordinate(TABLE_WIDTH/2.0 + 4.0*(BALL_DIAMETER+4.0)/2.0 + nudge(), TABLE_WIDTH/2.0 - 4.0*math.sqrt(3.0)/2.0*(BALL_DIAMETER+4.0) + nudge())
+    sb = StillBall(5, pos)
+    table += sb
+
+    return table
+
+def make_table(balls, time=0.0):
+    """
+    Builds a Table from (type, number, x, y, xvel, yvel) tuples, the
+    inverse of Table.balls. Used to send tables between processes.
+    """
+    table = Table()
+    table.time = time
+    for type, number, x, y, xvel, yvel in balls:
+        pos = Coordinate(x, y)
+        if type == phylib.PHYLIB_STILL_BALL:
+            table += StillBall(number, pos)
+        else:
+            vel = Coordinate(xvel, yvel)
+            if (phylib.phylib_length(vel) > VEL_EPSILON):
+                acc = Coordinate(float(-vel.x / phylib.phylib_length(vel) * DRAG), float(-vel.y / phylib.phylib_length(vel) * DRAG))
+            else:
+                acc = Coordinate(0, 0) # Ball should not be moving
+            table += RollingBall(number, pos, vel, acc)
+    return table
+
+def run_shot(balls, time, xvel, yvel, events, playerName, gameID):
+    """
+    Runs a shot in a worker process. The table is sent as Table.balls and
+    each segment is put on the events queue as ("frames", encoded frames),
+    followed by ("result", (elapsed, balls_sunk, balls, time, balls_left))
+    where balls and time describe the final table and balls_left lists the
+    balls on the table before the last one. The frames, and the shot for
+    the shot_cache on a miss, are queued on the process's shot_writer after
+    the result has been sent. The result is preceded by ("metrics",
+    snapshot) with the metrics of the process since its last shot, see
+    Metrics.drain.
+    """
+    metrics = process_metrics()
+    encoder = FrameEncoder()
+    stores = [] # Shots to cache, stored on the shot_writer once the result is out
+    shot = shot_cache().segments(make_table(balls, time), xvel, yvel, stores.append)
+    while True:
+        try:
+            segment = next(shot)
+        except StopIteration as stop:
+            elapsed, balls_sunk, tables = stop.value
+            break
+        with metrics.timer("encode"):
+            encoded = encoder.encode(segment)
+        events.put(("frames", encoded))
+    metrics.count_phylib()
+    events.put(("metrics", metrics.drain()))
+    if elapsed < 0:
+        events.put(("result", (elapsed, None, None, None, None)))
+        return
+    balls_left = tables[-2].balls_left() if len(tables) > 1 else []
+    events.put(("result", (elapsed, balls_sunk, tables[-1].balls(), tables[-1].time, balls_left)))
+    writer = shot_writer()
+    writer.write(playerName, gameID, tables)
+    for store in stores:
+        writer.call(store)
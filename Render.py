@@ -0,0 +1,73 @@
+import io
+import threading
+
+################################################################################
+# SVG fragments, the %d fields take the x and y of a ball
+CIRCLE     = """  <circle %s class="ball" cx="%%d" cy="%%d" r="%d" fill="%s" />\n"""
+CUE_ID     = 'id="cue"'
+FRAME      = b'<g id="frame-%d">\n'
+GROUP_END  = b"</g>\n"
+FLUSH_SIZE = 1 << 16 # Bytes buffered by write_frames before they are written out
+
+
+class Renderer():
+    """
+    Renders tables and frames as SVG from fragments prepared once: the
+    static background (header, cushions and holes) as a single block, and a
+    <circle> template per ball number in which only the coordinates are
+    filled in. Balls are (type, number, x, y, xvel, yvel) tuples like
+    Frame.balls. Output is bytes, returned or written straight to any
+    binary file such as an HTTP socket.
+    """
+
+    def __init__(self, background, footer, colours, radius):
+        self.background = background.encode()
+        self.footer = footer.encode()
+        # circles[include_id][number]
+        self.circles = [
+            [(CIRCLE % ("", radius, colour)).encode() for colour in colours],
+            [(CIRCLE % (CUE_ID if number == 0 else "", radius, colour)).encode() for number, colour in enumerate(colours)],
+        ]
+        self.local = threading.local()
+
+    def buffer(self):
+        """
+        Returns the emptied BytesIO of the calling thread, reused between calls.
+        """
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is None:
+            buffer = self.local.buffer = io.BytesIO()
+        buffer.seek(0)
+        buffer.truncate()
+        return buffer
+
+    def balls(self, balls, include_id=False):
+        circles = self.circles[include_id]
+        return b"".join([circles[number] % (x, y) for _, number, x, y, _, _ in balls])
+
+    def table(self, balls, include_id=False):
+        """
+        Returns a whole SVG document of the balls over the background.
+        """
+        return b"".join((self.background, self.balls(balls, include_id), self.footer))
+
+    def frame(self, index, balls, include_id=False):
+        return b"".join((FRAME % index, self.balls(balls, include_id), GROUP_END))
+
+    def write_table(self, out, balls, include_id=False):
+        out.write(self.table(balls, include_id))
+
+    def write_frames(self, out, frames, include_id=False, start=0):
+        """
+        Writes a <g id="frame-i"> group for every frame (anything with a
+        balls method, such as the items of a ShotFrames), numbered from
+        start. Groups are collected in the buffer of the calling thread and
+        written to out about FLUSH_SIZE bytes at a time.
+        """
+        buffer = self.buffer()
+        for index, frame in enumerate(frames, start):
+            buffer.write(self.frame(index, frame.balls(), include_id))
+            if buffer.tell() >= FLUSH_SIZE:
+                out.write(buffer.getvalue())
+                buffer = self.buffer()
+        out.write(buffer.getvalue())
@@ -0,0 +1,140 @@
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+
+from Physics import *
+
+################################################################################
+# Search settings
+MAX_SPEED     = 3000.0 # Fastest shot tried, the frontend allows about this much
+SPEEDS        = [750.0, 1500.0, 2250.0, MAX_SPEED]
+ANGLES        = 48     # Directions of the coarse pass
+REFINE        = 4      # Best shots refined by each fine pass
+CHUNK         = 8      # Shots evaluated per worker task
+TIME_BUDGET   = 2.0    # Seconds
+
+# Shot scores, following the rules of Game.next_player and the server
+WIN_SCORE     = 1000
+LOSS_SCORE    = -1000
+OWN_SCORE     = 10     # Per own ball sunk, the player shoots again
+OTHER_SCORE   = -5     # Per opponent ball sunk
+SCRATCH_SCORE = -50    # Cue ball sunk
+
+
+def run_chain(balls, start, xvel, yvel):
+    """
+    Runs the segments of a shot without generating frames. Returns the
+    numbers of the balls left on the final table and of the balls sunk in
+    the order they fell, or None if the shot never stopped.
+    """
+    table = make_table(balls, start)
+    strike(table, xvel, yvel)
+    tables, events = table.shoot()
+    if len(tables) >= MAX_COUNT:
+        return None
+    sunk = [event.ball for event in events if event.hit == phylib.PHYLIB_HOLE]
+    return (tables[-1].balls_left() if tables else table.balls_left()), sunk
+
+def score_shot(before, result, own, other):
+    """
+    Scores a shot from the ball numbers on the table before it and the
+    result of run_chain, own and other are the balls of the player and
+    their opponent (see player_balls).
+    """
+    if result is None:
+        return LOSS_SCORE # Never stopped, the server aborts such shots
+    after, balls_sunk = result
+    # Groups as the game assigns them after this shot
+    own, other = assign_balls(own, other, balls_sunk)
+    sunk = set(before) - set(after)
+    if BLACK_NUMBER in sunk:
+        return WIN_SCORE if black_wins(own, after) else LOSS_SCORE
+    score = OWN_SCORE * len(sunk & set(own)) + OTHER_SCORE * len(sunk & set(other))
+    if CUE_NUMBER in sunk:
+        score += SCRATCH_SCORE
+    return score
+
+def evaluate(balls, start, shots, own, other, deadline):
+    """
+    Scores each (xvel, yvel) of shots, runs in a worker process. Stops early
+    at the deadline (a time.time()) and returns the (score, xvel, yvel) of the
+    shots evaluated so far.
+    """
+    before = [ball[1] for ball in balls]
+    results = []
+    for xvel, yvel in shots:
+        if time.time() > deadline:
+            break
+        results.append((score_shot(before, run_chain(balls, start, xvel, yvel), own, other), xvel, yvel))
+    return results
+
+def player_balls(game: Game, playerName):
+    """
+    Returns the (own, other) balls of a player, both empty while the table
+    is open.
+    """
+    return game.balls[playerName], game.balls[game.other_player(playerName)]
+
+def velocity(angle, speed):
+    return (speed * math.cos(angle), speed * math.sin(angle))
+
+def coarse_shots(balls, own):
+    """
+    Every direction of the coarse pass plus shots straight at each own ball,
+    any ball but the cue and the black while the table is open, at each of
+    SPEEDS.
+    """
+    cue = next(ball for ball in balls if ball[1] == CUE_NUMBER)
+    targets = own or [number for number in range(1, 16) if number != BLACK_NUMBER]
+    angles = [2 * math.pi * i / ANGLES for i in range(ANGLES)]
+    angles += [math.atan2(ball[3] - cue[3], ball[2] - cue[2]) for ball in balls if ball[1] in targets]
+    return [velocity(angle, speed) for angle in angles for speed in SPEEDS]
+
+def fine_shots(best, angle_step, speed_step):
+    shots = []
+    for _, xvel, yvel in best:
+        angle = math.atan2(yvel, xvel)
+        speed = math.hypot(xvel, yvel)
+        for dangle in (-angle_step, 0, angle_step):
+            for dspeed in (-speed_step, 0, speed_step):
+                if dangle or dspeed:
+                    shots.append(velocity(angle + dangle, min(max(speed + dspeed, SPEEDS[0] / 2), MAX_SPEED)))
+    return shots
+
+def search(table: Table, own, other, time_budget=TIME_BUDGET, pool: ProcessPoolExecutor = None):
+    """
+    Searches for the best shot on a table of still balls within time_budget
+    seconds, fanning candidates out over pool (a new one if None). A coarse
+    pass over directions and speeds is followed by finer passes around the
+    best shots until the time is up. Returns (score, xvel, yvel), or None
+    if no shot could be evaluated in time.
+    """
+    deadline = time.time() + time_budget
+    balls = table.balls()
+    own_pool = pool is None
+    if own_pool:
+        pool = ProcessPoolExecutor()
+    results = []
+    shots = coarse_shots(balls, own)
+    angle_step = 2 * math.pi / ANGLES / 2
+    speed_step = (SPEEDS[1] - SPEEDS[0]) / 2
+    try:
+        while shots and time.time() < deadline:
+            tasks = [pool.submit(evaluate, balls, table.time, shots[i:i + CHUNK], own, other, deadline)
+                     for i in range(0, len(shots), CHUNK)]
+            done, pending = wait(tasks, timeout=max(deadline - time.time(), 0))
+            for task in done:
+                results.extend(task.result())
+            if pending:
+                # Out of time, workers stop at the deadline by themselves
+                for task in pending:
+                    task.cancel()
+                break
+            best = sorted(results, key=lambda result: result[0], reverse=True)[:REFINE]
+            shots = fine_shots(best, angle_step, speed_step)
+            angle_step /= 2
+            speed_step /= 2
+    finally:
+        if own_pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+    return max(results, key=lambda result: result[0]) if results else None
@@ -0,0 +1,83 @@
+"""
+Counts the blocks phylib allocates while a long shot on a seeded
+make_new_table runs to rest with Table.shoot, on every engine, along with
+the time it takes. The counts come from the allocations counter of
+phylib_take_counts (see phylib_alloc). The results are saved as JSON, and
+compared against the JSON of an earlier run when one is given.
+Command: python benchmarks/bench_alloc.py [output.json] [baseline.json]
+"""
+import os
+import sys
+import json
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+OUTPUT = os.path.abspath(sys.argv[1]) if len(sys.argv) > 1 else None
+BASELINE = os.path.abspath(sys.argv[2]) if len(sys.argv) > 2 else None
+from Physics import *
+
+ROUNDS = 3 # Best of
+SHOT = (-20.0, -3000.0) # Full break, the longest shot of bench_suite
+ENGINES = {"step": STEP_ENGINE, "event": EVENT_ENGINE, "soa": SOA_ENGINE}
+
+def struck_table():
+    table = make_new_table(RACK_SEED)
+    strike(table, *SHOT)
+    return table
+
+def run_shot(engine):
+    """
+    Returns the segments of the shot and the blocks phylib allocated for it.
+    """
+    table = struck_table()
+    phylib.phylib_take_counts()
+    tables, events = table.shoot(engine)
+    return len(tables), phylib.phylib_take_counts()["allocations"]
+
+def bench_engine(engine):
+    elapsed = math.inf
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        segments, allocations = run_shot(engine)
+        elapsed = min(elapsed, time.perf_counter() - start)
+    return {
+        "segments": segments,
+        "allocations": allocations,
+        "allocations_per_segment": allocations / segments,
+        "shot_ms": elapsed * 1000,
+    }
+
+def compare(results, baseline):
+    for name, metrics in results["engines"].items():
+        old = baseline["engines"].get(name)
+        if old is None:
+            continue
+        print(f"{name} against baseline")
+        for metric, value in metrics.items():
+            if old.get(metric):
+                print(f"  {metric:24} {value / old[metric]:8.2f}x")
+
+if __name__ == "__main__":
+    if not phylib.cvar.phylib_counting:
+        sys.exit("phylib counters are off, unset POOL_METRICS=0")
+    results = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "seed": RACK_SEED,
+        "shot": SHOT,
+        "rounds": ROUNDS,
+        "engines": {},
+    }
+    for name, engine in ENGINES.items():
+        metrics = bench_engine(engine)
+        results["engines"][name] = metrics
+        print(name)
+        for metric, value in metrics.items():
+            print(f"  {metric:24} {value:12.1f}")
+
+    if OUTPUT:
+        with open(OUTPUT, "w") as file:
+            json.dump(results, file, indent=2)
+    if BASELINE:
+        with open(BASELINE) as file:
+            compare(results, json.load(file))
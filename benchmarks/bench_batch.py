@@ -0,0 +1,35 @@
+"""
+Compares the shots/sec of simulate_batch, which runs every shot to rest in
+one C call, against a Python loop over Table.segment per shot.
+Command: python benchmarks/bench_batch.py [shots]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Physics import *
+from bench_threads import run_break
+
+def python_shots(tables, velocities):
+    for table, (xvel, yvel) in zip(tables, velocities):
+        table = make_table(table.balls())
+        strike(table, xvel, yvel)
+        run_break(table)
+
+if __name__ == "__main__":
+    shots = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    tables = [make_new_table(RACK_SEED) for _ in range(shots)]
+    velocities = [(math.sin(i) * 100.0, -2500.0) for i in range(shots)]
+    print(f"{shots} breaks")
+
+    start = time.perf_counter()
+    python_shots(tables, velocities)
+    loop = shots / (time.perf_counter() - start)
+    print(f"{'Table.segment loop':20} {loop:10.1f} shots/sec")
+
+    start = time.perf_counter()
+    results = simulate_batch(tables, velocities)
+    batch = shots / (time.perf_counter() - start)
+    print(f"{'simulate_batch':20} {batch:10.1f} shots/sec")
+    print(f"speedup {batch / loop:.2f}x, {sum(result[3] for result in results)} segments")
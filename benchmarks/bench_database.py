@@ -0,0 +1,64 @@
+"""
+Compares the rows/sec of Database.writeTables and writeShotFrames against
+writing a shot one table at a time with writeTable and writeTableShot.
+Command: python benchmarks/bench_database.py [shots]
+"""
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Physics import *
+
+ROUNDS = 3 # Best of
+
+def make_shot():
+    # Break of the rack
+    shot = simulate_segments(make_new_table(RACK_SEED), 30.0, -2500.0)
+    while True:
+        try:
+            next(shot)
+        except StopIteration as stop:
+            return stop.value[2]
+
+def count_rows(tables):
+    # TTable and TableShot per table, Ball and BallTable per ball
+    return sum(2 + 2 * len(table.balls()) for table in tables)
+
+def write_rows(db, tables, shotID):
+    for table in tables:
+        tableID = db.writeTable(table, False)
+        db.writeTableShot(tableID + 1, shotID, False)
+    db.conn.commit()
+
+def bench(name, write, tables, shots, journal=True):
+    db = Database(reset=True)
+    if not journal:
+        # SQLite defaults used before the write-ahead log
+        db.conn.execute("PRAGMA journal_mode=DELETE")
+        db.conn.execute("PRAGMA synchronous=FULL")
+    db.createDB()
+    gameID = db.writeGame("bench", "p1", "p2")
+    elapsed = math.inf
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        for _ in range(shots):
+            write(db, tables, db.writeShot("p1", gameID))
+        elapsed = min(elapsed, time.perf_counter() - start)
+    db.close()
+    rows = count_rows(tables) * shots
+    print(f"{name:24} {rows:9d} rows {elapsed:8.3f} s {rows / elapsed:12.0f} rows/sec")
+    return rows / elapsed
+
+if __name__ == "__main__":
+    shots = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    tables = make_shot()
+    os.chdir(tempfile.mkdtemp()) # Keep phylib.db of the server untouched
+    print(f"{shots} shots of {len(tables)} tables")
+    old = bench("writeTable (no WAL)", write_rows, tables, shots, journal=False)
+    rows = bench("writeTable", write_rows, tables, shots)
+    batch = bench("writeTables", lambda db, tables, shotID: db.writeTables(tables, shotID), tables, shots)
+    print(f"speedup {batch / old:.2f}x over writeTable without WAL, {batch / rows:.2f}x with WAL")
+    blob = bench("writeShotFrames", lambda db, tables, shotID: db.writeShotFrames(shotID, tables), tables, shots)
+    print(f"speedup {blob / old:.2f}x over writeTable without WAL (same rows as one ShotFrames row per shot)")
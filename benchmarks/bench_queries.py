@@ -0,0 +1,87 @@
+"""
+Times the replay and analytics queries of Database on a synthetic database,
+without and with the secondary indexes of Database.createIndexes.
+Command: python benchmarks/bench_queries.py [shots] [frames per shot]
+"""
+import os
+import sys
+import time
+import random
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Physics import *
+
+SHOTS_PER_GAME = 100
+BALLS = 16
+INDEXES = ["BallTableIndex", "TableShotIndex", "ShotGameIndex", "ShotPlayerIndex", "PlayerNameIndex", "PlayerGameIndex"]
+
+def make_database(shots, frames):
+    db = Database(reset=True)
+    db.createDB()
+    games = (shots + SHOTS_PER_GAME - 1) // SHOTS_PER_GAME
+    db.conn.executemany("""INSERT INTO Game (GAMEID, GAMENAME) VALUES (?, ?)""",
+                        [(game, f"game{game}") for game in range(1, games + 1)])
+    db.conn.executemany("""INSERT INTO Player (PLAYERID, GAMEID, PLAYERNAME) VALUES (?, ?, ?)""",
+                        [(2 * game - side, game, f"player{(game + side) % 50}") for game in range(1, games + 1) for side in (1, 0)])
+    db.conn.executemany("""INSERT INTO Shot (SHOTID, PLAYERID, GAMEID) VALUES (?, ?, ?)""",
+                        [(shot, 2 * game - shot % 2, game) for shot in range(1, shots + 1)
+                         for game in [(shot - 1) // SHOTS_PER_GAME + 1]])
+    # Rows are written a chunk of shots at a time to bound memory
+    tableID = 1
+    ballID = 1
+    for first in range(1, shots + 1, 1000):
+        ttables = []
+        table_shots = []
+        balls = []
+        ball_tables = []
+        for shot in range(first, min(first + 1000, shots + 1)):
+            for frame in range(frames):
+                ttables.append((tableID, frame * FRAME_RATE))
+                table_shots.append((tableID, shot))
+                for number in range(BALLS):
+                    balls.append((ballID, number, random.uniform(0, TABLE_WIDTH), random.uniform(0, TABLE_LENGTH)))
+                    ball_tables.append((ballID, tableID))
+                    ballID += 1
+                tableID += 1
+        db.conn.executemany("""INSERT INTO TTable (TABLEID, TIME) VALUES (?, ?)""", ttables)
+        db.conn.executemany("""INSERT INTO Ball (BALLID, BALLNO, XPOS, YPOS) VALUES (?, ?, ?, ?)""", balls)
+        db.conn.executemany("""INSERT INTO BallTable (BALLID, TABLEID) VALUES (?, ?)""", ball_tables)
+        db.conn.executemany("""INSERT INTO TableShot (TABLEID, SHOTID) VALUES (?, ?)""", table_shots)
+    db.conn.commit()
+    return db, games
+
+def bench(name, query, samples):
+    start = time.perf_counter()
+    for _ in range(samples):
+        query()
+    elapsed = (time.perf_counter() - start) / samples
+    print(f"  {name:16} {elapsed * 1000:10.3f} ms")
+
+def bench_queries(db, shots, games, samples):
+    bench("readShot", lambda: db.readShot(random.randint(1, shots)), samples)
+    bench("readTable", lambda: db.readTable(random.randint(0, shots - 1)), samples)
+    bench("readFinalTables", lambda: db.readFinalTables(random.randint(1, games)), samples)
+    bench("readShotCounts", lambda: db.readShotCounts(random.randint(1, games)), samples)
+    game = random.randint(1, games)
+    bench("writeShot", lambda: db.writeShot(db.readGame(game)[1], game), samples)
+
+if __name__ == "__main__":
+    shots = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    frames = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    os.chdir(tempfile.mkdtemp()) # Keep phylib.db of the server untouched
+    random.seed(0)
+    start = time.perf_counter()
+    db, games = make_database(shots, frames)
+    print(f"{shots} shots of {frames} tables in {games} games, built in {time.perf_counter() - start:.1f} s")
+
+    for index in INDEXES:
+        db.conn.execute(f"DROP INDEX {index}")
+    print("without indexes")
+    bench_queries(db, shots, games, 5)
+
+    start = time.perf_counter()
+    db.createIndexes()
+    print(f"with indexes (built in {time.perf_counter() - start:.1f} s)")
+    bench_queries(db, shots, games, 500)
+    db.close()
@@ -0,0 +1,61 @@
+"""
+Times rendering the frames of a seeded break as SVG, in frames rendered
+per second: the % template and string concatenation that Frame.balls_svg
+used before Render, Frame.balls_svg on the Renderer, and
+Renderer.write_frames straight into a file. Also times Table.svg.
+Command: python benchmarks/bench_render.py [frames]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Physics import *
+
+ROUNDS = 5 # Best of
+
+def make_frames(count):
+    table = make_new_table(RACK_SEED)
+    shot = simulate_segments(table, -20.0, -3000.0)
+    while True:
+        try:
+            next(shot)
+        except StopIteration as stop:
+            frames = list(stop.value[2])
+            break
+    # Repeat the break up to count frames
+    return (frames * (count // len(frames) + 1))[:count]
+
+def template_svg(frame, index, include_id=False):
+    contents = ""
+    for _, number, x, y, _, _ in frame.balls():
+        contents += """  <circle %s class="ball" cx="%d" cy="%d" r="%d" fill="%s" />\n""" % ('id="cue"' if number == 0 and include_id else '',
+                                                                           x, y, BALL_RADIUS, BALL_COLOURS[number])
+    return f'<g id="frame-{index}">\n{contents}</g>\n'
+
+def best(function):
+    elapsed = math.inf
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        function()
+        elapsed = min(elapsed, time.perf_counter() - start)
+    return elapsed
+
+def write_file(frames):
+    with open(os.devnull, "wb") as file:
+        RENDERER.write_frames(file, frames)
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    frames = make_frames(count)
+    tables = [make_table(frame.balls()) for frame in frames[:count // 10]]
+    results = {
+        "template": best(lambda: "".join(template_svg(frame, i) for i, frame in enumerate(frames))),
+        "balls_svg": best(lambda: "".join(frame.balls_svg(i) for i, frame in enumerate(frames))),
+        "write_frames": best(lambda: write_file(frames)),
+    }
+    base = count / results["template"]
+    for name, elapsed in results.items():
+        print(f"{name:14} {count / elapsed:12.0f} frames/sec {count / elapsed / base:6.2f}x")
+    elapsed = best(lambda: [table.svg() for table in tables])
+    print(f"{'Table.svg':14} {len(tables) / elapsed:12.0f} tables/sec")
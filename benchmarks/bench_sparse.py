@@ -0,0 +1,59 @@
+"""
+Times the same shot on a seeded make_new_table with fewer and fewer object
+balls left, as when balls have been pocketed: steps/sec and ms per shot of
+every engine with Table.shoot, frames/sec of Table.frames over the shot and
+tables/sec of iterating a Table. Engines and frames walk the slot index of
+the table (see phylib_index), so the cost should drop with the balls.
+Command: python benchmarks/bench_sparse.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Physics import *
+
+ROUNDS = 5 # Best of
+SHOT = (2600.0, 1500.0) # Long roll off several cushions, as in bench_suite
+BALLS_LEFT = [15, 7, 3, 0] # Object balls kept besides the cue ball
+ENGINES = {"step": STEP_ENGINE, "event": EVENT_ENGINE, "soa": SOA_ENGINE}
+ITERATIONS = 1000 # Loops over the table per round
+
+def sparse_table(left):
+    balls = [ball for ball in make_new_table(RACK_SEED).balls() if ball[1] <= left]
+    table = make_table(balls)
+    strike(table, *SHOT)
+    return table
+
+def best(function):
+    elapsed = math.inf
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        function()
+        elapsed = min(elapsed, time.perf_counter() - start)
+    return elapsed
+
+def bench_table(left):
+    table = sparse_table(left)
+    results = {}
+    for name, engine in ENGINES.items():
+        tables, events = table.shoot(engine)
+        steps = sum(segment.steps for segment in tables)
+        elapsed = best(lambda: table.shoot(engine))
+        results[f"{name}_ms"] = elapsed * 1000
+        if steps:
+            results[f"{name}_steps/sec"] = steps / elapsed
+    tables, events = table.shoot()
+    starts = [table] + tables[:-1]
+    count = sum(phylib.phylib_frame_count(0.0, end.time - start.time, FRAME_RATE) for start, end in zip(starts, tables))
+    elapsed = best(lambda: [start.frames(0.0, end.time - start.time) for start, end in zip(starts, tables)])
+    results["frames/sec"] = count / elapsed
+    elapsed = best(lambda: [list(table) for _ in range(ITERATIONS)])
+    results["iterations/sec"] = ITERATIONS / elapsed
+    return results
+
+if __name__ == "__main__":
+    for left in BALLS_LEFT:
+        print(f"{left} object balls")
+        for metric, value in bench_table(left).items():
+            print(f"  {metric:20} {value:12.3f}")
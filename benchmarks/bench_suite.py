@@ -0,0 +1,154 @@
+"""
+Runs a fixed set of shots on a seeded make_new_table and reports, per shot,
+segments/sec of Table.segment, frames/sec of Table.frames, the SVG bytes and
+ms of the animation, ms for the whole shot, DB rows/sec of writeTable and
+writeShotFrames and the peak Python memory. The results are saved as JSON,
+and compared against the JSON of an earlier run when one is given.
+Command: python benchmarks/bench_suite.py [output.json] [baseline.json]
+"""
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+OUTPUT = os.path.abspath(sys.argv[1]) if len(sys.argv) > 1 else None
+BASELINE = os.path.abspath(sys.argv[2]) if len(sys.argv) > 2 else None
+os.chdir(tempfile.mkdtemp()) # Database(reset=True) replaces phylib.db, keep the real one untouched
+from Physics import *
+
+ROUNDS = 3 # Best of
+# Canonical shots as (xvel, yvel) of the cue ball
+SHOTS = {
+    "soft_tap": (0.0, -800.0), # Just reaches the rack
+    "full_break": (-20.0, -3000.0), # Fastest shot of the frontend
+    "long_roll": (2600.0, 1500.0), # Away from the rack, off several cushions
+}
+
+def new_table():
+    return make_new_table(RACK_SEED)
+
+def run_segments(xvel, yvel):
+    """
+    Returns the tables at the start of every segment and the final table.
+    """
+    table = new_table()
+    strike(table, xvel, yvel)
+    tables = [table]
+    while table:
+        table = table.segment()
+        if table:
+            tables.append(table)
+        if len(tables) > MAX_COUNT:
+            break
+    return tables
+
+def best(function):
+    elapsed = math.inf
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        result = function()
+        elapsed = min(elapsed, time.perf_counter() - start)
+    return elapsed, result
+
+def roll_frames(tables):
+    frames = []
+    for table, next_table in zip(tables, tables[1:]):
+        frames.extend(table.frames(table.time, next_table.time))
+    return frames
+
+def make_svg(frames):
+    return "".join(frame.balls_svg(i) for i, frame in enumerate(frames))
+
+def write_rows(tables, frames):
+    db = Database(reset=True)
+    db.createDB()
+    gameID = db.writeGame("bench", "p1", "p2")
+    shotID = db.writeShot("p1", gameID)
+    for frame in frames:
+        db.writeTableShot(db.writeTable(frame, False) + 1, shotID, False)
+    db.conn.commit()
+    db.close()
+
+def write_blob(tables, frames):
+    db = Database(reset=True)
+    db.createDB()
+    gameID = db.writeGame("bench", "p1", "p2")
+    db.writeShotFrames(db.writeShot("p1", gameID), frames)
+    db.close()
+
+def run_shot(xvel, yvel):
+    shot = simulate_segments(new_table(), xvel, yvel)
+    while True:
+        try:
+            next(shot)
+        except StopIteration as stop:
+            return stop.value
+
+def bench_shot(xvel, yvel):
+    physics, tables = best(lambda: run_segments(xvel, yvel))
+    rolling, frames = best(lambda: roll_frames(tables))
+    rendering, svg = best(lambda: make_svg(frames))
+    shot, _ = best(lambda: run_shot(xvel, yvel))
+    rows = sum(2 + 2 * len(frame.balls()) for frame in frames) # As in bench_database
+    writing, _ = best(lambda: write_rows(tables, frames))
+    blob, _ = best(lambda: write_blob(tables, frames))
+
+    tracemalloc.start()
+    run_shot(xvel, yvel)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    segments = len(tables) - 1
+    return {
+        "segments": segments,
+        "frames": len(frames),
+        "segments_per_sec": segments / physics,
+        "frames_per_sec": len(frames) / rolling,
+        "svg_bytes": len(svg),
+        "svg_ms": rendering * 1000,
+        "shot_ms": shot * 1000,
+        "db_rows": rows,
+        "db_rows_per_sec": rows / writing,
+        "db_blob_rows_per_sec": rows / blob,
+        "peak_memory_bytes": peak,
+    }
+
+def compare(results, baseline):
+    for name, metrics in results["shots"].items():
+        old = baseline["shots"].get(name)
+        if old is None:
+            continue
+        print(f"{name} against baseline")
+        for metric, value in metrics.items():
+            if old.get(metric):
+                print(f"  {metric:22} {value / old[metric]:8.2f}x")
+
+if __name__ == "__main__":
+    results = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "engine": ENGINE,
+        "seed": RACK_SEED,
+        "rounds": ROUNDS,
+        "shots": {},
+    }
+    for name, (xvel, yvel) in SHOTS.items():
+        metrics = bench_shot(xvel, yvel)
+        results["shots"][name] = metrics
+        print(name)
+        for metric, value in metrics.items():
+            print(f"  {metric:22} {value:14.1f}")
+
+    if OUTPUT:
+        with open(OUTPUT, "w") as file:
+            json.dump(results, file, indent=2)
+    if BASELINE:
+        with open(BASELINE) as file:
+            compare(results, json.load(file))
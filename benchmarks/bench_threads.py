@@ -0,0 +1,52 @@
+"""
+Times independent breaks run to rest with Table.segment on 1, 2, 4, ...
+threads. The segment bindings of phylib.i release the GIL, so the breaks/sec
+should scale with the number of cores.
+Command: python benchmarks/bench_threads.py [breaks] [max threads]
+"""
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Physics import *
+
+ROUNDS = 3 # Best of
+
+def make_break(xvel):
+    table = make_new_table(RACK_SEED)
+    strike(table, xvel, -2500.0)
+    return table
+
+def run_break(table):
+    # Same limit as Table.shoot, some jittered racks never settle
+    count = 0
+    while table and count < MAX_COUNT:
+        table = table.segment()
+        count += 1
+    return count
+
+def bench(tables, threads):
+    elapsed = math.inf
+    for _ in range(ROUNDS):
+        with ThreadPoolExecutor(threads) as pool:
+            start = time.perf_counter()
+            segments = sum(pool.map(run_break, tables))
+            elapsed = min(elapsed, time.perf_counter() - start)
+    return segments, elapsed
+
+if __name__ == "__main__":
+    breaks = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    most = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    # Every break differs a little so no two threads share a table
+    tables = [make_break(50.0 + i) for i in range(breaks)]
+    print(f"{breaks} breaks on {os.cpu_count()} cores")
+    base = None
+    threads = 1
+    while threads <= most:
+        segments, elapsed = bench(tables, threads)
+        base = base or breaks / elapsed
+        print(f"{threads:3d} threads {segments:7d} segments {elapsed:8.3f} s "
+              f"{breaks / elapsed:10.1f} breaks/sec {breaks / elapsed / base:6.2f}x")
+        threads *= 2
@@ -1,6 +1,6 @@
 // Variables
 const FRAME_RATE = 10;
-const MOTION_RATE = 1.25;
+const BALL_RADIUS = 28;
 const MAX_SPEED = 3000;
 const MAX_DISTANCE = 200;
 const BALL_COLOURS = [ 
@@ -53,7 +53,7 @@ $(document).on("mousedown", async function(event){
     // Send post request with our information
     let vel = getVelocity()
     let velString = JSON.stringify({ x: vel.x , y: vel.y })
-    res = await fetch("api/table/shoot", {
+    res = await fetch("api/table/stream", {
       method: "POST",
       headers: {
         "Content-Type": "application/json",
@@ -61,8 +61,14 @@ $(document).on("mousedown", async function(event){
       },
       body: velString
     });
-    data = await res.json()
+    // Animate each segment as soon as it arrives
+    let animation = startAnimation();
+    data = await readEvents(res, (event, payload) => {
+      if (event == "frames") animation.push(payload);
+    });
+    animation.finish(data.svg || "table.svg");
     if (!data.svg) return; // Segment function failed
+    let remaining = data.elapsed * 1000 - animation.played();
 
     // Handle all related tasks
     setTimeout(() => {
@@ -71,15 +77,13 @@ $(document).on("mousedown", async function(event){
       for (const name of data.balls) {
         if (name != "ball-0") $(`.${name}`).each((i, ele) => $(ele).addClass("hide-vis"));
       }
-    }, data.elapsed * 1000);
-    handleAnimation(data);
-    // handleAnimation(data);
+    }, remaining);
     if (!data.ongoing) {
       // Game over
       setTimeout(() => {
         $("#display").text(`${data.current} has won!`);
         $("#over-menu").removeClass("hide");
-      }, data.elapsed * 1000);
+      }, remaining);
     }
     handleLine();
   }
@@ -142,24 +146,115 @@ $(document).on("mousemove", function(event) {
   handleLine();
 });
 
-// Helper function to handle an SVG animation for each shot
-function handleAnimation(data) {
-  $("#table").load(data.svg, function(){
-    for (var i = 0; i < data.frames.length; i++) {
-      let frame = data.frames[i];
-      let delay = i * FRAME_RATE;
-      let ele = $(`#${frame}`);
-      if (i != 0) ele.delay(delay).queue(() => ele.addClass("active"));
-      else ele.addClass("active");
-      
-      // Keep last frame as the new frame
-      if (i != data.frames.length - 1) {
-        setTimeout(() => {
-          ele.removeClass("active");
-        }, delay + FRAME_RATE * MOTION_RATE);
+// Helper function to read Server-Sent Events from a fetch response, returns the "result" event
+async function readEvents(res, handler) {
+  let reader = res.body.getReader();
+  let decoder = new TextDecoder();
+  let buffer = "";
+  let result = null;
+  while (true) {
+    let { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let end;
+    while ((end = buffer.indexOf("\n\n")) >= 0) {
+      let event = "message";
+      let payload = "";
+      for (const line of buffer.slice(0, end).split("\n")) {
+        if (line.startsWith("event: ")) event = line.slice(7);
+        else if (line.startsWith("data: ")) payload += line.slice(6);
       }
+      buffer = buffer.slice(end + 2);
+      if (event == "result") result = JSON.parse(payload);
+      else handler(event, JSON.parse(payload));
     }
-  });
+  }
+  return result;
+}
+
+// Helper function to animate encoded frames as they arrive
+function startAnimation() {
+  let svg = $("#table svg").get(0);
+  let frames = [];
+  let circles = {};
+  let positions = {};
+  let next = 0;
+  let start = null;
+  let done = null;
+
+  // Replace the balls of the current table with one circle per animated ball
+  $(svg).find("circle.ball").remove();
+  function addCircles(frame) {
+    if (!frame.k) return;
+    for (let i = 0; i < frame.k.length; i += 3) {
+      let number = frame.k[i];
+      if (circles[number]) continue;
+      let circle = document.createElementNS("http://www.w3.org/2000/svg", "circle");
+      circle.setAttribute("class", "ball");
+      circle.setAttribute("r", BALL_RADIUS);
+      circle.setAttribute("fill", BALL_COLOURS[number]);
+      svg.appendChild(circle);
+      circles[number] = circle;
+    }
+  }
+
+  // Keyframes place every ball, other frames move balls by their deltas
+  function applyFrame(frame) {
+    if (frame.k) {
+      positions = {};
+      for (let i = 0; i < frame.k.length; i += 3) positions[frame.k[i]] = [frame.k[i + 1], frame.k[i + 2]];
+    } else {
+      for (let i = 0; i < frame.length; i += 3) {
+        positions[frame[i]][0] += frame[i + 1];
+        positions[frame[i]][1] += frame[i + 2];
+      }
+    }
+  }
+
+  function drawFrame() {
+    for (const number in circles) {
+      let pos = positions[number];
+      circles[number].style.display = pos ? "" : "none";
+      if (pos) {
+        circles[number].setAttribute("cx", pos[0]);
+        circles[number].setAttribute("cy", pos[1]);
+      }
+    }
+  }
+
+  // Catch up on every frame due since the first one so slow devices stay in time
+  function step(now) {
+    if (start !== null) {
+      let due = Math.min(Math.floor((now - start) / FRAME_RATE) + 1, frames.length);
+      if (due > next) {
+        while (next < due) applyFrame(frames[next++]);
+        drawFrame();
+      }
+    }
+    if (next < frames.length || done === null) {
+      requestAnimationFrame(step);
+    } else {
+      // Keep the final table (with the cue) for the next shot
+      $("#table").load(done, handleLine);
+    }
+  }
+  requestAnimationFrame(step);
+
+  return {
+    push(segment) {
+      if (start === null) start = performance.now();
+      for (const frame of segment) {
+        addCircles(frame);
+        frames.push(frame);
+      }
+    },
+    finish(svg) {
+      done = svg;
+    },
+    played() {
+      return start === null ? 0 : performance.now() - start;
+    }
+  };
 }
 
 // Helper function to draw the line for our shot
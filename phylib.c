@@ -6,7 +6,7 @@
 
 /* Constructor to initialize a still ball */
 phylib_object *phylib_new_still_ball(unsigned char number, phylib_coord *pos) {
-  phylib_object *new_still_ball = malloc(sizeof(phylib_object));
+  phylib_object *new_still_ball = phylib_alloc(NULL, sizeof(phylib_object));
   if (new_still_ball == NULL) return NULL; // malloc failed
 
   // Creating the object
@@ -22,7 +22,7 @@ phylib_object *phylib_new_still_ball(unsigned char number, phylib_coord *pos) {
 
 /* Constructor to initialize a rolling ball */
 phylib_object *phylib_new_rolling_ball(unsigned char number, phylib_coord *pos, phylib_coord *vel, phylib_coord *acc) {
-  phylib_object *new_rolling_ball = malloc(sizeof(phylib_object));
+  phylib_object *new_rolling_ball = phylib_alloc(NULL, sizeof(phylib_object));
   if (new_rolling_ball == NULL) return NULL; // malloc failed
 
   // Creating the object
@@ -40,7 +40,7 @@ phylib_object *phylib_new_rolling_ball(unsigned char number, phylib_coord *pos,
 
 /* Constructor to initialize a hole */
 phylib_object *phylib_new_hole(phylib_coord *pos) {
-  phylib_object *new_hole = malloc(sizeof(phylib_object));
+  phylib_object *new_hole = phylib_alloc(NULL, sizeof(phylib_object));
   if (new_hole == NULL) return NULL; // malloc failed
 
   // Creating the object
@@ -55,7 +55,7 @@ phylib_object *phylib_new_hole(phylib_coord *pos) {
 
 /* Constructor to initialize a horizontal cushion */
 phylib_object *phylib_new_hcushion(double y) {
-  phylib_object *new_hcushion = malloc(sizeof(phylib_object));
+  phylib_object *new_hcushion = phylib_alloc(NULL, sizeof(phylib_object));
   if (new_hcushion == NULL) return NULL; // malloc failed
 
   // Creating the object
@@ -70,7 +70,7 @@ phylib_object *phylib_new_hcushion(double y) {
 
 /* Constructor to initialize a vertical cushion */
 phylib_object *phylib_new_vcushion(double x) { 
-  phylib_object *new_vcushion = malloc(sizeof(phylib_object));
+  phylib_object *new_vcushion = phylib_alloc(NULL, sizeof(phylib_object));
   if (new_vcushion == NULL) return NULL; // malloc failed
 
   // Creating the object
@@ -85,15 +85,17 @@ phylib_object *phylib_new_vcushion(double x) {
 
 /* Constructor to initialize a table */
 phylib_table *phylib_new_table() {
-  phylib_table *new_table = malloc(sizeof(phylib_table));
+  phylib_table *new_table = phylib_alloc(NULL, sizeof(phylib_table));
   if (new_table == NULL) return NULL; // malloc failed
 
   new_table->time = 0.0;
+  new_table->event = (phylib_event){PHYLIB_NO_EVENT, -1, -1};
+  new_table->steps = 0;
   // Populating the object based on the given schema
-  new_table->object[0] = phylib_new_hcushion(0);
-  new_table->object[1] = phylib_new_hcushion(PHYLIB_TABLE_LENGTH);
-  new_table->object[2] = phylib_new_vcushion(0);
-  new_table->object[3] = phylib_new_vcushion(PHYLIB_TABLE_WIDTH);
+  new_table->slot[0] = (phylib_object){PHYLIB_HCUSHION, {.hcushion = {0}}};
+  new_table->slot[1] = (phylib_object){PHYLIB_HCUSHION, {.hcushion = {PHYLIB_TABLE_LENGTH}}};
+  new_table->slot[2] = (phylib_object){PHYLIB_VCUSHION, {.vcushion = {0}}};
+  new_table->slot[3] = (phylib_object){PHYLIB_VCUSHION, {.vcushion = {PHYLIB_TABLE_WIDTH}}};
 
   phylib_coord hole_positions[6] = {
     (phylib_coord){0, 0},
@@ -104,13 +106,17 @@ phylib_table *phylib_new_table() {
     (phylib_coord){PHYLIB_TABLE_WIDTH, PHYLIB_TABLE_LENGTH}
   };
 
-  for (int i = 4; i < PHYLIB_MAX_OBJECTS; i++) {
-    if (i < 10) {
-      new_table->object[i] = phylib_new_hole(&hole_positions[i - 4]);
+  for (int i = 0; i < PHYLIB_MAX_OBJECTS; i++) {
+    if (i < 4) {
+      new_table->object[i] = &new_table->slot[i];
+    } else if (i < 10) {
+      new_table->slot[i] = (phylib_object){PHYLIB_HOLE, {.hole = {hole_positions[i - 4]}}};
+      new_table->object[i] = &new_table->slot[i];
     } else {
       new_table->object[i] = NULL;
     }
   }
+  phylib_index(new_table);
 
   return new_table;
 }
@@ -118,44 +124,67 @@ phylib_table *phylib_new_table() {
 /* Copy an object from source to destination */
 void phylib_copy_object(phylib_object **dest, phylib_object **src) {
   if (*src != NULL) {
-    *dest = (phylib_object *)malloc(sizeof(phylib_object));
+    *dest = (phylib_object *)phylib_alloc(NULL, sizeof(phylib_object));
     if (*dest != NULL) memcpy(*dest, *src, sizeof(phylib_object));
   } else {
     *dest = NULL;
   }
 }
 
-/* Copy and return a table */
+/* Copy and return a table, its objects are copied along with it in one block */
 phylib_table *phylib_copy_table(phylib_table *table) {
-  phylib_table * duplicate_table = (phylib_table *)malloc(sizeof(phylib_table));
+  phylib_table * duplicate_table = (phylib_table *)phylib_alloc(NULL, sizeof(phylib_table));
   if (duplicate_table == NULL) return NULL; // malloc failed
 
   duplicate_table->time = table->time;
+  duplicate_table->event = table->event;
+  duplicate_table->steps = table->steps;
   for (int i = 0; i < PHYLIB_MAX_OBJECTS; i++) {
-    phylib_copy_object(&duplicate_table->object[i], &table->object[i]);
+    if (table->object[i] != NULL) {
+      duplicate_table->slot[i] = *table->object[i];
+      duplicate_table->object[i] = &duplicate_table->slot[i];
+    } else {
+      duplicate_table->object[i] = NULL;
+    }
   }
+  phylib_index(duplicate_table);
 
   return duplicate_table;
 }
 
-/* Add an object to a table */
-void phylib_add_object(phylib_table *table, phylib_object *object) {
+/* Copy an object into the first free slot of a table and return the slot, or NULL if the table is full */
+phylib_object *phylib_put_object(phylib_table *table, phylib_object *object) {
   for (int i = 0; i < PHYLIB_MAX_OBJECTS; i++) {
     if (table->object[i] == NULL) {
-      table->object[i] = object;
-      break;
+      table->slot[i] = *object;
+      table->object[i] = &table->slot[i];
+      phylib_index(table);
+      return table->object[i];
     }
   }
+  return NULL;
 }
 
-/* Free the table from memory */
-void phylib_free_table(phylib_table *table) {
+/* Add an object to a table, the table takes it over and frees it once it holds a copy */
+void phylib_add_object(phylib_table *table, phylib_object *object) {
+  if (phylib_put_object(table, object) != NULL) free(object);
+}
+
+/* Rebuild the index of occupied and rolling slots from the objects of the table, needed after */
+/* an object is added, removed or changes type through a pointer rather than a table function, */
+/* every segment function rebuilds it on entry since Python can still set the type of a ball   */
+void phylib_index(phylib_table *table) {
+  table->count = 0;
+  table->rolling_count = 0;
   for (int i = 0; i < PHYLIB_MAX_OBJECTS; i++) {
-    if (table->object[i] != NULL) {
-      free(table->object[i]);
-    }
+    if (table->object[i] == NULL) continue;
+    table->index[table->count++] = i;
+    if (table->object[i]->type == PHYLIB_ROLLING_BALL) table->rolling[table->rolling_count++] = i;
   }
+}
 
+/* Free the table from memory, along with the objects in its slots */
+void phylib_free_table(phylib_table *table) {
   free(table);
 }
 
@@ -271,7 +300,7 @@ void phylib_bounce(phylib_object **a, phylib_object **b) {
       }
       
       case PHYLIB_HOLE: {
-        free(*a);
+        // The ball keeps its slot, which is freed with its table
         *a = NULL;
         break;
       }
@@ -323,48 +352,1032 @@ void phylib_bounce(phylib_object **a, phylib_object **b) {
 /* Return the number of rolling balls on the table */
 unsigned char phylib_rolling(phylib_table *t) {
   if (t == NULL) return 0;
-  unsigned char count = 0;
+  return t->rolling_count;
+}
+
+/* Return the number of a ball, or -1 if the object is not a ball */
+int phylib_number(phylib_object *object) {
+  if (object->type == PHYLIB_STILL_BALL) return object->obj.still_ball.number;
+  if (object->type == PHYLIB_ROLLING_BALL) return object->obj.rolling_ball.number;
+  return -1;
+}
+
+/* Return the slot of the still ball numbered number, or -1 if the table has none */
+int phylib_still_slot(phylib_table *t, int number) {
   for (int i = 0; i < PHYLIB_MAX_OBJECTS; i++) {
-    if (t->object[i] != NULL && t->object[i]->type == PHYLIB_ROLLING_BALL) {
-      count++; 
+    if (t->object[i] != NULL && t->object[i]->type == PHYLIB_STILL_BALL && t->object[i]->obj.still_ball.number == number) return i;
+  }
+  return -1;
+}
+
+/* Record the event that ended a segment of steps steps in event and count the segment */
+void phylib_end_segment(phylib_event *event, unsigned long steps, int hit, int ball, int other) {
+  event->hit = hit;
+  event->ball = ball;
+  event->other = other;
+  phylib_count_segment(steps, hit);
+}
+
+/* Return how many of the following steps cannot end a segment, no rolling ball can stop or */
+/* touch another object before then given its current speed, acceleration and distances     */
+int phylib_safe_steps(phylib_table *t) {
+  double safe = PHYLIB_MAX_TIME;
+
+  for (int r = 0; r < t->rolling_count; r++) {
+    int i = t->rolling[r];
+    double speed = phylib_length(t->object[i]->obj.rolling_ball.vel);
+    double drag = phylib_length(t->object[i]->obj.rolling_ball.acc);
+    if (speed < PHYLIB_VEL_EPSILON) return 0;
+    // Speed falls by at most drag per second
+    if (drag > 0) safe = fmin(safe, (speed - PHYLIB_VEL_EPSILON) / drag);
+
+    // The acceleration is not always against the velocity (phylib_bounce keeps it for a ball left
+    // below PHYLIB_VEL_EPSILON), so a gap closes by at most closing * t + growth * t * t / 2
+    for (int k = 0; k < t->count; k++) {
+      int j = t->index[k];
+      if (j == i) continue;
+      double closing = speed;
+      double growth = drag;
+      if (t->object[j]->type == PHYLIB_ROLLING_BALL) {
+        closing += phylib_length(t->object[j]->obj.rolling_ball.vel);
+        growth += phylib_length(t->object[j]->obj.rolling_ball.acc);
+      }
+      double gap = phylib_distance(t->object[i], t->object[j]);
+      if (gap <= 0) return 0;
+      // Positive root of growth / 2 * t^2 + closing * t - gap, stable when growth is 0
+      safe = fmin(safe, 2 * gap / (closing + sqrt(closing * closing + 2 * growth * gap)));
     }
   }
-  return count;
+
+  // One step of margin for rounding
+  double steps = floor(safe / PHYLIB_SIM_RATE) - 1;
+  return steps > 0 ? (int)steps : 0;
 }
 
 /* Conduct a pool segment and return the updated table */
 phylib_table *phylib_segment(phylib_table *table) {
+  if (table == NULL) return NULL;
+  phylib_index(table);
   if (phylib_rolling(table) == 0) return NULL;
   phylib_table * copy_table = phylib_copy_table(table);
+  // Falls back to checking every pair when the grid cannot be allocated
+  phylib_grid *grid = phylib_new_grid(copy_table->object, PHYLIB_MAX_OBJECTS, PHYLIB_TABLE_WIDTH, PHYLIB_TABLE_LENGTH);
+  phylib_grid_insert(grid, copy_table->object);
+  copy_table->steps = 0;
+  int skip = 0;
 
   // Prevent time from passing the max time
   for (double time = PHYLIB_SIM_RATE; time < PHYLIB_MAX_TIME; time += PHYLIB_SIM_RATE) {
     copy_table->time += PHYLIB_SIM_RATE;
-    for (int i = 0; i < PHYLIB_MAX_OBJECTS; i++) {
-      if (copy_table->object[i] != NULL && copy_table->object[i]->type == PHYLIB_ROLLING_BALL) {
-        phylib_roll(copy_table->object[i], table->object[i], time);
-        // phylib_visualize(copy_table->object[i], copy_table->time);
+    // Steps that cannot end the segment only advance the clock, so every event lands on the same step
+    if (skip > 0) {
+      skip--;
+      continue;
+    }
+    copy_table->steps++;
+    // The rolling balls only change at the event that ends the segment, so the index holds until then
+    for (int r = 0; r < copy_table->rolling_count; r++) {
+      int i = copy_table->rolling[r];
+      phylib_roll(copy_table->object[i], table->object[i], time);
+      phylib_grid_move(grid, copy_table->object, i);
+      // phylib_visualize(copy_table->object[i], copy_table->time);
+    }
+
+    // Each ball must roll before attempting to return from a bounce
+    for (int r = 0; r < copy_table->rolling_count; r++) {
+      int i = copy_table->rolling[r];
+      if (phylib_stopped(copy_table->object[i])) { // Check if rolling ball has stopped
+        phylib_free_grid(grid);
+        phylib_end_segment(&copy_table->event, copy_table->steps, PHYLIB_STOPPED, phylib_number(copy_table->object[i]), -1);
+        phylib_index(copy_table);
+        return copy_table;
+      }
+      // Check if two objects are colliding
+      int j = phylib_grid_collision(grid, copy_table->object, i);
+      if (j >= 0) {
+        // Numbers are taken before the bounce, which removes a ball that falls in a hole
+        phylib_end_segment(&copy_table->event, copy_table->steps, copy_table->object[j]->type,
+                           phylib_number(copy_table->object[i]), phylib_number(copy_table->object[j]));
+        phylib_bounce(&copy_table->object[i], &copy_table->object[j]);
+        phylib_free_grid(grid);
+        phylib_index(copy_table);
+        return copy_table;
+      }
+    }
+    skip = phylib_safe_steps(copy_table);
+  }
+
+  phylib_free_grid(grid);
+  phylib_end_segment(&copy_table->event, copy_table->steps, PHYLIB_NO_EVENT, -1, -1);
+  return copy_table;
+}
+
+/* Evaluate a polynomial with the given coefficients (lowest order first) */
+double phylib_poly_eval(const double *c, int degree, double t) {
+  double result = 0.0;
+  for (int k = degree; k >= 0; k--) {
+    result = result * t + c[k];
+  }
+  return result;
+}
+
+/* Bisect a sign change of a polynomial on [a, b] and return the end that keeps the sign of f(b) */
+double phylib_poly_bisect(const double *c, int degree, double a, double b) {
+  unsigned char negative = phylib_poly_eval(c, degree, b) < 0;
+  for (int k = 0; k < 200 && b - a > PHYLIB_ROOT_EPSILON; k++) {
+    double mid = (a + b) / 2;
+    if ((phylib_poly_eval(c, degree, mid) < 0) == negative) {
+      b = mid;
+    } else {
+      a = mid;
+    }
+  }
+  return b;
+}
+
+/* Find the sign changes of a polynomial in (lo, hi), store them in ascending order and return the count */
+int phylib_poly_roots(const double *c, int degree, double lo, double hi, double *roots) {
+  if (degree < 1 || hi <= lo) return 0;
+  double derivative[PHYLIB_MAX_DEGREE];
+  double bounds[PHYLIB_MAX_DEGREE + 1];
+  int count = 0;
+  int n = 0;
+
+  // The roots of the derivative split the interval into monotonic pieces
+  bounds[n++] = lo;
+  if (degree > 1) {
+    for (int k = 1; k <= degree; k++) derivative[k - 1] = k * c[k];
+    n += phylib_poly_roots(derivative, degree - 1, lo, hi, &bounds[n]);
+  }
+  bounds[n++] = hi;
+
+  // Each monotonic piece holds at most one sign change
+  for (int k = 0; k < n - 1; k++) {
+    double fa = phylib_poly_eval(c, degree, bounds[k]);
+    double fb = phylib_poly_eval(c, degree, bounds[k + 1]);
+    if ((fa < 0) != (fb < 0)) {
+      roots[count++] = phylib_poly_bisect(c, degree, bounds[k], bounds[k + 1]);
+    }
+  }
+  return count;
+}
+
+/* Return the earliest time in [lo, hi] where a separation polynomial is negative and not increasing */
+double phylib_contact_time(const double *c, int degree, double lo, double hi) {
+  if (hi < lo) return -1.0;
+  double derivative[PHYLIB_MAX_DEGREE];
+  double bounds[PHYLIB_MAX_DEGREE + 1];
+  int n = 0;
+
+  bounds[n++] = lo;
+  if (degree > 1) {
+    for (int k = 1; k <= degree; k++) derivative[k - 1] = k * c[k];
+    n += phylib_poly_roots(derivative, degree - 1, lo, hi, &bounds[n]);
+  }
+  bounds[n++] = hi;
+
+  for (int k = 0; k < n - 1; k++) {
+    double fa = phylib_poly_eval(c, degree, bounds[k]);
+    double fb = phylib_poly_eval(c, degree, bounds[k + 1]);
+    if (fb >= fa) continue; // Objects are separating (e.g. right after a bounce)
+    if (fa < 0) return bounds[k]; // Already overlapping and still approaching
+    if (fb < 0) return phylib_poly_bisect(c, degree, bounds[k], bounds[k + 1]);
+  }
+  return -1.0;
+}
+
+/* Return the time until a rolling ball comes to rest, this matches the sign change check in phylib_roll */
+double phylib_stop_time(phylib_object *object) {
+  if (object->type != PHYLIB_ROLLING_BALL) return -1.0;
+  phylib_rolling_ball b = object->obj.rolling_ball;
+  double stop = 0.0;
+
+  double vel[2] = {b.vel.x, b.vel.y};
+  double acc[2] = {b.acc.x, b.acc.y};
+  for (int k = 0; k < 2; k++) {
+    if (vel[k] == 0 && acc[k] == 0) continue;
+    if (vel[k] * acc[k] >= 0) return INFINITY; // Component never changes sign
+    if (-vel[k] / acc[k] > stop) stop = -vel[k] / acc[k];
+  }
+  return stop;
+}
+
+/* Return the time at which a rolling ball first touches another object, or -1.0 if it does not by hi */
+double phylib_collision_time(phylib_object *obj1, phylib_object *obj2, double hi) {
+  if (obj1->type != PHYLIB_ROLLING_BALL) return -1.0;
+  phylib_rolling_ball a = obj1->obj.rolling_ball;
+  if (phylib_stop_time(obj1) < hi) hi = phylib_stop_time(obj1);
+
+  // Relative motion is r(t) = r + v * t + h * t^2 and contact happens when |r(t)| = radius
+  phylib_coord r, v, h;
+  double radius;
+  switch (obj2->type) {
+    case PHYLIB_ROLLING_BALL: {
+      phylib_rolling_ball b = obj2->obj.rolling_ball;
+      if (phylib_stop_time(obj2) < hi) hi = phylib_stop_time(obj2);
+      r = phylib_sub(a.pos, b.pos);
+      v = phylib_sub(a.vel, b.vel);
+      h = (phylib_coord){.5 * (a.acc.x - b.acc.x), .5 * (a.acc.y - b.acc.y)};
+      radius = PHYLIB_BALL_DIAMETER;
+      break;
+    }
+
+    case PHYLIB_STILL_BALL: {
+      r = phylib_sub(a.pos, obj2->obj.still_ball.pos);
+      v = a.vel;
+      h = (phylib_coord){.5 * a.acc.x, .5 * a.acc.y};
+      radius = PHYLIB_BALL_DIAMETER;
+      break;
+    }
+
+    case PHYLIB_HOLE: {
+      r = phylib_sub(a.pos, obj2->obj.hole.pos);
+      v = a.vel;
+      h = (phylib_coord){.5 * a.acc.x, .5 * a.acc.y};
+      radius = PHYLIB_HOLE_RADIUS;
+      break;
+    }
+
+    case PHYLIB_HCUSHION: {
+      r = (phylib_coord){0, a.pos.y - obj2->obj.hcushion.y};
+      v = (phylib_coord){0, a.vel.y};
+      h = (phylib_coord){0, .5 * a.acc.y};
+      radius = PHYLIB_BALL_RADIUS;
+      break;
+    }
+
+    case PHYLIB_VCUSHION: {
+      r = (phylib_coord){a.pos.x - obj2->obj.vcushion.x, 0};
+      v = (phylib_coord){a.vel.x, 0};
+      h = (phylib_coord){.5 * a.acc.x, 0};
+      radius = PHYLIB_BALL_RADIUS;
+      break;
+    }
+
+    default: return -1.0; // invalid type
+  }
+
+  // Expand |r(t)|^2 - radius^2 into a quartic
+  double c[PHYLIB_MAX_DEGREE + 1] = {
+    phylib_dot_product(r, r) - radius * radius,
+    2 * phylib_dot_product(r, v),
+    phylib_dot_product(v, v) + 2 * phylib_dot_product(r, h),
+    2 * phylib_dot_product(v, h),
+    phylib_dot_product(h, h)
+  };
+  return phylib_contact_time(c, PHYLIB_MAX_DEGREE, 0.0, hi);
+}
+
+/* Conduct a pool segment by solving for the next event directly and return the updated table */
+phylib_table *phylib_segment_event(phylib_table *table) {
+  if (table == NULL) return NULL;
+  phylib_index(table);
+  if (phylib_rolling(table) == 0) return NULL;
+  phylib_table * copy_table = phylib_copy_table(table);
+  if (copy_table == NULL) return NULL; // malloc failed
+
+  double time = PHYLIB_MAX_TIME;
+  int first = -1;
+  int second = -1; // Remains -1 when the next event is a ball stopping
+
+  // The copy was just indexed, its slots match those of table
+  for (int r = 0; r < copy_table->rolling_count; r++) {
+    int i = copy_table->rolling[r];
+    double stop = phylib_stop_time(table->object[i]);
+    if (stop < time) {
+      time = stop;
+      first = i;
+      second = -1;
+    }
+  }
+
+  for (int r = 0; r < copy_table->rolling_count; r++) {
+    int i = copy_table->rolling[r];
+    for (int k = 0; k < copy_table->count; k++) {
+      int j = copy_table->index[k];
+      if (i == j) continue;
+      // Pairs of rolling balls are checked once, from the lower index like phylib_segment
+      if (table->object[j]->type == PHYLIB_ROLLING_BALL && j < i) continue;
+      double contact = phylib_collision_time(table->object[i], table->object[j], time);
+      if (contact >= 0 && contact < time) {
+        time = contact;
+        first = i;
+        second = j;
+      }
+    }
+  }
+
+  // Jump straight to the event
+  copy_table->time += time;
+  for (int r = 0; r < copy_table->rolling_count; r++) {
+    int i = copy_table->rolling[r];
+    phylib_roll(copy_table->object[i], table->object[i], time);
+  }
+
+  if (first >= 0 && second < 0) {
+    phylib_stopped(copy_table->object[first]);
+    phylib_end_segment(&copy_table->event, 0, PHYLIB_STOPPED, phylib_number(copy_table->object[first]), -1);
+  } else if (first >= 0) {
+    phylib_end_segment(&copy_table->event, 0, copy_table->object[second]->type,
+                       phylib_number(copy_table->object[first]), phylib_number(copy_table->object[second]));
+    phylib_bounce(&copy_table->object[first], &copy_table->object[second]);
+  } else {
+    phylib_end_segment(&copy_table->event, 0, PHYLIB_NO_EVENT, -1, -1);
+  }
+  phylib_index(copy_table);
+
+  return copy_table;
+}
+
+/* Conduct a pool segment with the given engine */
+phylib_table *phylib_segment_engine(phylib_table *table, phylib_engine engine) {
+  switch (engine) {
+    case PHYLIB_EVENT_ENGINE: return phylib_segment_event(table);
+    case PHYLIB_SOA_ENGINE: return phylib_segment_soa(table);
+    default: return phylib_segment(table);
+  }
+}
+
+/* Constructor to initialize a broad phase grid over a width by length table */
+phylib_grid *phylib_new_grid(phylib_object **objects, int count, double width, double length) {
+  phylib_grid *grid = phylib_alloc(NULL, sizeof(phylib_grid));
+  if (grid == NULL) return NULL; // malloc failed
+
+  grid->columns = width > PHYLIB_GRID_SIZE ? (int)ceil(width / PHYLIB_GRID_SIZE) : 1;
+  grid->rows = length > PHYLIB_GRID_SIZE ? (int)ceil(length / PHYLIB_GRID_SIZE) : 1;
+  grid->count = count;
+  int cells = grid->columns * grid->rows;
+
+  grid->head = phylib_alloc(NULL, cells * sizeof(int));
+  grid->next = phylib_alloc(NULL, count * sizeof(int));
+  grid->cell = phylib_alloc(NULL, count * sizeof(int));
+  grid->static_start = phylib_alloc(NULL, (cells + 1) * sizeof(int));
+  grid->static_index = NULL;
+  if (grid->head == NULL || grid->next == NULL || grid->cell == NULL || grid->static_start == NULL) {
+    phylib_free_grid(grid);
+    return NULL; // malloc failed
+  }
+
+  for (int i = 0; i < count; i++) grid->cell[i] = -1;
+  memset(grid->static_start, 0, (cells + 1) * sizeof(int));
+
+  // Holes and cushions never move, so the cells each of them can reach are computed once
+  for (int i = 0; i < count; i++) {
+    int first, last;
+    if (objects[i] == NULL || !phylib_grid_reach(grid, objects[i], &first, &last)) continue;
+    for (int r = first / grid->columns; r <= last / grid->columns; r++) {
+      for (int q = first % grid->columns; q <= last % grid->columns; q++) {
+        if (phylib_grid_touches(grid, objects[i], r * grid->columns + q)) grid->static_start[r * grid->columns + q + 1]++;
+      }
+    }
+  }
+  for (int c = 0; c < cells; c++) grid->static_start[c + 1] += grid->static_start[c];
+
+  grid->static_index = phylib_alloc(NULL, (grid->static_start[cells] + 1) * sizeof(int));
+  if (grid->static_index == NULL) {
+    phylib_free_grid(grid);
+    return NULL; // malloc failed
+  }
+
+  // Use the heads as fill cursors so each cell lists its objects in index order
+  for (int c = 0; c < cells; c++) grid->head[c] = grid->static_start[c];
+  for (int i = 0; i < count; i++) {
+    int first, last;
+    if (objects[i] == NULL || !phylib_grid_reach(grid, objects[i], &first, &last)) continue;
+    for (int r = first / grid->columns; r <= last / grid->columns; r++) {
+      for (int q = first % grid->columns; q <= last % grid->columns; q++) {
+        int c = r * grid->columns + q;
+        if (phylib_grid_touches(grid, objects[i], c)) grid->static_index[grid->head[c]++] = i;
+      }
+    }
+  }
+  for (int c = 0; c < cells; c++) grid->head[c] = -1;
+
+  return grid;
+}
+
+/* Free the grid from memory */
+void phylib_free_grid(phylib_grid *grid) {
+  if (grid == NULL) return;
+  free(grid->head);
+  free(grid->next);
+  free(grid->cell);
+  free(grid->static_start);
+  free(grid->static_index);
+  free(grid);
+}
+
+/* Find and return the cell holding a position, positions off the table fall into the edge cells */
+int phylib_grid_cell(phylib_grid *grid, phylib_coord pos) {
+  int column = (int)floor(pos.x / PHYLIB_GRID_SIZE);
+  int row = (int)floor(pos.y / PHYLIB_GRID_SIZE);
+  if (column < 0) column = 0;
+  if (column >= grid->columns) column = grid->columns - 1;
+  if (row < 0) row = 0;
+  if (row >= grid->rows) row = grid->rows - 1;
+  return row * grid->columns + column;
+}
+
+/* Find the corner cells bounding the reach of a hole or cushion, return 0 for other objects */
+unsigned char phylib_grid_reach(phylib_grid *grid, phylib_object *object, int *first, int *last) {
+  double width = grid->columns * PHYLIB_GRID_SIZE;
+  double length = grid->rows * PHYLIB_GRID_SIZE;
+  phylib_coord lo, hi;
+
+  switch (object->type) {
+    case PHYLIB_HOLE: {
+      phylib_coord h = object->obj.hole.pos;
+      lo = (phylib_coord){h.x - PHYLIB_HOLE_RADIUS, h.y - PHYLIB_HOLE_RADIUS};
+      hi = (phylib_coord){h.x + PHYLIB_HOLE_RADIUS, h.y + PHYLIB_HOLE_RADIUS};
+      break;
+    }
+
+    case PHYLIB_HCUSHION: {
+      lo = (phylib_coord){0, object->obj.hcushion.y - PHYLIB_BALL_RADIUS};
+      hi = (phylib_coord){width, object->obj.hcushion.y + PHYLIB_BALL_RADIUS};
+      break;
+    }
+
+    case PHYLIB_VCUSHION: {
+      lo = (phylib_coord){object->obj.vcushion.x - PHYLIB_BALL_RADIUS, 0};
+      hi = (phylib_coord){object->obj.vcushion.x + PHYLIB_BALL_RADIUS, length};
+      break;
+    }
+
+    default: return 0;
+  }
+
+  *first = phylib_grid_cell(grid, lo);
+  *last = phylib_grid_cell(grid, hi);
+  return 1;
+}
+
+/* Check if a hole or cushion can touch a ball centred anywhere in a cell */
+unsigned char phylib_grid_touches(phylib_grid *grid, phylib_object *object, int cell) {
+  int column = cell % grid->columns;
+  int row = cell / grid->columns;
+
+  // Edge cells extend outwards to match phylib_grid_cell
+  double x0 = column == 0 ? -INFINITY : column * PHYLIB_GRID_SIZE;
+  double x1 = column == grid->columns - 1 ? INFINITY : (column + 1) * PHYLIB_GRID_SIZE;
+  double y0 = row == 0 ? -INFINITY : row * PHYLIB_GRID_SIZE;
+  double y1 = row == grid->rows - 1 ? INFINITY : (row + 1) * PHYLIB_GRID_SIZE;
+
+  switch (object->type) {
+    case PHYLIB_HOLE: {
+      phylib_coord h = object->obj.hole.pos;
+      double dx = fmax(fmax(x0 - h.x, h.x - x1), 0);
+      double dy = fmax(fmax(y0 - h.y, h.y - y1), 0);
+      return (dx * dx) + (dy * dy) <= PHYLIB_HOLE_RADIUS * PHYLIB_HOLE_RADIUS;
+    }
+
+    case PHYLIB_HCUSHION: {
+      double y = object->obj.hcushion.y;
+      return y >= y0 - PHYLIB_BALL_RADIUS && y <= y1 + PHYLIB_BALL_RADIUS;
+    }
+
+    case PHYLIB_VCUSHION: {
+      double x = object->obj.vcushion.x;
+      return x >= x0 - PHYLIB_BALL_RADIUS && x <= x1 + PHYLIB_BALL_RADIUS;
+    }
+
+    default: return 0; // Balls are binned every step instead
+  }
+}
+
+/* Bin every ball by its current position, only rolling balls need phylib_grid_move afterwards */
+void phylib_grid_insert(phylib_grid *grid, phylib_object **objects) {
+  if (grid == NULL) return;
+
+  // Only clear the cells used last time rather than the whole grid
+  for (int i = 0; i < grid->count; i++) {
+    if (grid->cell[i] >= 0) grid->head[grid->cell[i]] = -1;
+  }
+
+  for (int i = 0; i < grid->count; i++) {
+    grid->cell[i] = -1;
+    if (objects[i] == NULL) continue;
+    if (objects[i]->type == PHYLIB_STILL_BALL || objects[i]->type == PHYLIB_ROLLING_BALL) {
+      // The position is in the same place for both ball types
+      int c = phylib_grid_cell(grid, objects[i]->obj.still_ball.pos);
+      grid->next[i] = grid->head[c];
+      grid->head[c] = i;
+      grid->cell[i] = c;
+    }
+  }
+}
+
+/* Move ball i to the cell holding its current position */
+void phylib_grid_move(phylib_grid *grid, phylib_object **objects, int i) {
+  if (grid == NULL || grid->cell[i] < 0) return;
+  int c = phylib_grid_cell(grid, objects[i]->obj.rolling_ball.pos);
+  if (c == grid->cell[i]) return; // Most steps stay inside the same cell
+
+  // Unlink from the old cell
+  int *link = &grid->head[grid->cell[i]];
+  while (*link != i) link = &grid->next[*link];
+  *link = grid->next[i];
+
+  grid->next[i] = grid->head[c];
+  grid->head[c] = i;
+  grid->cell[i] = c;
+}
+
+/* Return the lowest index of an object colliding with rolling ball i, or -1 if there is none */
+int phylib_grid_collision(phylib_grid *grid, phylib_object **objects, int i) {
+  int found = -1;
+
+  // Without a grid every object is a candidate
+  if (grid == NULL) {
+    for (int j = 0; j < PHYLIB_MAX_OBJECTS; j++) {
+      if (objects[j] != NULL && objects[i] != objects[j] && phylib_distance(objects[i], objects[j]) < 0) return j;
+    }
+    return -1;
+  }
+
+  int c = grid->cell[i];
+  if (c < 0) return -1;
+
+  for (int k = grid->static_start[c]; k < grid->static_start[c + 1]; k++) {
+    int j = grid->static_index[k];
+    if (objects[j] != NULL && (found < 0 || j < found) && phylib_distance(objects[i], objects[j]) < 0) found = j;
+  }
+
+  // Cells are at least a ball diameter wide, so touching balls are in neighbouring cells
+  int column = c % grid->columns;
+  int row = c / grid->columns;
+  for (int r = row - 1; r <= row + 1; r++) {
+    for (int q = column - 1; q <= column + 1; q++) {
+      if (r < 0 || r >= grid->rows || q < 0 || q >= grid->columns) continue;
+      for (int j = grid->head[r * grid->columns + q]; j >= 0; j = grid->next[j]) {
+        if (j != i && (found < 0 || j < found) && phylib_distance(objects[i], objects[j]) < 0) found = j;
+      }
+    }
+  }
+
+  return found;
+}
+
+/* Convert a table into the contiguous layout */
+void phylib_table_to_soa(phylib_soa_table *dest, phylib_table *src) {
+  memset(dest, 0, sizeof(phylib_soa_table));
+  dest->time = src->time;
+  dest->event = src->event;
+
+  for (int k = 0; k < src->count; k++) {
+    int i = src->index[k];
+    phylib_object *object = src->object[i];
+    dest->alive |= 1UL << i;
+    dest->type[i] = object->type;
+
+    switch (object->type) {
+      case PHYLIB_STILL_BALL: {
+        dest->number[i] = object->obj.still_ball.number;
+        dest->pos_x[i] = object->obj.still_ball.pos.x;
+        dest->pos_y[i] = object->obj.still_ball.pos.y;
+        break;
+      }
+
+      case PHYLIB_ROLLING_BALL: {
+        dest->number[i] = object->obj.rolling_ball.number;
+        dest->pos_x[i] = object->obj.rolling_ball.pos.x;
+        dest->pos_y[i] = object->obj.rolling_ball.pos.y;
+        dest->vel_x[i] = object->obj.rolling_ball.vel.x;
+        dest->vel_y[i] = object->obj.rolling_ball.vel.y;
+        dest->acc_x[i] = object->obj.rolling_ball.acc.x;
+        dest->acc_y[i] = object->obj.rolling_ball.acc.y;
+        break;
+      }
+
+      case PHYLIB_HOLE: {
+        dest->pos_x[i] = object->obj.hole.pos.x;
+        dest->pos_y[i] = object->obj.hole.pos.y;
+        break;
+      }
+
+      case PHYLIB_HCUSHION: {
+        dest->pos_y[i] = object->obj.hcushion.y;
+        break;
+      }
+
+      case PHYLIB_VCUSHION: {
+        dest->pos_x[i] = object->obj.vcushion.x;
+        break;
+      }
+    }
+  }
+}
+
+/* Convert a contiguous table back into a new table */
+phylib_table *phylib_soa_to_table(phylib_soa_table *src) {
+  phylib_table *table = phylib_alloc(NULL, sizeof(phylib_table));
+  if (table == NULL) return NULL; // malloc failed
+  table->time = src->time;
+  table->event = src->event;
+  table->steps = 0;
+
+  for (int i = 0; i < PHYLIB_MAX_OBJECTS; i++) {
+    table->object[i] = NULL;
+    if (!(src->alive & (1UL << i))) continue;
+
+    phylib_object *object = &table->slot[i];
+    phylib_coord pos = {src->pos_x[i], src->pos_y[i]};
+    phylib_coord vel = {src->vel_x[i], src->vel_y[i]};
+    phylib_coord acc = {src->acc_x[i], src->acc_y[i]};
+    switch (src->type[i]) {
+      case PHYLIB_STILL_BALL: object->obj.still_ball = (phylib_still_ball){src->number[i], pos}; break;
+      case PHYLIB_ROLLING_BALL: object->obj.rolling_ball = (phylib_rolling_ball){src->number[i], pos, vel, acc}; break;
+      case PHYLIB_HOLE: object->obj.hole = (phylib_hole){pos}; break;
+      case PHYLIB_HCUSHION: object->obj.hcushion = (phylib_hcushion){src->pos_y[i]}; break;
+      case PHYLIB_VCUSHION: object->obj.vcushion = (phylib_vcushion){src->pos_x[i]}; break;
+    }
+    object->type = src->type[i];
+    table->object[i] = object;
+  }
+  phylib_index(table);
+
+  return table;
+}
+
+/* Copy a contiguous table */
+void phylib_soa_copy(phylib_soa_table *dest, phylib_soa_table *src) {
+  memcpy(dest, src, sizeof(phylib_soa_table));
+}
+
+/* Return the number of rolling balls on a contiguous table */
+unsigned char phylib_soa_rolling(phylib_soa_table *t) {
+  unsigned char count = 0;
+  for (int i = 0; i < PHYLIB_MAX_OBJECTS; i++) {
+    count += t->type[i] == PHYLIB_ROLLING_BALL;
+  }
+  return count;
+}
+
+/* Roll every rolling ball of old by time into new, the arithmetic matches phylib_roll */
+void phylib_soa_roll(phylib_soa_table *new, phylib_soa_table *old, double time) {
+  // Other slots roll by zero seconds so the loop has no branches and vectorizes
+  for (int i = 0; i < PHYLIB_MAX_OBJECTS; i++) {
+    double t = old->type[i] == PHYLIB_ROLLING_BALL ? time : 0.0;
+
+    new->pos_x[i] = old->pos_x[i] + (old->vel_x[i] * t) + (.5 * old->acc_x[i] * t * t);
+    new->pos_y[i] = old->pos_y[i] + (old->vel_y[i] * t) + (.5 * old->acc_y[i] * t * t);
+
+    double vel_x = old->vel_x[i] + (old->acc_x[i] * t);
+    double vel_y = old->vel_y[i] + (old->acc_y[i] * t);
+
+    // Check for change of sign
+    int flip_x = vel_x * old->vel_x[i] < 0;
+    int flip_y = vel_y * old->vel_y[i] < 0;
+    new->vel_x[i] = flip_x ? 0 : vel_x;
+    new->acc_x[i] = flip_x ? 0 : old->acc_x[i];
+    new->vel_y[i] = flip_y ? 0 : vel_y;
+    new->acc_y[i] = flip_y ? 0 : old->acc_y[i];
+  }
+}
+
+/* Check if rolling ball i has stopped and make it a still ball if so */
+unsigned char phylib_soa_stopped(phylib_soa_table *t, int i) {
+  if (t->type[i] != PHYLIB_ROLLING_BALL) return 0;
+
+  if (phylib_length((phylib_coord){t->vel_x[i], t->vel_y[i]}) < PHYLIB_VEL_EPSILON) {
+    t->type[i] = PHYLIB_STILL_BALL;
+    t->vel_x[i] = t->vel_y[i] = 0;
+    t->acc_x[i] = t->acc_y[i] = 0;
+    return 1;
+  }
+
+  return 0;
+}
+
+/* Find the distance from rolling ball i to every slot, the arithmetic matches phylib_distance */
+void phylib_soa_distances(phylib_soa_table *t, int i, double *distance) {
+  double ax = t->pos_x[i];
+  double ay = t->pos_y[i];
+
+  for (int j = 0; j < PHYLIB_MAX_OBJECTS; j++) {
+    double dx = t->pos_x[j] - ax;
+    double dy = t->pos_y[j] - ay;
+    double radius = t->type[j] == PHYLIB_HOLE ? PHYLIB_HOLE_RADIUS : PHYLIB_BALL_DIAMETER;
+    double centre = sqrt((dx * dx) + (dy * dy)) - radius;
+    double line = t->type[j] == PHYLIB_HCUSHION ? fabs(dy) : fabs(dx);
+
+    // Selects instead of a switch keep the loop vectorizable
+    int cushion = (t->type[j] == PHYLIB_HCUSHION) | (t->type[j] == PHYLIB_VCUSHION);
+    distance[j] = cushion ? line - PHYLIB_BALL_RADIUS : centre;
+  }
+}
+
+/* Handle the collision between rolling ball a and slot b, the arithmetic matches phylib_bounce */
+void phylib_soa_bounce(phylib_soa_table *t, int a, int b) {
+  switch (t->type[b]) {
+    case PHYLIB_HCUSHION: {
+      t->vel_y[a] = -t->vel_y[a];
+      t->acc_y[a] = -t->acc_y[a];
+      break;
+    }
+
+    case PHYLIB_VCUSHION: {
+      t->vel_x[a] = -t->vel_x[a];
+      t->acc_x[a] = -t->acc_x[a];
+      break;
+    }
+
+    case PHYLIB_HOLE: {
+      // Empty slots are kept as zeroed still balls so that loops can test the type alone
+      t->alive &= ~(1UL << a);
+      t->type[a] = PHYLIB_STILL_BALL;
+      t->pos_x[a] = t->pos_y[a] = 0;
+      t->vel_x[a] = t->vel_y[a] = 0;
+      t->acc_x[a] = t->acc_y[a] = 0;
+      break;
+    }
+
+    case PHYLIB_STILL_BALL: {
+      t->vel_x[b] = t->vel_y[b] = 0;
+      t->acc_x[b] = t->acc_y[b] = 0;
+      t->type[b] = PHYLIB_ROLLING_BALL;
+      // Flow into next case
+    }
+
+    case PHYLIB_ROLLING_BALL: {
+      // Compute background information
+      phylib_coord r_ab = {t->pos_x[a] - t->pos_x[b], t->pos_y[a] - t->pos_y[b]};
+      phylib_coord v_rel = {t->vel_x[a] - t->vel_x[b], t->vel_y[a] - t->vel_y[b]};
+      phylib_coord n = (phylib_coord){
+        r_ab.x / phylib_length(r_ab),
+        r_ab.y / phylib_length(r_ab)
+      };
+      double v_rel_n = phylib_dot_product(v_rel, n);
+
+      // Update velocities
+      t->vel_x[a] -= v_rel_n * n.x;
+      t->vel_y[a] -= v_rel_n * n.y;
+
+      t->vel_x[b] += v_rel_n * n.x;
+      t->vel_y[b] += v_rel_n * n.y;
+
+      // Adjustment for simulation
+      int balls[2] = {a, b};
+      for (int k = 0; k < 2; k++) {
+        int i = balls[k];
+        phylib_coord vel = {t->vel_x[i], t->vel_y[i]};
+        if (phylib_length(vel) > PHYLIB_VEL_EPSILON) {
+          t->acc_x[i] = -vel.x / phylib_length(vel) * PHYLIB_DRAG;
+          t->acc_y[i] = -vel.y / phylib_length(vel) * PHYLIB_DRAG;
+        }
       }
+
+      break;
     }
+  }
+}
+
+/* Conduct a pool segment on a contiguous table into result, return 0 if no ball is rolling */
+unsigned char phylib_soa_segment(phylib_soa_table *result, phylib_soa_table *table) {
+  if (phylib_soa_rolling(table) == 0) return 0;
+  phylib_soa_copy(result, table);
+  double distance[PHYLIB_MAX_OBJECTS];
+
+  // Prevent time from passing the max time
+  for (double time = PHYLIB_SIM_RATE; time < PHYLIB_MAX_TIME; time += PHYLIB_SIM_RATE) {
+    result->time += PHYLIB_SIM_RATE;
+    phylib_soa_roll(result, table, time);
 
     // Each ball must roll before attempting to return from a bounce
     for (int i = 0; i < PHYLIB_MAX_OBJECTS; i++) {
-      if (copy_table->object[i] != NULL && copy_table->object[i]->type == PHYLIB_ROLLING_BALL) {
-        if (phylib_stopped(copy_table->object[i])) return copy_table; // Check if rolling ball has stopped
+      if (result->type[i] == PHYLIB_ROLLING_BALL) {
+        if (phylib_soa_stopped(result, i)) { // Check if rolling ball has stopped
+          phylib_end_segment(&result->event, lround(time / PHYLIB_SIM_RATE), PHYLIB_STOPPED, result->number[i], -1);
+          return 1;
+        }
+        phylib_soa_distances(result, i, distance);
         for (int j = 0; j < PHYLIB_MAX_OBJECTS; j++) {
-          if (copy_table->object[j] != NULL && copy_table->object[i] != copy_table->object[j]) {
-            // Check if two objects are colliding
-            if (phylib_distance(copy_table->object[i], copy_table->object[j]) < 0) {
-              phylib_bounce(&copy_table->object[i], &copy_table->object[j]);
-              return copy_table;
-            }
+          // Check if two objects are colliding
+          if (j != i && (result->alive >> j & 1) && distance[j] < 0) {
+            phylib_end_segment(&result->event, lround(time / PHYLIB_SIM_RATE), result->type[j], result->number[i],
+                               result->type[j] <= PHYLIB_ROLLING_BALL ? result->number[j] : -1);
+            phylib_soa_bounce(result, i, j);
+            return 1;
           }
         }
       }
     }
   }
 
-  return copy_table;
+  phylib_end_segment(&result->event, lround(PHYLIB_MAX_TIME / PHYLIB_SIM_RATE), PHYLIB_NO_EVENT, -1, -1);
+  return 1;
+}
+
+/* Conduct a pool segment through the contiguous layout and return the updated table */
+phylib_table *phylib_segment_soa(phylib_table *table) {
+  if (table == NULL) return NULL;
+  phylib_index(table);
+  if (phylib_rolling(table) == 0) return NULL;
+  phylib_soa_table before, after;
+  phylib_table_to_soa(&before, table);
+  if (!phylib_soa_segment(&after, &before)) return NULL;
+  phylib_table *result = phylib_soa_to_table(&after);
+  if (result != NULL) result->steps = lround((after.time - before.time) / PHYLIB_SIM_RATE);
+  return result;
+}
+
+/* Return the number of balls on the table */
+unsigned char phylib_balls(phylib_table *t) {
+  if (t == NULL) return 0;
+  unsigned char count = 0;
+  for (int k = 0; k < t->count; k++) {
+    phylib_obj type = t->object[t->index[k]]->type;
+    if (type == PHYLIB_STILL_BALL || type == PHYLIB_ROLLING_BALL) {
+      count++;
+    }
+  }
+  return count;
+}
+
+/* Return the number of frames from start up to (but not including) end */
+int phylib_frame_count(double start, double end, double step) {
+  if (step <= 0 || end <= start) return 0;
+  return (int)floor((end - start) / step);
+}
+
+/* Pack a ball into PHYLIB_FRAME_FIELDS doubles of buffer and return the end of them */
+double *phylib_pack_ball(phylib_object *object, double *buffer) {
+  if (object->type == PHYLIB_ROLLING_BALL) {
+    *buffer++ = PHYLIB_ROLLING_BALL;
+    *buffer++ = object->obj.rolling_ball.number;
+    *buffer++ = object->obj.rolling_ball.pos.x;
+    *buffer++ = object->obj.rolling_ball.pos.y;
+    *buffer++ = object->obj.rolling_ball.vel.x;
+    *buffer++ = object->obj.rolling_ball.vel.y;
+  } else {
+    *buffer++ = PHYLIB_STILL_BALL;
+    *buffer++ = object->obj.still_ball.number;
+    *buffer++ = object->obj.still_ball.pos.x;
+    *buffer++ = object->obj.still_ball.pos.y;
+    *buffer++ = 0.0;
+    *buffer++ = 0.0;
+  }
+  return buffer;
+}
+
+/* Roll the table by time and pack its balls into buffer, return the end of them */
+double *phylib_frame(phylib_table *table, double time, double *buffer) {
+  for (int k = 0; k < table->count; k++) {
+    phylib_object *object = table->object[table->index[k]];
+
+    if (object->type == PHYLIB_ROLLING_BALL) {
+      phylib_object ball = *object;
+      phylib_roll(&ball, object, time);
+      buffer = phylib_pack_ball(&ball, buffer);
+    } else if (object->type == PHYLIB_STILL_BALL) {
+      buffer = phylib_pack_ball(object, buffer);
+    }
+  }
+  return buffer;
+}
+
+/* Roll the table to every frame time and pack its balls into buffer, return the number of frames */
+int phylib_frames(phylib_table *table, double start, double end, double step, double *buffer) {
+  int count = phylib_frame_count(start, end, step);
+
+  for (int k = 0; k < count; k++) {
+    buffer = phylib_frame(table, (start - table->time) + k * step, buffer);
+  }
+
+  return count;
+}
+
+/* Pack the balls of the table as they are into buffer, return the number of balls */
+int phylib_state(phylib_table *table, double *buffer) {
+  int count = 0;
+  for (int k = 0; k < table->count; k++) {
+    phylib_object *object = table->object[table->index[k]];
+    if (object->type == PHYLIB_STILL_BALL || object->type == PHYLIB_ROLLING_BALL) {
+      buffer = phylib_pack_ball(object, buffer);
+      count++;
+    }
+  }
+  return count;
+}
+
+/* Set the still cue ball of a contiguous table rolling, return 0 if there is no cue ball */
+unsigned char phylib_soa_strike(phylib_soa_table *t, double xvel, double yvel) {
+  for (int i = 0; i < PHYLIB_MAX_OBJECTS; i++) {
+    if ((t->alive >> i & 1) && t->type[i] == PHYLIB_STILL_BALL && t->number[i] == 0) {
+      double speed = phylib_length((phylib_coord){xvel, yvel});
+      t->type[i] = PHYLIB_ROLLING_BALL;
+      t->vel_x[i] = xvel;
+      t->vel_y[i] = yvel;
+      // Same acceleration as strike in Physics.py
+      t->acc_x[i] = speed > PHYLIB_VEL_EPSILON ? -xvel / speed * PHYLIB_DRAG : 0;
+      t->acc_y[i] = speed > PHYLIB_VEL_EPSILON ? -yvel / speed * PHYLIB_DRAG : 0;
+      return 1;
+    }
+  }
+  return 0;
+}
+
+/* Strike the cue ball and run a contiguous table to rest in place, the shot is summarized in result */
+void phylib_soa_shoot(phylib_soa_table *t, double xvel, double yvel, int max_segments, phylib_shot_result *result) {
+  phylib_soa_table next;
+  double start = t->time;
+
+  result->segments = 0;
+  result->sunk_count = 0;
+  if (phylib_soa_strike(t, xvel, yvel)) {
+    while (phylib_soa_segment(&next, t)) {
+      phylib_soa_copy(t, &next);
+      if (next.event.hit == PHYLIB_HOLE) {
+        result->sunk[result->sunk_count++] = next.event.ball;
+      }
+      if (++result->segments > max_segments) {
+        result->segments = -1;
+        break;
+      }
+    }
+  }
+  result->time = t->time - start;
+}
+
+/* Shoot count independent contiguous tables in place with velocities[2*k], velocities[2*k+1] */
+void phylib_batch(phylib_soa_table *tables, const double *velocities, int count, int max_segments, phylib_shot_result *results) {
+  // Every shot owns its table and result, so the shots can run on any number of threads
+#ifdef _OPENMP
+  #pragma omp parallel for schedule(dynamic)
+#endif
+  for (int k = 0; k < count; k++) {
+    phylib_soa_shoot(&tables[k], velocities[2 * k], velocities[2 * k + 1], max_segments, &results[k]);
+  }
+}
+
+unsigned char phylib_counting = 0;
+phylib_counters phylib_counts; // Counted atomically, shots run on several threads at once (see phylib_batch)
+
+// Relaxed atomic add, only the totals matter
+#define PHYLIB_COUNT(counter, value) __atomic_fetch_add(&(counter), (value), __ATOMIC_RELAXED)
+
+/* Count a segment of steps steps that ended by hitting an object of type hit, PHYLIB_STOPPED or PHYLIB_NO_EVENT */
+void phylib_count_segment(unsigned long steps, int hit) {
+  if (!phylib_counting) return;
+  PHYLIB_COUNT(phylib_counts.segments, 1);
+  PHYLIB_COUNT(phylib_counts.steps, steps);
+  if (hit == PHYLIB_STOPPED) {
+    PHYLIB_COUNT(phylib_counts.stops, 1);
+  } else if (hit >= 0) {
+    PHYLIB_COUNT(phylib_counts.collisions[hit], 1);
+  }
+}
+
+/* Copy the counts into dest and start counting from zero */
+void phylib_take_counters(phylib_counters *dest) {
+  *dest = phylib_counts;
+  memset(&phylib_counts, 0, sizeof(phylib_counters));
+}
+
+/* realloc that counts the block in phylib_counts.allocations, ptr is NULL for a new block */
+void *phylib_alloc(void *ptr, size_t size) {
+  if (phylib_counting) PHYLIB_COUNT(phylib_counts.allocations, 1);
+  return realloc(ptr, size);
+}
+
+/* Run a struck table to rest, at most max_segments segments, and return every table after a segment */
+phylib_shot *phylib_shoot(phylib_table *table, phylib_engine engine, int max_segments) {
+  if (table == NULL) return NULL;
+  phylib_index(table);
+  phylib_shot *shot = phylib_alloc(NULL, sizeof(phylib_shot));
+  if (shot == NULL) return NULL; // malloc failed
+  *shot = (phylib_shot){0, 0, NULL};
+
+  phylib_table *current = table;
+  while (shot->count < max_segments) {
+    phylib_table *next = phylib_segment_engine(current, engine);
+    if (next == NULL) break; // Every ball stopped
+    if (shot->count == shot->size) {
+      int size = shot->size ? 2 * shot->size : 64;
+      phylib_table **tables = phylib_alloc(shot->table, size * sizeof(phylib_table *));
+      if (tables == NULL) { // realloc failed
+        phylib_free_table(next);
+        phylib_free_shot(shot);
+        return NULL;
+      }
+      shot->table = tables;
+      shot->size = size;
+    }
+    shot->table[shot->count++] = next;
+    current = next;
+  }
+
+  return shot;
+}
+
+/* Free a shot and the tables it still holds, a caller that keeps a table sets its entry to NULL */
+void phylib_free_shot(phylib_shot *shot) {
+  if (shot == NULL) return;
+  for (int k = 0; k < shot->count; k++) {
+    if (shot->table[k] != NULL) phylib_free_table(shot->table[k]);
+  }
+  free(shot->table);
+  free(shot);
 }
 
 // Helper functions
@@ -1,3 +1,5 @@
+#include <stddef.h>
+
 
 #define PHYLIB_BALL_RADIUS (28.5) // mm
 #define PHYLIB_BALL_DIAMETER (2*PHYLIB_BALL_RADIUS)
@@ -9,6 +11,12 @@
 #define PHYLIB_DRAG (150.0) // mm/s^2
 #define PHYLIB_MAX_TIME (600) // s
 #define PHYLIB_MAX_OBJECTS (26)
+#define PHYLIB_ROOT_EPSILON (1e-12) // s
+#define PHYLIB_MAX_DEGREE (4)
+#define PHYLIB_GRID_SIZE (2*PHYLIB_BALL_DIAMETER) // mm
+#define PHYLIB_FRAME_FIELDS (6) // type, number, pos.x, pos.y, vel.x, vel.y
+#define PHYLIB_STOPPED (-1) // hit of phylib_count_segment when a ball stopped
+#define PHYLIB_NO_EVENT (-2) // hit of phylib_count_segment when the segment reached PHYLIB_MAX_TIME
 
 typedef enum {
   PHYLIB_STILL_BALL = 0,
@@ -18,6 +26,12 @@ typedef enum {
   PHYLIB_VCUSHION = 4,
 } phylib_obj;
 
+typedef enum {
+  PHYLIB_STEP_ENGINE = 0,
+  PHYLIB_EVENT_ENGINE = 1,
+  PHYLIB_SOA_ENGINE = 2,
+} phylib_engine;
+
 typedef struct {
   double x;
   double y;
@@ -60,11 +74,70 @@ typedef struct {
   phylib_untyped obj;
 } phylib_object;
 
+typedef struct {
+  int hit; // phylib_obj of the object hit, PHYLIB_STOPPED or PHYLIB_NO_EVENT
+  int ball; // number of the rolling ball that stopped or hit, -1 without an event
+  int other; // number of the ball hit, -1 when the object hit is not a ball
+} phylib_event;
+
 typedef struct {
   double time;
-  phylib_object *object[PHYLIB_MAX_OBJECTS];
+  phylib_object *object[PHYLIB_MAX_OBJECTS]; // NULL or &slot[i], the table owns its objects
+  phylib_event event; // event that ended the segment that made this table, at its time
+  unsigned long steps; // PHYLIB_SIM_RATE steps evaluated by the segment that made this table
+  int count; // occupied slots, listed in index
+  int rolling_count; // slots holding a rolling ball, listed in rolling
+  int index[PHYLIB_MAX_OBJECTS]; // occupied slots in increasing order, see phylib_index
+  int rolling[PHYLIB_MAX_OBJECTS]; // slots holding a rolling ball in increasing order
+  phylib_object slot[PHYLIB_MAX_OBJECTS]; // storage of the objects, allocated and freed with the table
 } phylib_table;
 
+typedef struct {
+  int columns;
+  int rows;
+  int count; // number of object slots covered by the grid
+  int *head; // first ball in each cell, -1 when empty
+  int *next; // next ball in the same cell, -1 at the end
+  int *cell; // cell of each ball, -1 when not binned
+  int *static_start; // holes and cushions that can touch cell c are
+  int *static_index; // static_index[static_start[c]..static_start[c+1]-1]
+} phylib_grid;
+
+typedef struct {
+  double time;
+  double pos_x[PHYLIB_MAX_OBJECTS]; // also the x of a vcushion
+  double pos_y[PHYLIB_MAX_OBJECTS]; // also the y of an hcushion
+  double vel_x[PHYLIB_MAX_OBJECTS];
+  double vel_y[PHYLIB_MAX_OBJECTS];
+  double acc_x[PHYLIB_MAX_OBJECTS];
+  double acc_y[PHYLIB_MAX_OBJECTS];
+  unsigned char type[PHYLIB_MAX_OBJECTS];
+  unsigned char number[PHYLIB_MAX_OBJECTS];
+  unsigned long alive; // bit i is set when slot i holds an object
+  phylib_event event;
+} phylib_soa_table;
+
+typedef struct {
+  unsigned long segments;
+  unsigned long steps; // PHYLIB_SIM_RATE steps evaluated by the step and SOA engines
+  unsigned long stops; // segments that ended with a ball stopping
+  unsigned long collisions[5]; // segments that ended with a collision, by phylib_obj of the object hit
+  unsigned long allocations; // blocks allocated by phylib_alloc
+} phylib_counters;
+
+typedef struct {
+  double time; // seconds from the strike until every ball stopped
+  int segments; // -1 when the shot did not stop within the segment limit
+  int sunk_count; // balls sunk, listed in sunk
+  unsigned char sunk[PHYLIB_MAX_OBJECTS]; // numbers of the balls sunk, in the order they fell
+} phylib_shot_result;
+
+typedef struct {
+  int count; // segments run, the shot did not stop when it reaches max_segments
+  int size;
+  phylib_table **table; // table[k] is the table after segment k, its event ended the segment
+} phylib_shot;
+
 // Part 1
 phylib_object *phylib_new_still_ball(unsigned char number, phylib_coord *pos);
 phylib_object *phylib_new_rolling_ball(unsigned char number, phylib_coord *pos, phylib_coord *vel, phylib_coord *acc);
@@ -76,8 +149,10 @@ phylib_table *phylib_new_table(void);
 // Part 2
 void phylib_copy_object(phylib_object **dest, phylib_object **src);
 phylib_table *phylib_copy_table(phylib_table *table);
+phylib_object *phylib_put_object(phylib_table *table, phylib_object *object);
 void phylib_add_object(phylib_table *table, phylib_object *object);
 void phylib_free_table(phylib_table *table);
+void phylib_index(phylib_table *table);
 phylib_coord phylib_sub(phylib_coord c1, phylib_coord c2);
 double phylib_length(phylib_coord c);
 double phylib_dot_product(phylib_coord a, phylib_coord b);
@@ -88,8 +163,68 @@ void phylib_roll(phylib_object *new, phylib_object *old, double time);
 unsigned char phylib_stopped(phylib_object *object);
 void phylib_bounce(phylib_object **a, phylib_object **b);
 unsigned char phylib_rolling(phylib_table *t);
+int phylib_number(phylib_object *object);
+int phylib_still_slot(phylib_table *t, int number);
+void phylib_end_segment(phylib_event *event, unsigned long steps, int hit, int ball, int other);
+int phylib_safe_steps(phylib_table *t);
 phylib_table *phylib_segment(phylib_table *table);
 
+// Part 4
+double phylib_poly_eval(const double *c, int degree, double t);
+double phylib_poly_bisect(const double *c, int degree, double a, double b);
+int phylib_poly_roots(const double *c, int degree, double lo, double hi, double *roots);
+double phylib_contact_time(const double *c, int degree, double lo, double hi);
+double phylib_stop_time(phylib_object *object);
+double phylib_collision_time(phylib_object *obj1, phylib_object *obj2, double hi);
+phylib_table *phylib_segment_event(phylib_table *table);
+phylib_table *phylib_segment_engine(phylib_table *table, phylib_engine engine);
+
+// Part 5
+phylib_grid *phylib_new_grid(phylib_object **objects, int count, double width, double length);
+void phylib_free_grid(phylib_grid *grid);
+int phylib_grid_cell(phylib_grid *grid, phylib_coord pos);
+unsigned char phylib_grid_reach(phylib_grid *grid, phylib_object *object, int *first, int *last);
+unsigned char phylib_grid_touches(phylib_grid *grid, phylib_object *object, int cell);
+void phylib_grid_insert(phylib_grid *grid, phylib_object **objects);
+void phylib_grid_move(phylib_grid *grid, phylib_object **objects, int i);
+int phylib_grid_collision(phylib_grid *grid, phylib_object **objects, int i);
+
+// Part 6
+void phylib_table_to_soa(phylib_soa_table *dest, phylib_table *src);
+phylib_table *phylib_soa_to_table(phylib_soa_table *src);
+void phylib_soa_copy(phylib_soa_table *dest, phylib_soa_table *src);
+unsigned char phylib_soa_rolling(phylib_soa_table *t);
+void phylib_soa_roll(phylib_soa_table *new, phylib_soa_table *old, double time);
+unsigned char phylib_soa_stopped(phylib_soa_table *t, int i);
+void phylib_soa_distances(phylib_soa_table *t, int i, double *distance);
+void phylib_soa_bounce(phylib_soa_table *t, int a, int b);
+unsigned char phylib_soa_segment(phylib_soa_table *result, phylib_soa_table *table);
+phylib_table *phylib_segment_soa(phylib_table *table);
+
+// Part 7
+unsigned char phylib_balls(phylib_table *t);
+int phylib_frame_count(double start, double end, double step);
+double *phylib_pack_ball(phylib_object *object, double *buffer);
+double *phylib_frame(phylib_table *table, double time, double *buffer);
+int phylib_frames(phylib_table *table, double start, double end, double step, double *buffer);
+int phylib_state(phylib_table *table, double *buffer);
+
+// Part 8
+unsigned char phylib_soa_strike(phylib_soa_table *t, double xvel, double yvel);
+void phylib_soa_shoot(phylib_soa_table *t, double xvel, double yvel, int max_segments, phylib_shot_result *result);
+void phylib_batch(phylib_soa_table *tables, const double *velocities, int count, int max_segments, phylib_shot_result *results);
+
+// Part 9
+extern unsigned char phylib_counting; // counters are only updated when set
+extern phylib_counters phylib_counts;
+void phylib_count_segment(unsigned long steps, int hit);
+void phylib_take_counters(phylib_counters *dest);
+void *phylib_alloc(void *ptr, size_t size);
+
+// Part 10
+phylib_shot *phylib_shoot(phylib_table *table, phylib_engine engine, int max_segments);
+void phylib_free_shot(phylib_shot *shot);
+
 // Helper functions
 char *phylib_object_string(phylib_object *object);
 void phylib_print_table(phylib_table *table);
@@ -12,6 +12,42 @@
   #include "phylib.h"
 %}
 
+/******************************************************************************/
+/* the compute heavy functions only touch the tables and objects passed to    */
+/* them, so they release the GIL and let other Python threads run meanwhile   */
+/******************************************************************************/
+
+%define PHYLIB_RELEASE_GIL(function)
+%exception function {
+  Py_BEGIN_ALLOW_THREADS
+  $action
+  Py_END_ALLOW_THREADS
+}
+%enddef
+
+PHYLIB_RELEASE_GIL(phylib_roll)
+PHYLIB_RELEASE_GIL(phylib_copy_table)
+PHYLIB_RELEASE_GIL(phylib_segment)
+PHYLIB_RELEASE_GIL(phylib_segment_event)
+PHYLIB_RELEASE_GIL(phylib_segment_soa)
+PHYLIB_RELEASE_GIL(phylib_segment_engine)
+PHYLIB_RELEASE_GIL(phylib_shoot)
+
+/******************************************************************************/
+/* functions returning a new table hand it to Python, which frees it with     */
+/* ~phylib_table once the last reference is gone                              */
+/******************************************************************************/
+
+%newobject phylib_new_table;
+%newobject phylib_copy_table;
+%newobject phylib_segment;
+%newobject phylib_segment_event;
+%newobject phylib_segment_soa;
+%newobject phylib_segment_engine;
+%newobject phylib_soa_to_table;
+%newobject phylib_table::copy;
+%newobject phylib_table::segment;
+
 /******************************************************************************/
 
 %include "phylib.h"
@@ -119,7 +155,11 @@
 
   phylib_table *copy()
   {
-    phylib_table *ptr = phylib_copy_table( $self );
+    phylib_table *ptr;
+
+    Py_BEGIN_ALLOW_THREADS
+    ptr = phylib_copy_table( $self );
+    Py_END_ALLOW_THREADS
     if (!ptr)
     {
       PyErr_SetString( PyExc_ValueError, "malloc error" );
@@ -130,9 +170,136 @@
 
   /****************************************************************************/
 
-  phylib_table *segment()
+  /* releases the GIL while the segment is computed (see PHYLIB_RELEASE_GIL) */
+  phylib_table *segment( phylib_engine engine=PHYLIB_STEP_ENGINE )
   {
-    return phylib_segment( $self );
+    phylib_table *ptr;
+
+    Py_BEGIN_ALLOW_THREADS
+    ptr = phylib_segment_engine( $self, engine );
+    Py_END_ALLOW_THREADS
+    return ptr;
+  }
+
+  /****************************************************************************/
+
+  /* runs the struck table to rest in one call to phylib_shoot, at most       */
+  /* max_segments segments, and returns (tables, events) where tables lists   */
+  /* the new phylib_table after each segment and events the (time, hit, ball, */
+  /* other) of the event that ended it, other is None unless a ball was hit   */
+  PyObject *shoot( phylib_engine engine, int max_segments )
+  {
+    phylib_shot *shot;
+    PyObject *tables;
+    PyObject *events;
+
+    Py_BEGIN_ALLOW_THREADS
+    shot = phylib_shoot( $self, engine, max_segments );
+    Py_END_ALLOW_THREADS
+    if (!shot)
+    {
+      PyErr_SetString( PyExc_ValueError, "malloc error" );
+      return NULL;
+    }
+
+    tables = PyList_New( shot->count );
+    events = PyList_New( shot->count );
+    for (int k = 0; tables && events && k < shot->count; k++)
+    {
+      phylib_event *event = &shot->table[k]->event;
+      PyObject *ball = event->ball >= 0 ? PyLong_FromLong( event->ball ) : Py_None;
+      PyObject *other = event->other >= 0 ? PyLong_FromLong( event->other ) : Py_None;
+      PyObject *item = ball && other ? Py_BuildValue( "(diOO)", shot->table[k]->time, event->hit, ball, other ) : NULL;
+
+      if (ball != Py_None)
+      {
+        Py_XDECREF( ball );
+      }
+      if (other != Py_None)
+      {
+        Py_XDECREF( other );
+      }
+      if (!item)
+      {
+        Py_CLEAR( tables );
+        break;
+      }
+      PyList_SET_ITEM( events, k, item );
+      /* the Python object owns the table from here on */
+      PyList_SET_ITEM( tables, k, SWIG_NewPointerObj( shot->table[k], SWIGTYPE_p_phylib_table, SWIG_POINTER_OWN ) );
+      shot->table[k] = NULL;
+    }
+    phylib_free_shot( shot );
+    if (!tables || !events)
+    {
+      Py_XDECREF( tables );
+      Py_XDECREF( events );
+      return NULL;
+    }
+    return Py_BuildValue( "(NN)", tables, events );
+  }
+
+  /****************************************************************************/
+
+  /* rolls the table to every frame in [start, end) and returns a memoryview */
+  /* of bytes holding PHYLIB_FRAME_FIELDS doubles per ball per frame          */
+  PyObject *frames( double start, double end, double step )
+  {
+    Py_ssize_t size = (Py_ssize_t)phylib_frame_count( start, end, step ) *
+                      phylib_balls( $self ) * PHYLIB_FRAME_FIELDS * sizeof( double );
+    PyObject *buffer = PyByteArray_FromStringAndSize( NULL, size );
+    PyObject *view;
+
+    if (!buffer)
+    {
+      return NULL;
+    }
+    Py_BEGIN_ALLOW_THREADS
+    phylib_frames( $self, start, end, step, (double *)PyByteArray_AS_STRING( buffer ) );
+    Py_END_ALLOW_THREADS
+    view = PyMemoryView_FromObject( buffer );
+    Py_DECREF( buffer );
+    return view;
+  }
+
+  /****************************************************************************/
+
+  /* rolls the table by time and packs its balls into a read-only memoryview */
+  /* of bytes, laid out like one frame of frames                             */
+  PyObject *frame( double time )
+  {
+    Py_ssize_t size = (Py_ssize_t)phylib_balls( $self ) * PHYLIB_FRAME_FIELDS * sizeof( double );
+    PyObject *buffer = PyBytes_FromStringAndSize( NULL, size );
+    PyObject *view;
+
+    if (!buffer)
+    {
+      return NULL;
+    }
+    phylib_frame( $self, time, (double *)PyBytes_AS_STRING( buffer ) );
+    view = PyMemoryView_FromObject( buffer );
+    Py_DECREF( buffer );
+    return view;
+  }
+
+  /****************************************************************************/
+
+  /* packs the balls of the table into a read-only memoryview of bytes with   */
+  /* PHYLIB_FRAME_FIELDS doubles per ball, laid out like one frame of frames  */
+  PyObject *state()
+  {
+    Py_ssize_t size = (Py_ssize_t)phylib_balls( $self ) * PHYLIB_FRAME_FIELDS * sizeof( double );
+    PyObject *buffer = PyBytes_FromStringAndSize( NULL, size );
+    PyObject *view;
+
+    if (!buffer)
+    {
+      return NULL;
+    }
+    phylib_state( $self, (double *)PyBytes_AS_STRING( buffer ) );
+    view = PyMemoryView_FromObject( buffer );
+    Py_DECREF( buffer );
+    return view;
   }
 
   /****************************************************************************/
@@ -150,12 +317,38 @@
 
   /****************************************************************************/
 
-  void add_object( phylib_object *object1 )
+  /* returns a tuple of the occupied slots in increasing order */
+  PyObject *slots()
+  {
+    PyObject *slots = PyTuple_New( $self->count );
+
+    for (int k = 0; slots && k < $self->count; k++)
+    {
+      PyTuple_SET_ITEM( slots, k, PyLong_FromLong( $self->index[k] ) );
+    }
+    return slots;
+  }
+
+  /****************************************************************************/
+
+  /* returns a tuple of the slots holding a rolling ball in increasing order */
+  PyObject *rolling_slots()
   {
-    phylib_object *ptr;
+    PyObject *slots = PyTuple_New( $self->rolling_count );
+
+    for (int k = 0; slots && k < $self->rolling_count; k++)
+    {
+      PyTuple_SET_ITEM( slots, k, PyLong_FromLong( $self->rolling[k] ) );
+    }
+    return slots;
+  }
 
-    phylib_copy_object( &ptr, &object1 );
-    phylib_add_object( self, ptr );
+  /****************************************************************************/
+
+  /* copies the object into a slot of the table, the caller keeps object1 */
+  void add_object( phylib_object *object1 )
+  {
+    phylib_put_object( self, object1 );
   }
 
   /****************************************************************************/
@@ -166,3 +359,203 @@
     phylib_free_table( $self );
   }
 };
+
+/******************************************************************************/
+/* this creates a phylib_soa_table class, a contiguous copy of a phylib_table */
+/******************************************************************************/
+
+%newobject phylib_soa_table::table;
+
+%extend phylib_soa_table {
+
+  /* constructor method that converts a phylib_table */
+  phylib_soa_table( phylib_table *table )
+  {
+    phylib_soa_table *new;
+    new = malloc( sizeof( phylib_soa_table ) );
+    if (!new)
+    {
+      PyErr_SetString( PyExc_ValueError, "malloc error" );
+      return NULL;
+    }
+    phylib_table_to_soa( new, table );
+    return new;
+  }
+
+  /* converts back into a new phylib_table */
+  phylib_table *table()
+  {
+    phylib_table *ptr = phylib_soa_to_table( $self );
+    if (!ptr)
+    {
+      PyErr_SetString( PyExc_ValueError, "malloc error" );
+      return NULL;
+    }
+    return ptr;
+  }
+
+  /* destructor method */
+  ~phylib_soa_table()
+  {
+    free( $self );
+  }
+};
+
+/******************************************************************************/
+/* runs many independent shots in one call to phylib_batch                    */
+/******************************************************************************/
+
+%inline %{
+
+  /* tables is a sequence of phylib_tables (left untouched) and velocities a  */
+  /* sequence of (xvel, yvel) of the same length, returns a list holding the */
+  /* (time, segments, sunk, balls) of each shot, where sunk lists the balls  */
+  /* sunk in the order they fell and balls lists the final balls as the     */
+  /* (type, number, x, y, xvel, yvel) tuples of Table.balls in Physics.py    */
+  PyObject *phylib_shoot_batch( PyObject *tables, PyObject *velocities, int max_segments )
+  {
+    PyObject *table_seq = PySequence_Fast( tables, "tables must be a sequence" );
+    PyObject *velocity_seq = NULL;
+    PyObject *list = NULL;
+    phylib_soa_table *soa = NULL;
+    phylib_shot_result *results = NULL;
+    double *vel = NULL;
+    Py_ssize_t count;
+
+    if (!table_seq)
+    {
+      return NULL;
+    }
+    velocity_seq = PySequence_Fast( velocities, "velocities must be a sequence" );
+    if (!velocity_seq)
+    {
+      goto done;
+    }
+    count = PySequence_Fast_GET_SIZE( table_seq );
+    if (PySequence_Fast_GET_SIZE( velocity_seq ) != count)
+    {
+      PyErr_SetString( PyExc_ValueError, "tables and velocities differ in length" );
+      goto done;
+    }
+
+    soa = malloc( (count ? count : 1) * sizeof( phylib_soa_table ) );
+    results = malloc( (count ? count : 1) * sizeof( phylib_shot_result ) );
+    vel = malloc( (count ? count : 1) * 2 * sizeof( double ) );
+    if (!soa || !results || !vel)
+    {
+      PyErr_SetString( PyExc_ValueError, "malloc error" );
+      goto done;
+    }
+
+    for (Py_ssize_t k = 0; k < count; k++)
+    {
+      void *table;
+      if (!SWIG_IsOK( SWIG_ConvertPtr( PySequence_Fast_GET_ITEM( table_seq, k ), &table,
+                                       SWIGTYPE_p_phylib_table, 0 ) ))
+      {
+        PyErr_SetString( PyExc_TypeError, "tables must hold phylib_tables" );
+        goto done;
+      }
+      phylib_table_to_soa( &soa[k], (phylib_table *)table );
+      if (!PyArg_ParseTuple( PySequence_Fast_GET_ITEM( velocity_seq, k ), "dd",
+                             &vel[2 * k], &vel[2 * k + 1] ))
+      {
+        goto done;
+      }
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    phylib_batch( soa, vel, (int)count, max_segments, results );
+    Py_END_ALLOW_THREADS
+
+    list = PyList_New( count );
+    for (Py_ssize_t k = 0; list && k < count; k++)
+    {
+      PyObject *balls = PyList_New( 0 );
+      PyObject *sunk = PyList_New( results[k].sunk_count );
+      PyObject *shot;
+
+      for (int n = 0; sunk && n < results[k].sunk_count; n++)
+      {
+        PyObject *number = PyLong_FromLong( results[k].sunk[n] );
+        if (!number)
+        {
+          Py_CLEAR( sunk );
+          break;
+        }
+        PyList_SET_ITEM( sunk, n, number );
+      }
+
+      for (int i = 0; balls && i < PHYLIB_MAX_OBJECTS; i++)
+      {
+        PyObject *ball;
+        if (!(soa[k].alive >> i & 1) || soa[k].type[i] > PHYLIB_ROLLING_BALL)
+        {
+          continue;
+        }
+        ball = Py_BuildValue( "(iidddd)", soa[k].type[i], soa[k].number[i],
+                              soa[k].pos_x[i], soa[k].pos_y[i],
+                              soa[k].vel_x[i], soa[k].vel_y[i] );
+        if (!ball || PyList_Append( balls, ball ) < 0)
+        {
+          Py_CLEAR( balls );
+        }
+        Py_XDECREF( ball );
+      }
+      shot = balls && sunk ? Py_BuildValue( "(diOO)", results[k].time, results[k].segments,
+                                            sunk, balls ) : NULL;
+      Py_XDECREF( sunk );
+      Py_XDECREF( balls );
+      if (!shot)
+      {
+        Py_CLEAR( list );
+        break;
+      }
+      PyList_SET_ITEM( list, k, shot );
+    }
+
+  done:
+    free( soa );
+    free( results );
+    free( vel );
+    Py_XDECREF( velocity_seq );
+    Py_DECREF( table_seq );
+    return list;
+  }
+%}
+
+/******************************************************************************/
+/* reads the counters of phylib_count_segment (set phylib.cvar.phylib_counting */
+/* to count)                                                                   */
+/******************************************************************************/
+
+%inline %{
+
+  /* returns the counts since the last call as a dict, collisions maps the */
+  /* type of the object hit to its count                                    */
+  PyObject *phylib_take_counts( void )
+  {
+    static const char *names[] = { "still_ball", "rolling_ball", "hole", "hcushion", "vcushion" };
+    phylib_counters counts;
+    PyObject *collisions;
+
+    phylib_take_counters( &counts );
+    collisions = PyDict_New();
+    for (int i = 0; collisions && i < 5; i++)
+    {
+      PyObject *count = PyLong_FromUnsignedLong( counts.collisions[i] );
+      if (!count || PyDict_SetItemString( collisions, names[i], count ) < 0)
+      {
+        Py_CLEAR( collisions );
+      }
+      Py_XDECREF( count );
+    }
+    if (!collisions)
+    {
+      return NULL;
+    }
+    return Py_BuildValue( "{sksksksksN}", "segments", counts.segments, "steps", counts.steps,
+                          "stops", counts.stops, "allocations", counts.allocations,
+                          "collisions", collisions );
+  }
+%}
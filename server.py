@@ -1,113 +1,179 @@
 import os
 import sys
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from http.cookies import SimpleCookie
 from urllib.parse import urlparse
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import threading
+import queue
+import secrets
+import signal
 import json
 import random
 
 # For physics
 from Physics import *
+import ShotSearch
+import Metrics
 
-# Reset DB every time server starts
-Database(reset=True).close()
+# Games are kept across restarts and can be resumed from their snapshots
+db = Database()
+db.createDB()
+db.close()
 
 # Hardcoded values
 TABLE_NAME = "table.svg"
 EMPTY_NAME = "empty.svg"
 FOLDER = "frontend"
+ANIMATION_PATH = "/api/table/animation"
+STREAM_PATH = "/api/table/stream"
+SUGGEST_PATH = "/api/table/suggest"
+METRICS_PATH = "/metrics"
+SESSION_COOKIE = "session"
+MAX_SESSIONS = 64 # Oldest games are dropped from memory past this, they resume from their snapshot
+POLL_TIME = 1 # Seconds between checks that a shot is still running
 
-# Global variables used to make working with the server a LOT easier
-table: Table = None
-game: Game = None 
-p1 = None # P1 name
-p2 = None # P2 name
-name = None # Game name
-current_player = None # Current player
-
-def nudge():
-    return random.uniform(-1, 1)
-
-# Makes a new table with a full set of balls
-def make_new_table():
-    table = Table()
-    # Cue ball
-    pos = Coordinate(TABLE_WIDTH/2.0, TABLE_LENGTH - TABLE_WIDTH/2.0)
-    cue = StillBall(0, pos)
-    table += cue
-
-    # All balls from front to back (left to right each row)
-    # Row 1
-    pos = Coordinate(TABLE_WIDTH / 2.0 + nudge(), TABLE_WIDTH / 2.0 + nudge())
-    sb = StillBall(1, pos)
-    table += sb
-    # Row 2
-    pos = Coordinate(TABLE_WIDTH/2.0 - (BALL_DIAMETER+4.0)/2.0 + nudge(), TABLE_WIDTH/2.0 - math.sqrt(3.0)/2.0*(BALL_DIAMETER+4.0) + nudge())
-    sb = StillBall(2, pos)
-    table += sb
-    pos = Coordinate(TABLE_WIDTH/2.0 + (BALL_DIAMETER+4.0)/2.0 + nudge(), TABLE_WIDTH/2.0 - math.sqrt(3.0)/2.0*(BALL_DIAMETER+4.0) + nudge())
-    sb = StillBall(9, pos)
-    table += sb
-    # Row 3
-    pos = Coordinate(TABLE_WIDTH/2.0 - 2.0*(BALL_DIAMETER+4.0)/2.0 + nudge(), TABLE_WIDTH/2.0 - 2.0*math.sqrt(3.0)/2.0*(BALL_DIAMETER+4.0) + nudge())
-    sb = StillBall(3, pos)
-    table += sb
-    pos = Coordinate(TABLE_WIDTH/2.0 + nudge(), TABLE_WIDTH/2.0 - 2.0*math.sqrt(3.0)/2.0*(BALL_DIAMETER+4.0) + nudge())
-    sb = StillBall(8, pos)
-    table += sb
-    pos = Coordinate(TABLE_WIDTH/2.0 + 2.0*(BALL_DIAMETER+4.0)/2.0 + nudge(), TABLE_WIDTH/2.0 - 2.0*math.sqrt(3.0)/2.0*(BALL_DIAMETER+4.0) + nudge())
-    sb = StillBall(10, pos)
-    table += sb
-    # Row 4
-    pos = Coordinate(TABLE_WIDTH/2.0 - 3.0*(BALL_DIAMETER+4.0)/2.0 + nudge(), TABLE_WIDTH/2.0 - 3.0*math.sqrt(3.0)/2.0*(BALL_DIAMETER+4.0) + nudge())
-    sb = StillBall(4, pos)
-    table += sb
-    pos = Coordinate(TABLE_WIDTH/2.0 - (BALL_DIAMETER+4.0)/2.0 + nudge(), TABLE_WIDTH/2.0 - 3.0*math.sqrt(3.0)/2.0*(BALL_DIAMETER+4.0) + nudge())
-    sb = StillBall(14, pos)
-    table += sb
-    pos = Coordinate(TABLE_WIDTH/2.0 + (BALL_DIAMETER+4.0)/2.0 + nudge(), TABLE_WIDTH/2.0 - 3.0*math.sqrt(3.0)/2.0*(BALL_DIAMETER+4.0) + nudge())
-    sb = StillBall(7, pos)
-    table += sb
-    pos = Coordinate(TABLE_WIDTH/2.0 + 3.0*(BALL_DIAMETER+4.0)/2.0 + nudge(), TABLE_WIDTH/2.0 - 3.0*math.sqrt(3.0)/2.0*(BALL_DIAMETER+4.0) + nudge())
-    sb = StillBall(11, pos)
-    table += sb
-    # Row 5
-    pos = Coordinate(TABLE_WIDTH/2.0 - 4.0*(BALL_DIAMETER+4.0)/2.0 + nudge(), TABLE_WIDTH/2.0 - 4.0*math.sqrt(3.0)/2.0*(BALL_DIAMETER+4.0) + nudge())
-    sb = StillBall(12, pos)
-    table += sb
-    pos = Coordinate(TABLE_WIDTH/2.0 - 2.0*(BALL_DIAMETER+4.0)/2.0 + nudge(), TABLE_WIDTH/2.0 - 4.0*math.sqrt(3.0)/2.0*(BALL_DIAMETER+4.0) + nudge())
-    sb = StillBall(6, pos)
-    table += sb
-    pos = Coordinate(TABLE_WIDTH/2.0 + nudge(), TABLE_WIDTH/2.0 - 4.0*math.sqrt(3.0)/2.0*(BALL_DIAMETER+4.0) + nudge())
-    sb = StillBall(15, pos)
-    table += sb
-    pos = Coordinate(TABLE_WIDTH/2.0 + 2.0*(BALL_DIAMETER+4.0)/2.0 + nudge(), TABLE_WIDTH/2.0 - 4.0*math.sqrt(3.0)/2.0*(BALL_DIAMETER+4.0) + nudge())
-    sb = StillBall(13, pos)
-    table += sb
-    pos = Coordinate(TABLE_WIDTH/2.0 + 4.0*(BALL_DIAMETER+4.0)/2.0 + nudge(), TABLE_WIDTH/2.0 - 4.0*math.sqrt(3.0)/2.0*(BALL_DIAMETER+4.0) + nudge())
-    sb = StillBall(5, pos)
-    table += sb
-
-    return table
-
-def save_table(table: Table):
-    with open(f"{FOLDER}/{TABLE_NAME}", "w") as f:
-        f.write(table.svg(include_id=True))
-        f.close()
+SEARCH_WORKERS = max((os.cpu_count() or 1) // 2, 1) # Workers of search_pool
+
+# Shots are simulated in worker processes, see run_shot
+pool: ProcessPoolExecutor = None
+# Shot searches get their own workers, so a suggestion never holds up the shots of other games
+search_pool: ProcessPoolExecutor = None
+manager = None # multiprocessing.Manager for the shot event queues
+
+class Session():
+    """
+    State of one game, every browser gets its own through the session cookie.
+    The lock keeps a game to one shot at a time.
+    """
+
+    def __init__(self, game: Game, table: Table, current_player):
+        self.lock = threading.Lock()
+        self.game = game
+        self.table = table
+        self.current_player = current_player
+        self.svg = RENDERER.table(table.balls(), include_id=True) # Rendered final table, as bytes
+        self.animation = None # Encoded frames of the last shot
+
+# Games keyed by session id
+sessions = {}
+sessions_lock = threading.Lock()
+
+def ignore_interrupt():
+    # Ctrl-C reaches the pool workers too, they are stopped by pool.shutdown instead
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def save_session(session_id, session: Session):
+    with sessions_lock:
+        sessions.pop(session_id, None)
+        sessions[session_id] = session
+        while len(sessions) > MAX_SESSIONS:
+            del sessions[next(iter(sessions))]
+
+def drop_session(session_id):
+    with sessions_lock:
+        sessions.pop(session_id, None)
 
 class Handler(BaseHTTPRequestHandler):
-    def write_json(self, data):
+    def session_id(self):
+        cookie = SimpleCookie(self.headers.get("Cookie", ""))
+        return cookie[SESSION_COOKIE].value if SESSION_COOKIE in cookie else None
+
+    def session(self) -> Session:
+        session_id = self.session_id()
+        if session_id is None:
+            return None
+        with sessions_lock:
+            session = sessions.get(session_id)
+        db = Database()
+        state = db.readSessionGame(session_id)
+        db.close()
+        if state is None:
+            return session
+        gameID, version = state
+        if session is None or session.game.gameID != gameID or session.game.version != version:
+            # Resume a game dropped from memory, started before a restart or moved on by another server
+            game = Game(gameID - 1) # Game IDs are offset by one
+            session = Session(game, game.table, game.current_player)
+            save_session(session_id, session)
+        return session
+
+    def write_json(self, data, session_id=None):
         content = json.dumps(data)
         self.send_response(200)
         self.send_header("Content-Type", "application/json")
         self.send_header("Content-Length", len(content))
+        if session_id:
+            self.send_header("Set-Cookie", f"{SESSION_COOKIE}={session_id}; Path=/; SameSite=Strict")
         self.end_headers()
         self.wfile.write(bytes(content, "utf-8"))
 
+    def write_not_found(self, path):
+        self.send_response(404)
+        self.end_headers()
+        self.wfile.write(bytes("404: %s not found" % path, "utf-8"))
+
+    def start_events(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+    def write_event(self, event, data):
+        # Server-Sent Event, the response is left open until the handler returns
+        self.wfile.write(bytes(f"event: {event}\ndata: {json.dumps(data)}\n\n", "utf-8"))
+        self.wfile.flush()
+
     def do_GET(self):
         parsed = urlparse(self.path)
         path = f"./{FOLDER}{parsed.path}"
 
-        if parsed.path in ["/index.html"]:
+        if parsed.path == METRICS_PATH:
+            # Counters and stage timers of every shot so far, in the Prometheus text format
+            metrics = Metrics.process_metrics()
+            metrics.count_phylib() # Segments run in this process
+            content = metrics.prometheus()
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", len(content))
+            self.end_headers()
+            self.wfile.write(bytes(content, "utf-8"))
+        elif parsed.path == ANIMATION_PATH:
+            session = self.session()
+            if session is None or session.animation is None:
+                self.write_not_found(parsed.path)
+            else:
+                self.write_json(session.animation)
+        elif parsed.path == SUGGEST_PATH:
+            # Best shot for the player to shoot, found within ShotSearch.TIME_BUDGET
+            session = self.session()
+            if session is None or session.current_player is None:
+                self.write_not_found(parsed.path)
+                return
+            own, other = ShotSearch.player_balls(session.game, session.current_player)
+            best = ShotSearch.search(session.table, own, other, pool=search_pool)
+            if best is None:
+                self.write_json({"x": None, "y": None, "score": None})
+            else:
+                score, xvel, yvel = best
+                self.write_json({"x": xvel, "y": yvel, "score": score})
+        elif parsed.path == f"/{TABLE_NAME}":
+            # Each game's final table is kept in memory
+            session = self.session()
+            if session is None:
+                self.write_not_found(parsed.path)
+                return
+            content = session.svg
+
+            self.send_response(200)
+            self.send_header("Content-Type", "image/svg+xml")
+            self.send_header("Content-Length", len(content))
+            self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+            self.wfile.write(content)
+        elif parsed.path in ["/index.html"]:
             f = open(path)
             content = f.read()
             f.close()
@@ -120,7 +186,7 @@ class Handler(BaseHTTPRequestHandler):
 
             # Send to browser
             self.wfile.write(bytes(content, "utf-8"))
-        elif ((parsed.path.startswith("/table") and parsed.path.endswith(".svg")) or parsed.path in ["/empty.svg"]) and os.path.exists(path):
+        elif parsed.path in ["/empty.svg"] and os.path.exists(path):
             f = open(path)
             content = f.read()
             f.close()
@@ -146,79 +212,114 @@ class Handler(BaseHTTPRequestHandler):
             self.wfile.write(bytes(content, "utf-8"))
         else:
             # Raise error
-            self.send_response(404)
-            self.end_headers()
-            self.wfile.write(bytes("404: %s not found" % parsed.path, "utf-8"))
+            self.write_not_found(parsed.path)
 
 
     def do_POST(self):
-        # Use global variables
-        global table
-        global game
-        global p1, p2, name, current_player
         parsed = urlparse(self.path)
 
-        if parsed.path in ["/api/table/shoot"]:
+        if parsed.path in ["/api/table/shoot", STREAM_PATH]:
             data_string = self.rfile.read(int(self.headers['Content-Length']))
             data = json.loads(data_string)
-            
-            prev_player = current_player
-            current_player, elapsed, balls_sunk, tables = game.shoot(name, current_player, table, data["x"], data["y"])
-            table = tables[-1] # Update with the next table
-            if elapsed < 0:
-                print("Segment function failed: Aborting...")
-                self.write_json({"svg": None})
-                current_player = prev_player
+            session = self.session()
+            if session is None:
+                self.write_not_found(parsed.path)
                 return
 
-            with open(f"{FOLDER}/{TABLE_NAME}", "w") as f:
-                f.write(FULL_HEADER)
-                for i, table in enumerate(tables):
-                    f.write(table.balls_svg(i, True if i == len(tables) - 1 else False))
-                f.write(FOOTER)
-
-            
-            if current_player:
-                self.write_json({"svg": TABLE_NAME, "current": current_player, "low": game.low, "elapsed": elapsed,
-                                 "frames": [f"frame-{i}" for i in range(len(tables))], "current": current_player, "ongoing": True,
-                                 "balls": [f"ball-{num}" for num in balls_sunk]})
-            else:
-                # Decide winner
-                prev_table = tables[-2] # Get table before emptying table
-                if any(ball in game.balls[prev_player] for ball in prev_table.balls_left()):
-                    winner = game.other_player(prev_player) # 8 ball sunk early
-                else:
-                    winner = prev_player
-                self.write_json({"svg": TABLE_NAME, "current": current_player, "low": game.low, "elapsed": elapsed,
-                                 "frames": [f"frame-{i}" for i in range(len(tables))], "current": winner, "ongoing": False,
-                                 "balls": [f"ball-{num}" for num in balls_sunk]})
-            
-            # Write frames after sending result
-            db = Database()
-            shotID = db.writeShot(prev_player, game.gameID)
-            for table in tables:
-                tableID = db.writeTable(table, False)
-                db.writeTableShot(tableID + 1, shotID, False)
-            db.conn.commit()
-            db.close()
+            # Stages of the shot are timed per request, then added to the metrics of the server
+            metrics = Metrics.Metrics()
+            with session.lock, metrics.timer("request"):
+                # The game is over, checked under the lock since the shot before may have just ended it
+                if session.current_player is None:
+                    self.write_not_found(parsed.path)
+                    return
+                self.shoot(session, self.session_id(), data["x"], data["y"], parsed.path == STREAM_PATH, metrics)
+            metrics.count("shots")
+            if Metrics.LOG:
+                print(f"Shot {parsed.path}: {metrics.summary()}")
+            Metrics.process_metrics().merge(metrics.drain())
         elif parsed.path in ["/api/table/new"]:
             data_string = self.rfile.read(int(self.headers['Content-Length']))
             data = json.loads(data_string)
 
             p1 = data["p1"]
             p2 = data["p2"]
-            name = data["game"]
-            game = Game(None, name, p1, p2)
-            table = make_new_table()
-            save_table(table)
+            game = Game(None, data["game"], p1, p2)
             current_player = random.choice([p1, p2])
+            # Starting a new game replaces the old one of the same browser
+            session_id = self.session_id() or secrets.token_hex(16)
+            table = make_new_table()
+            game.save(table, current_player, session_id)
+            save_session(session_id, Session(game, table, current_player))
             data = {"svg": TABLE_NAME, "current": current_player, "low": None}
-            self.write_json(data)
+            self.write_json(data, session_id)
         else:
             # Raise error
-            self.send_response(404)
-            self.end_headers()
-            self.wfile.write(bytes("404: %s not found" % parsed.path, "utf-8"))
+            self.write_not_found(parsed.path)
+
+    def shoot(self, session: Session, session_id, xvel, yvel, stream, metrics: Metrics.Metrics):
+        # Streaming sends each segment's frames while later segments are computed
+        write_result = (lambda result: self.write_event("result", result)) if stream else self.write_json
+        if stream:
+            self.start_events()
+
+        game = session.game
+        prev_player = session.current_player
+        events = manager.Queue()
+        shot = pool.submit(run_shot, session.table.balls(), session.table.time, xvel, yvel,
+                           events, prev_player, game.gameID)
+        frames = []
+        while True:
+            try:
+                event, payload = events.get(timeout=POLL_TIME)
+            except queue.Empty:
+                if shot.done():
+                    shot.result() # Raises the error that stopped the worker
+                continue
+            if event == "result":
+                elapsed, balls_sunk, balls, time, balls_left = payload
+                break
+            if event == "metrics":
+                metrics.merge(payload) # Stages timed by the worker
+                continue
+            frames.extend(payload)
+            if stream:
+                self.write_event("frames", payload)
+
+        if elapsed < 0:
+            print("Segment function failed: Aborting...")
+            write_result({"svg": None})
+            return
+
+        # Only the final table is rendered, the frames are sent as an encoded animation
+        session.current_player = game.next_player(prev_player, balls_sunk)
+        session.table = make_table(balls, time) # Update with the next table
+        with metrics.timer("svg"):
+            session.svg = RENDERER.table(session.table.balls(), include_id=True)
+        session.animation = {"rate": FRAME_RATE, "frames": frames}
+        with metrics.timer("snapshot"):
+            saved = game.save(session.table, session.current_player, session_id)
+        if not saved:
+            # Another server sharing the database played this game meanwhile, the next request reloads it
+            print("Game moved on by another server: Aborting...")
+            drop_session(session_id)
+            write_result({"svg": None})
+            return
+
+        if session.current_player:
+            write_result({"svg": TABLE_NAME, "current": session.current_player, "low": game.low, "elapsed": elapsed,
+                         "animation": ANIMATION_PATH[1:], "ongoing": True,
+                         "balls": [f"ball-{num}" for num in balls_sunk]})
+        else:
+            # Decide winner from the table before emptying table
+            if black_wins(game.balls[prev_player], balls_left):
+                winner = prev_player
+            else:
+                winner = game.other_player(prev_player) # 8 ball sunk early
+            write_result({"svg": TABLE_NAME, "low": game.low, "elapsed": elapsed,
+                         "animation": ANIMATION_PATH[1:], "current": winner, "ongoing": False,
+                         "balls": [f"ball-{num}" for num in balls_sunk]})
+        # The worker queues the frames for its database writer after sending the result
         
 
 if __name__ == "__main__":
@@ -228,6 +329,16 @@ if __name__ == "__main__":
         print("This file must be invoked with a single command line argument representing the server port")
         exit(1)
     # Use "0.0.0.0" for docker container and "localhost" locally
-    server = HTTPServer(("0.0.0.0", int(sys.argv[1])), Handler)
+    pool = ProcessPoolExecutor(initializer=ignore_interrupt)
+    search_pool = ProcessPoolExecutor(SEARCH_WORKERS, initializer=ignore_interrupt)
+    manager = multiprocessing.Manager()
+    server = ThreadingHTTPServer(("0.0.0.0", int(sys.argv[1])), Handler)
     print(f"Server listing on port: http://localhost:{int(sys.argv[1])}")
-    server.serve_forever()
\ No newline at end of file
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Workers flush their queued shots to the database as they exit
+        search_pool.shutdown(cancel_futures=True)
+        pool.shutdown()
\ No newline at end of file
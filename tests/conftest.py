@@ -0,0 +1,9 @@
+"""
+Fixtures shared by the tests.
+"""
+import pytest
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    # Database opens DB_NAME in the working directory, keep the real phylib.db untouched
+    monkeypatch.chdir(tmp_path)
@@ -0,0 +1,98 @@
+"""
+Differential test of the segment engines: from identical input tables,
+one segment of STEP_ENGINE and one of EVENT_ENGINE must end within one
+SIM_RATE step of each other, on the same event, with the same balls at
+positions within POS_TOLERANCE. Shots are racked breaks and single balls
+on a seeded make_new_table, each followed segment by segment to rest.
+Two events inside the same step may be taken in either order, the shot
+is followed up to such a tie, where both events must be in contact.
+Command: python -m pytest tests
+"""
+import os
+import sys
+import math
+import random
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Physics import *
+
+SHOTS          = 20 # Of each kind, with seeded directions and speeds
+TIME_TOLERANCE = phylib.PHYLIB_SIM_RATE # The stepping engine stops on the first step past the event
+POS_TOLERANCE  = 0.5 # mm, a ball at full speed covers about 0.3 mm in one step
+VEL_TOLERANCE  = 10.0 # mm/s, from bounces one step apart
+
+def struck_table(seed, single):
+    table = make_new_table(seed)
+    rng = random.Random(seed)
+    if single:
+        number = rng.randint(1, 15)
+        table = make_table([ball for ball in table.balls() if ball[1] in (CUE_NUMBER, number)])
+    angle = rng.uniform(0.0, 2 * math.pi)
+    speed = rng.uniform(200.0, 3000.0)
+    strike(table, speed * math.cos(angle), speed * math.sin(angle))
+    return table
+
+def event_gap(table, time, event):
+    """
+    Returns how far the ball of event is from touching the object it hit,
+    negative once they overlap, with the balls of table rolled to time.
+    Cushions and holes are found from the position of the ball, a ball
+    that stopped is at 0 once it is below VEL_EPSILON.
+    """
+    balls = {ball[1]: ball for ball in table.frame(time - table.time).balls()}
+    _, _, x, y, xvel, yvel = balls[event.ball]
+    if event.hit == STOPPED:
+        return (math.hypot(xvel, yvel) - VEL_EPSILON) * SIM_RATE
+    if event.hit == phylib.PHYLIB_HCUSHION:
+        return min(y, TABLE_LENGTH - y) - BALL_RADIUS
+    if event.hit == phylib.PHYLIB_VCUSHION:
+        return min(x, TABLE_WIDTH - x) - BALL_RADIUS
+    if event.hit == phylib.PHYLIB_HOLE:
+        return min(math.hypot(x - hole_x, y - hole_y) for hole_x in (0.0, TABLE_WIDTH)
+                   for hole_y in (0.0, TABLE_LENGTH / 2, TABLE_LENGTH)) - HOLE_RADIUS
+    other = balls[event.other]
+    return math.hypot(x - other[2], y - other[3]) - BALL_DIAMETER
+
+@pytest.mark.parametrize("single", [False, True], ids=["rack", "single"])
+@pytest.mark.parametrize("seed", range(SHOTS))
+def test_engines_agree(seed, single):
+    table = struck_table(seed, single)
+    for _ in range(MAX_COUNT):
+        step = table.segment(STEP_ENGINE)
+        event = table.segment(EVENT_ENGINE)
+        if step is None or event is None:
+            assert step is None and event is None
+            return
+        assert abs(step.time - event.time) <= TIME_TOLERANCE
+        if (step.event.hit, step.event.ball, step.event.other) != (event.event.hit, event.event.ball, event.event.other):
+            # A tie, both events fall in the step the stepping engine stopped on: it takes the
+            # lowest slot of the step, the event engine the earliest contact
+            assert step.time - TIME_TOLERANCE <= event.time <= step.time
+            assert abs(event_gap(table, event.time, event.event)) <= POS_TOLERANCE
+            assert abs(event_gap(table, step.time, step.event)) <= POS_TOLERANCE
+            return
+        step_balls = {ball[1]: ball for ball in step.balls()}
+        event_balls = {ball[1]: ball for ball in event.balls()}
+        assert step_balls.keys() == event_balls.keys()
+        for number, (type, _, x, y, xvel, yvel) in step_balls.items():
+            other = event_balls[number]
+            assert type == other[0]
+            assert math.hypot(x - other[2], y - other[3]) <= POS_TOLERANCE
+            assert math.hypot(xvel - other[4], yvel - other[5]) <= VEL_TOLERANCE
+        # Both engines continue from the same table
+        table = step
+    pytest.fail("shot never stopped")
+
+@pytest.mark.parametrize("gap", [5.0, 60.0, 400.0])
+@pytest.mark.parametrize("speed, acc", [(5.0, 150.0), (1.0, 800.0)])
+def test_engines_agree_speeding_up(gap, speed, acc):
+    # phylib_bounce keeps the acceleration of a ball left below VEL_EPSILON, so it can speed up
+    table = Table()
+    table += RollingBall(CUE_NUMBER, Coordinate(300.0, 1000.0), Coordinate(speed, 0.0), Coordinate(acc, 0.0))
+    table += StillBall(1, Coordinate(300.0 + BALL_DIAMETER + gap, 1000.0))
+    step = table.segment(STEP_ENGINE)
+    event = table.segment(EVENT_ENGINE)
+    assert step.event.hit == event.event.hit == phylib.PHYLIB_STILL_BALL
+    assert abs(step.time - event.time) <= TIME_TOLERANCE
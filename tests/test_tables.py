@@ -0,0 +1,55 @@
+"""
+Checks that the objects of a Table stay valid as long as they are
+referenced, after the table they live in has been dropped, and that
+segments see the changes made to a table through its objects.
+Command: python -m pytest tests
+"""
+import gc
+import os
+import sys
+import weakref
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Physics import *
+
+def struck_table():
+    table = make_new_table(RACK_SEED)
+    strike(table, 100.0, -2000.0)
+    return table
+
+def test_ball_outlives_segment():
+    segment = struck_table().segment()
+    slot = segment.rolling_slots()[0]
+    ball = segment[slot]
+    expected = (ball.type, ball.obj.rolling_ball.pos.x, ball.obj.rolling_ball.pos.y)
+    table = weakref.ref(segment)
+    del segment
+    gc.collect()
+    # Reuse the freed memory if the ball no longer holds on to its table
+    tables = [struck_table().segment() for _ in range(50)]
+    assert table() is not None
+    assert (ball.type, ball.obj.rolling_ball.pos.x, ball.obj.rolling_ball.pos.y) == expected
+
+def test_balls_outlive_shot():
+    tables, events = struck_table().shoot()
+    balls = list(tables[-1])
+    expected = [str(ball) for ball in balls]
+    del tables
+    gc.collect()
+    tables = [struck_table().shoot() for _ in range(10)]
+    assert [str(ball) for ball in balls] == expected
+
+@pytest.mark.parametrize("engine", [STEP_ENGINE, EVENT_ENGINE, SOA_ENGINE])
+def test_segment_after_type_change(engine):
+    # Python can turn a ball into a rolling one through its object, behind the index of the table
+    table = Table()
+    table += StillBall(CUE_NUMBER, Coordinate(TABLE_WIDTH / 2, TABLE_LENGTH / 2))
+    ball = table.get_cue()
+    ball.type = phylib.PHYLIB_ROLLING_BALL
+    ball.obj.rolling_ball.vel.x = 500.0
+    ball.obj.rolling_ball.acc.x = -DRAG
+    assert table.segment(engine) is not None
+    tables, events = table.shoot(engine)
+    assert tables